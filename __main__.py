@@ -1,87 +1,138 @@
-from twitter_scraper_class import TwitterScraper
-from alphavantage_scraper_class import AlphaVantageScraper
+from orchestrator_class import ScrapeOrchestrator
+from database import connect_to_db, connect_to_sqlite
+from sentiment_scorer_class import SentimentScorer
+from sentiment_backends import SENTIMENT_BACKENDS
+from bulk_writer_class import BulkWriter
+from http_client_class import HttpClient
+from cassette_class import Cassette, RecordingHttpClient, ReplayHttpClient
+from watermark_store_class import WatermarkStore
+from clock_class import FakeClock
+from metrics_class import shared_metrics
+from daemon_class import AdaptivePollInterval, ScrapeDaemon
+import create_tables
+import argparse
 import json
-import sqlalchemy
-import os
-import time
 
-from dotenv import load_dotenv
-load_dotenv()
+def main(max_workers=1, pipelined=False, sentiment_workers=1, sentiment_backend='textblob', write_batch_size=1000,
+         load_data=False, unified=False, backfill_months=0, query_info_path='query_info.json', record=None, replay=None,
+         sqlite=None, metrics_log=None, metrics_file=None, metrics_port=None, daemon=False, min_interval=120,
+         max_interval=3600, prices_per_day=450):
+    if daemon and backfill_months:
+        # Every poll would fetch the whole history again
+        raise ValueError('Run a backfill once, without --daemon')
 
-def connect_to_db():
-    '''
-    Function to connect to the database used to store results.
-    This code is run with both MySQL and MariaDB databases, which are
-    functionally the same, but require slightly different connection strings.
-    '''
-    # Getting SQL database credentials
-    mysql_user = os.getenv('MYSQL_USER')
-    mysql_pwd = os.getenv('MYSQL_PWD')
-    mysql_host = os.getenv('MYSQL_HOST')
-    mysql_db = os.getenv('MYSQL_DB')
-
-    # Setting up connection to SQL database
-    # I have set this up to handle either mariadb or mysql because I run this on two
-    # different computers which use these different SQL databases.
-    try:
-        engine_str = f'mariadb+mariadbconnector://{mysql_user}:{mysql_pwd}@{mysql_host}/{mysql_db}'
-        engine = sqlalchemy.create_engine(engine_str)
-        print('Using mariadb database')
-    except:
-        engine_str = f'mysql+pymysql://{mysql_user}:{mysql_pwd}@{mysql_host}/{mysql_db}'
-        engine = sqlalchemy.create_engine(engine_str)
-        print('Using mysql database')
-    
-    return engine
-
-def main():
     # Get our query info for each company
-    with open('query_info.json') as f:
+    with open(query_info_path) as f:
         query_info = json.load(f)
 
-    # Connect to our database
-    engine = connect_to_db()
+    # Connect to our database. This one engine (and its connection pool) is
+    # shared by every scraper, so size the pool for the number of workers.
+    # Offline runs use a SQLite database instead, whose tables are created here.
+    if sqlite is not None:
+        engine = connect_to_sqlite(None if sqlite == ':memory:' else sqlite)
+        create_tables.migrate(engine, query_info, unified=unified)
+        db_schema = 'main'
+    else:
+        engine = connect_to_db(pool_size=max(5, max_workers), max_overflow=max_workers, local_infile=load_data)
+        db_schema = 'stock_sentiment_project'
 
-    # Iterate over the companies
-    for company in query_info:
-        print(company) # Print the name of the company
-        
-        query_terms = query_info[company]['query_terms'] # Search terms
-        tweet_table = query_info[company]['tweet_table'] # Destination table
-        # Import and run our Twitter scraper
-        twitter_scraper = TwitterScraper(query_terms=query_terms, db_table=tweet_table, use_since_id=True)
-        twitter_results = twitter_scraper.run()
+    # Responses can be recorded to a cassette, or replayed from one instead of
+    # querying the APIs (see cassette_class.py). Replays run on a fake clock
+    # starting at the time of the recording, so they are deterministic and do
+    # not wait for the rate limiter. The watermarks read while recording are
+    # saved too, and seeded on replay, so the replay sends the recorded requests
+    # whatever its database holds.
+    clock = None
+    http_client = None
+    watermarks = WatermarkStore(engine)
+    if replay is not None:
+        cassette = Cassette.load(replay)
+        http_client = ReplayHttpClient(cassette)
+        clock = FakeClock(cassette.recorded_at)
+        watermarks.seed(cassette.watermarks)
+    elif record is not None:
+        http_client = RecordingHttpClient(HttpClient(pool_maxsize=max(10, max_workers)), record, watermarks=watermarks)
 
-        symbol = query_info[company]['symbol'] # Stock symbol
-        stock_table = query_info[company]['stock_table'] # Destination table
-        # Import and run our AlphaVantage scraper
-        if company in ['Bitcoin', 'Ethereum', 'Polkadot']:
-            stock_scraper = AlphaVantageScraper(db_table=stock_table, symbol=symbol, endpoint='CRYPTO_INTRADAY')
-        else:
-            stock_scraper = AlphaVantageScraper(db_table=stock_table, symbol=symbol, endpoint='TIME_SERIES_INTRADAY')
-        stock_results = stock_scraper.run()
+    # Stage timings and counts (see metrics_class.py): as JSON lines, in a
+    # Prometheus text file written after the cycle, and/or on an HTTP endpoint
+    metrics = shared_metrics()
+    metrics.log_path = metrics_log
+    if metrics_port is not None:
+        metrics.serve_prometheus(metrics_port)
 
-        # Send the Twitter results to the respective table in the db
-        twitter_results.to_sql(
-            name=tweet_table,
-            con=engine,
-            index=False,
-            if_exists='append'
-        )
+    # Scrape every company. With max_workers > 1 the companies are scraped
+    # concurrently. The scrapers share one rate limiter which keeps us within
+    # Twitter's and AlphaVantage's API limits (e.g. 5 AlphaVantage requests per minute).
+    # Sentiment scoring can use several processes for large batches (TextBlob
+    # backend) or the vectorized lexicon backend
+    sentiment_scorer = SentimentScorer(workers=sentiment_workers, backend=SENTIMENT_BACKENDS[sentiment_backend]())
 
-        # Send the stock results to the respective table in the db
-        stock_results.to_sql(
-            name=stock_table,
-            con=engine,
-            index=False,
-            if_exists='append'
-        )
+    # Results are upserted in batches, optionally with LOAD DATA for large batches
+    writer = BulkWriter(engine, batch_size=write_batch_size, use_load_data=load_data)
 
-    # AlphaVantage's API limits us to 5 requests per minute so we sleep for 21
-    # seconds between companies to ensure we don't hit this limit
-    time.sleep(21)
+    # The cleanup runs on errors and Ctrl-C too, so a recording is saved and
+    # the sentiment worker processes are shut down
+    try:
+        orchestrator = ScrapeOrchestrator(
+            query_info, engine, max_workers=max_workers, pipelined=pipelined, sentiment_scorer=sentiment_scorer,
+            writer=writer, unified=unified, backfill_months=backfill_months, db_schema=db_schema,
+            http_client=http_client, clock=clock, metrics_path=metrics_file, watermarks=watermarks
+            )
+        if daemon:
+            # Stay resident and poll the tweets and prices of each company on their
+            # own adaptive schedules, with the price polls within AlphaVantage's
+            # daily quota, until SIGTERM or SIGINT. SIGHUP (or editing the file)
+            # reloads query_info.json.
+            scrape_daemon = ScrapeDaemon(
+                orchestrator, query_info_path=query_info_path, max_workers=max_workers, clock=clock,
+                make_interval=lambda: AdaptivePollInterval(min_interval=min_interval, max_interval=max_interval),
+                prices_per_day=prices_per_day
+                )
+            scrape_daemon.install_signal_handlers()
+            scrape_daemon.run()
+        else:
+            orchestrator.run_cycle()
+    finally:
+        sentiment_scorer.close()
+        try:
+            if record is not None:
+                http_client.save()
+        finally:
+            if http_client is not None:
+                http_client.close()
 
     return 0
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Scrape Tweets and prices for every company in query_info.json.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of companies to scrape concurrently.')
+    parser.add_argument('--pipelined', action='store_true', help='Process Twitter pages while fetching the next page.')
+    parser.add_argument('--sentiment-workers', type=int, default=1, help='Number of processes used to score sentiment.')
+    parser.add_argument('--sentiment-backend', choices=sorted(SENTIMENT_BACKENDS), default='textblob', help='Sentiment backend.')
+    parser.add_argument('--write-batch-size', type=int, default=1000, help='Number of rows per INSERT.')
+    parser.add_argument('--load-data', action='store_true', help='Use LOAD DATA LOCAL INFILE for large writes (MySQL).')
+    parser.add_argument('--unified', action='store_true', help='Write to the unified tweets and prices tables (see create_tables.py).')
+    parser.add_argument('--backfill-months', type=int, default=0, help='Fetch this many months of stock price history.')
+    parser.add_argument('--query-info', default='query_info.json', help='Path of query_info.json.')
+    parser.add_argument('--record', metavar='CASSETTE', help='Record the API responses to this cassette file.')
+    parser.add_argument('--replay', metavar='CASSETTE', help='Replay the API responses of this cassette file.')
+    parser.add_argument('--sqlite', metavar='PATH', help='Use this SQLite database (or :memory:) instead of MySQL.')
+    parser.add_argument('--metrics-log', metavar='PATH', help='Append stage timings and counts to this file as JSON lines.')
+    parser.add_argument('--metrics-file', metavar='PATH', help='Write the metrics to this file in Prometheus text format.')
+    parser.add_argument('--metrics-port', type=int, help='Serve the metrics in Prometheus text format on this port.')
+    parser.add_argument('--daemon', action='store_true', help='Keep running and poll each company on an adaptive schedule.')
+    parser.add_argument('--min-interval', type=float, default=120, help='Shortest poll interval of a company in daemon mode (seconds).')
+    parser.add_argument('--max-interval', type=float, default=3600, help='Longest poll interval of a company in daemon mode (seconds).')
+    parser.add_argument('--prices-per-day', type=int, default=450, help='AlphaVantage requests per day of all price polls in daemon mode.')
+    args = parser.parse_args()
+    if args.daemon and args.backfill_months:
+        parser.error('--backfill-months is a one-time job and cannot be combined with --daemon')
+    main(
+        max_workers=args.workers, pipelined=args.pipelined,
+        sentiment_workers=args.sentiment_workers, sentiment_backend=args.sentiment_backend,
+        write_batch_size=args.write_batch_size, load_data=args.load_data, unified=args.unified,
+        backfill_months=args.backfill_months, query_info_path=args.query_info, record=args.record,
+        replay=args.replay, sqlite=args.sqlite, metrics_log=args.metrics_log, metrics_file=args.metrics_file,
+        metrics_port=args.metrics_port, daemon=args.daemon, min_interval=args.min_interval, max_interval=args.max_interval,
+        prices_per_day=args.prices_per_day
+        )
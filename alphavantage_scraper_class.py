@@ -1,133 +1,252 @@
 import os
-import requests
 import pandas as pd
 import sqlalchemy
 
+from rate_limiter_class import shared_rate_limiter
+from database import connect_to_db
+from http_client_class import shared_http_client
+from price_parser import parse_prices
+from schema import PRICE_DTYPES, CRYPTO_PRICE_DTYPES
+from watermark_store_class import watermark_name
+from clock_class import SYSTEM_CLOCK
+from metrics_class import shared_metrics
+
 from dotenv import load_dotenv
 load_dotenv()
 
+# outputsize=compact returns the newest COMPACT_BARS bars, outputsize=full the whole intraday history
+COMPACT_BARS = 100
+INTERVAL_MINUTES = {'1min': 1, '5min': 5, '15min': 15, '30min': 30, '60min': 60}
+# Time zones of AlphaVantage's timestamps, by endpoint
+TIME_ZONES = {'TIME_SERIES_INTRADAY': 'US/Eastern', 'CRYPTO_INTRADAY': 'UTC'}
+
 class AlphaVantageScraper():
     '''
     Methods
         - connect_to_db(self)
-        - query_crypto(self)
-        - query_stock(self)
-        - process_results(self, json_data)
+        - query_crypto(self, outputsize='full')
+        - query_stock(self, outputsize='full', month=None)
+        - request(self, url)
+        - query(self, outputsize='full')
+        - get_time_series(self, request_result, key)
+        - process_results(self, json_data, cutoff_date=None)
         - get_cutoff_date(self)
+        - query_cutoff_date(self)
+        - now(self)
+        - choose_outputsize(self, cutoff_date)
+        - covers(self, json_data, cutoff_date)
+        - backfill(self, months)
         - run(self)
+
+    OUTPUTSIZE
+    With outputsize=full, AlphaVantage returns the whole intraday history (days
+    or weeks of bars), of which a regular poll only keeps the few bars newer than
+    the cutoff date. run() therefore asks for outputsize=compact (the newest
+    COMPACT_BARS bars) whenever less time than COMPACT_BARS intervals has passed
+    since the cutoff date, and for outputsize=full otherwise (first run, or
+    after a pause). If a compact response still does not reach back to the
+    cutoff date (e.g. the clock and AlphaVantage disagree), it asks again with
+    outputsize=full, so no bars are skipped.
+
+    BACKFILL
+    With backfill_months > 0, run() instead fetches the full intraday history
+    of each of the last backfill_months months, one request per month (stocks only).
     '''
 
-    def __init__(self, db_table, symbol, endpoint='CRYPTO_INTRADAY', market='USD', interval='1min'):
-        # Connect to our SQL database
+    def __init__(self, db_table, symbol, endpoint='CRYPTO_INTRADAY', market='USD', interval='1min',
+                 rate_limiter=None, engine=None, http_client=None, db_schema='stock_sentiment_project', watermarks=None,
+                 symbol_id=None, backfill_months=0, clock=None):
+        # Connect to our SQL database, unless we were given a shared engine
+        self.db_schema = db_schema
         self.db_table = db_table
-        self.engine = self.connect_to_db()
+        # Symbol of the company in the unified prices table, or None for a per-company table
+        self.symbol_id = symbol_id
+        self.engine = engine if engine is not None else self.connect_to_db()
 
         # Set the AlphaVantage endpoint to be queried
         self.endpoint = endpoint
+        # Dtypes of the parsed prices: crypto volumes are fractional
+        self.price_dtypes = CRYPTO_PRICE_DTYPES if endpoint == 'CRYPTO_INTRADAY' else PRICE_DTYPES
         # Set the symbol for the cryptocurrency whose price we want to query
         self.symbol = symbol
         # Set market to query
         self.market = market
         # Set interval of the price breakdown
         self.interval = interval
+        # Rate limiter shared with the other scrapers (see rate_limiter_class.py)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else shared_rate_limiter()
+        # HTTP client with pooled keep-alive sessions and retries (see http_client_class.py)
+        self.http_client = http_client if http_client is not None else shared_http_client()
+        # Store of the newest price date of each table (see watermark_store_class.py)
+        self.watermarks = watermarks
+        # Number of months of history fetched by run(), or 0 to only fetch new prices
+        self.backfill_months = backfill_months
+        # Clock deciding the outputsize (see clock_class.py)
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
     
     def connect_to_db(self):
         '''
         Function to connect to the database used to store results.
-        This code is run with both MySQL and MariaDB databases, which are
-        functionally the same, but require slightly different connection strings.
-        '''
-        # Getting SQL database credentials
-        mysql_user = os.getenv('MYSQL_USER')
-        mysql_pwd = os.getenv('MYSQL_PWD')
-        mysql_host = os.getenv('MYSQL_HOST')
-        mysql_db = os.getenv('MYSQL_DB')
-
-        # Setting up connection to SQL database
-        # I have set this up to handle either mariadb or mysql because I run this on two
-        # different computers which use these different SQL databases.
-        try:
-            engine_str = f'mariadb+mariadbconnector://{mysql_user}:{mysql_pwd}@{mysql_host}/{mysql_db}'
-            engine = sqlalchemy.create_engine(engine_str)
-            print('Using mariadb database')
-        except:
-            engine_str = f'mysql+pymysql://{mysql_user}:{mysql_pwd}@{mysql_host}/{mysql_db}'
-            engine = sqlalchemy.create_engine(engine_str)
-            print('Using mysql database')
-        
-        return engine
+        Only used when no engine is passed to the scraper. Creating one engine
+        and sharing it between scrapers (see database.py) avoids building a new
+        connection pool for every scraper.
+        '''
+        return connect_to_db(pool_size=1, max_overflow=2)
     
-    def query_crypto(self):
+    def query_crypto(self, outputsize='full'):
         # Getting my Alpha Vantage API key
         ALPHAVANTAGE_API_KEY = os.getenv('ALPHAVANTAGE_API_KEY')
 
         # Pulling stock data using the API
-        url = f'https://www.alphavantage.co/query?function={self.endpoint}&symbol={self.symbol}&market={self.market}&interval={self.interval}&outputsize=full&apikey={ALPHAVANTAGE_API_KEY}'
-        request_result = requests.get(url).json() # Return the request as a json object
+        url = f'https://www.alphavantage.co/query?function={self.endpoint}&symbol={self.symbol}&market={self.market}&interval={self.interval}&outputsize={outputsize}&apikey={ALPHAVANTAGE_API_KEY}'
+        request_result = self.request(url)
         # Alphavantage return metadata and the actual data. We only want the actual data.
-        
-        json_data = request_result[f'Time Series Crypto ({self.interval})']
+        json_data = self.get_time_series(request_result, f'Time Series Crypto ({self.interval})')
         
         return json_data
     
-    def query_stock(self):
+    def query_stock(self, outputsize='full', month=None):
         # Getting my Alpha Vantage API key
         ALPHAVANTAGE_API_KEY = os.getenv('ALPHAVANTAGE_API_KEY')
 
         # Pulling stock data using the API
-        url = f'https://www.alphavantage.co/query?function={self.endpoint}&symbol={self.symbol}&interval={self.interval}&outputsize=full&apikey={ALPHAVANTAGE_API_KEY}'
-        request_result = requests.get(url).json() # Return the request as a json object
+        url = f'https://www.alphavantage.co/query?function={self.endpoint}&symbol={self.symbol}&interval={self.interval}&outputsize={outputsize}&apikey={ALPHAVANTAGE_API_KEY}'
+        if month is not None:
+            # A month of history, e.g. 2022-01
+            url += f'&month={month}'
+        request_result = self.request(url)
         # Alphavantage return metadata and the actual data. We only want the actual data.
-        json_data = request_result[f'Time Series ({self.interval})']
+        json_data = self.get_time_series(request_result, f'Time Series ({self.interval})')
         
         return json_data
-    
-    def process_results(self, json_data):
-        # Convert the json dict to a Pandas dataframe
-        data = pd.DataFrame.from_dict(json_data, orient='index')
 
-        # When the data arrives, the datetime is the index column.
-        # We want the datetime to be its own non-index column.
-        data.reset_index(inplace=True)
-        data.rename(columns={"index": "date"}, inplace=True)
+    def request(self, url):
+        '''
+        Sends a request to AlphaVantage and returns its decoded json.
+        '''
+        # The HTTP client waits for our turn within AlphaVantage's rate limit
+        response = self.http_client.get(url, rate_limiter=self.rate_limiter, api='alphavantage')
+        with shared_metrics().timer('json_parse', api='alphavantage'):
+            return response.json()
+    
+    def query(self, outputsize='full'):
+        if self.endpoint == 'CRYPTO_INTRADAY':
+            return self.query_crypto(outputsize)
+        return self.query_stock(outputsize)
 
-        # Sort by date from oldest to newest
-        data.sort_values(by='date', ascending=True, inplace=True)
+    def get_time_series(self, request_result, key):
+        '''
+        Returns the time series from an AlphaVantage response. When AlphaVantage
+        cannot serve a request (unknown symbol, too many calls) it still answers
+        with status 200 but without the time series and with an explanation under
+        'Note', 'Information' or 'Error Message'.
+        '''
+        if key not in request_result:
+            message = request_result.get('Note') or request_result.get('Information') or request_result.get('Error Message')
+            raise ValueError(f'AlphaVantage returned no {key} for {self.symbol}: {message}')
+        return request_result[key]
 
+    def process_results(self, json_data, cutoff_date=None):
+        '''
+        Parses the time series into a price frame with the dtypes of schema.py,
+        sorted from oldest to newest, without the prices we already have
+        (newer than cutoff_date, by default the latest date in the db).
+        The cutoff is applied to the parsed dates before the prices are parsed
+        (see price_parser.py), so a full history costs little more than the
+        few new bars in it.
+        '''
         # Get the latest date of price data in the db
-        cutoff_date = self.get_cutoff_date()
-        if cutoff_date:
-            # We want to filter out data we already have.
-            data = data[data['date'] > cutoff_date]
+        if cutoff_date is None:
+            cutoff_date = self.get_cutoff_date()
 
-        return data
+        with shared_metrics().timer('price_parse'):
+            return parse_prices(json_data, cutoff_date, self.price_dtypes)
 
     def get_cutoff_date(self):
-        # Get cutoff date
+        '''
+        Returns the date of the newest price in the database, or None if the
+        table is empty. With a watermark store, the date comes from its cache and
+        the table is only queried if it has no watermark yet.
+        '''
+        if self.watermarks is not None:
+            return self.watermarks.get_date(watermark_name(self.db_table, self.symbol_id), fallback=self.query_cutoff_date)
+        return self.query_cutoff_date()
+
+    def query_cutoff_date(self):
+        # Get cutoff date. date is the primary key, so MAX() does not sort the table.
+        # The unified prices table is keyed by (symbol_id, date), so the same holds per symbol.
+        symbol_condition = '' if self.symbol_id is None else 'WHERE symbol_id = :symbol_id'
         mysql_query = f'''
-        SELECT date
-        FROM stock_sentiment_project.{self.db_table}
-        ORDER BY `date` desc
-        LIMIT 1;
+        SELECT MAX(date) AS date
+        FROM {self.db_schema}.{self.db_table}
+        {symbol_condition};
         '''
 
-        cutoff_date_df = pd.read_sql_query(mysql_query, self.engine)
+        with shared_metrics().timer('db_lookup', table=self.db_table):
+            cutoff_date_df = pd.read_sql_query(
+                sqlalchemy.text(mysql_query), self.engine, params={'symbol_id': self.symbol_id}, parse_dates=['date']
+                )
 
-        if cutoff_date_df.empty:
+        cutoff_date = cutoff_date_df['date'].iloc[0]
+        if pd.isna(cutoff_date):
             return None
-        else:
-            cutoff_date = cutoff_date_df['date'].iloc[0]
-            return cutoff_date
+        return cutoff_date
     
+    def now(self):
+        '''
+        Returns the current time in the time zone of AlphaVantage's timestamps.
+        '''
+        return self.clock.now(TIME_ZONES[self.endpoint])
+
+    def choose_outputsize(self, cutoff_date):
+        '''
+        Returns 'compact' if the newest COMPACT_BARS bars certainly include every
+        bar since cutoff_date, and 'full' otherwise.
+        '''
+        if cutoff_date is None:
+            return 'full'
+        compact_window = pd.Timedelta(minutes=COMPACT_BARS * INTERVAL_MINUTES[self.interval])
+        if self.now() - pd.Timestamp(cutoff_date) <= compact_window:
+            return 'compact'
+        return 'full'
+
+    def covers(self, json_data, cutoff_date):
+        '''
+        Returns whether the time series reaches back to cutoff_date, i.e. no bar
+        after cutoff_date can be missing from it.
+        '''
+        # The timestamps (YYYY-MM-DD HH:MM:SS) sort like dates
+        return len(json_data) > 0 and pd.Timestamp(min(json_data)) <= pd.Timestamp(cutoff_date)
+
+    def backfill(self, months):
+        '''
+        Returns the prices of the last months months, including the current one,
+        with one outputsize=full request per month. Prices already in the
+        database are written again, which BulkWriter's upserts allow.
+        '''
+        if self.endpoint != 'TIME_SERIES_INTRADAY':
+            raise ValueError(f'AlphaVantage has no monthly history for {self.endpoint}')
+        last_month = self.now().to_period('M')
+        frames = []
+        for month in pd.period_range(end=last_month, periods=months, freq='M'):
+            frames.append(parse_prices(self.query_stock('full', month=str(month)), dtypes=self.price_dtypes))
+        return pd.concat(frames, ignore_index=True).drop_duplicates(subset='date', keep='last')
+
     def run(self):
-        if self.endpoint == 'CRYPTO_INTRADAY':
-            results_json = self.query_crypto()
-        elif self.endpoint == 'TIME_SERIES_INTRADAY':
-            results_json = self.query_stock()
-        else:
+        if self.endpoint not in TIME_ZONES:
             print('ERROR: unrecognized endpoint')
             return
-        
-        results_df = self.process_results(results_json)
 
-        return results_df
\ No newline at end of file
+        if self.backfill_months > 0:
+            return self.backfill(self.backfill_months)
+
+        # Only ask for the whole history when the newest bars do not reach the cutoff date
+        cutoff_date = self.get_cutoff_date()
+        outputsize = self.choose_outputsize(cutoff_date)
+        results_json = self.query(outputsize)
+        if outputsize == 'compact' and not self.covers(results_json, cutoff_date):
+            results_json = self.query('full')
+
+        results_df = self.process_results(results_json, cutoff_date)
+
+        return results_df
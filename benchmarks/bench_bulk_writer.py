@@ -0,0 +1,80 @@
+'''
+Compares writing a company's tweets with DataFrame.to_sql(if_exists='append')
+with BulkWriter's batched upserts, on a SQLite file. to_sql cannot write the
+same tweets twice (the primary key collides), while BulkWriter updates them.
+Run from the repository root:
+    python benchmarks/bench_bulk_writer.py
+'''
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import sqlalchemy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bulk_writer_class import BulkWriter
+from database import connect_to_sqlite
+from schema import tweet_frame
+
+def load_tweets(scale=1):
+    tweets = pd.read_csv('data_files/tweets_110421.csv', index_col=0)
+    tweets = pd.concat([tweets] * scale, ignore_index=True)
+    tweets['tweet_id'] = range(1, len(tweets) + 1)
+    tweets['followers_count'] = pd.to_numeric(tweets['followers_count'], errors='coerce')
+    return tweet_frame(tweets)
+
+def create_table(engine):
+    metadata = sqlalchemy.MetaData()
+    sqlalchemy.Table(
+        'tweets', metadata,
+        sqlalchemy.Column('tweet_id', sqlalchemy.BigInteger, primary_key=True),
+        sqlalchemy.Column('datetime', sqlalchemy.DateTime),
+        sqlalchemy.Column('tweet_text', sqlalchemy.String(255)),
+        sqlalchemy.Column('polarity', sqlalchemy.Float),
+        sqlalchemy.Column('sentiment', sqlalchemy.String(255)),
+        sqlalchemy.Column('author_id', sqlalchemy.BigInteger),
+        sqlalchemy.Column('followers_count', sqlalchemy.Integer),
+        sqlalchemy.Column('retweet_count', sqlalchemy.Integer),
+        sqlalchemy.Column('like_count', sqlalchemy.Integer),
+        sqlalchemy.Column('collection_time', sqlalchemy.DateTime),
+        sqlalchemy.Column('original_tweet_id', sqlalchemy.BigInteger)
+        )
+    metadata.create_all(engine)
+
+def timed(write, tweets):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = connect_to_sqlite(os.path.join(directory, 'bench.db'))
+        create_table(engine)
+        start = time.perf_counter()
+        elapsed = write(tweets, engine)
+        return elapsed if elapsed is not None else time.perf_counter() - start
+
+def to_sql_append(tweets, engine):
+    tweets.to_sql('tweets', engine, index=False, if_exists='append')
+
+def bulk_writer(tweets, engine):
+    BulkWriter(engine).write_tweets(tweets, 'tweets')
+
+def bulk_writer_rewrite(tweets, engine):
+    # Writes the tweets, then times writing them again
+    writer = BulkWriter(engine)
+    writer.write_tweets(tweets, 'tweets')
+    start = time.perf_counter()
+    writer.write_tweets(tweets, 'tweets')
+    return time.perf_counter() - start
+
+def main():
+    for scale in [1, 10, 100]:
+        tweets = load_tweets(scale)
+        times = {
+            'to_sql append': timed(to_sql_append, tweets),
+            'BulkWriter': timed(bulk_writer, tweets),
+            'BulkWriter rewrite': timed(bulk_writer_rewrite, tweets)
+        }
+        summary = ', '.join(f'{name} {seconds * 1000:8.1f} ms' for name, seconds in times.items())
+        print(f'{len(tweets):>7} tweets: {summary}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+'''
+Compares the original AlphaVantage processing (a frame of strings built from
+the whole time series, sorted, then filtered by the cutoff date) with
+price_parser.parse_prices(), which drops the bars at or before the cutoff
+before parsing any prices. The time series are synthetic 1-minute bars, as
+returned with outputsize=full, with a cutoff leaving the newest 5 bars.
+Run from the repository root:
+    python benchmarks/bench_price_parsing.py
+'''
+import os
+import sys
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from price_parser import parse_prices
+from schema import price_frame
+
+def make_time_series(bars):
+    dates = pd.date_range('2022-01-03 09:30', periods=bars, freq='min')[::-1]
+    return {
+        f'{date:%Y-%m-%d %H:%M:%S}': {
+            '1. open': f'{100 + i / 100:.4f}', '2. high': f'{101 + i / 100:.4f}', '3. low': f'{99 + i / 100:.4f}',
+            '4. close': f'{100.5 + i / 100:.4f}', '5. volume': f'{1000 + i}'
+        }
+        for i, date in enumerate(dates)
+    }
+
+def original_process_results(time_series, cutoff_date):
+    data = pd.DataFrame.from_dict(time_series, orient='index')
+    data.reset_index(inplace=True)
+    data.rename(columns={'index': 'date'}, inplace=True)
+    data = price_frame(data)
+    data.sort_values(by='date', ascending=True, inplace=True)
+    return data[data['date'] > cutoff_date]
+
+def main():
+    # One day of 1-minute bars, then the sizes of the full intraday history of 10 and 100 symbols
+    for bars in [1000, 10000, 100000]:
+        time_series = make_time_series(bars)
+        cutoff_date = pd.Timestamp(sorted(time_series)[-6])
+        expected = original_process_results(time_series, cutoff_date).reset_index(drop=True)
+        pd.testing.assert_frame_equal(parse_prices(time_series, cutoff_date), expected)
+
+        runs = {
+            'original': lambda: original_process_results(time_series, cutoff_date),
+            'parse_prices': lambda: parse_prices(time_series, cutoff_date),
+            'parse_prices (no cutoff)': lambda: parse_prices(time_series)
+        }
+        times = {name: min(timeit.repeat(run, number=1, repeat=3)) for name, run in runs.items()}
+        summary = ', '.join(f'{name} {seconds * 1000:8.1f} ms' for name, seconds in times.items())
+        print(f'{bars:>8} bars: {summary}, speedup {times["original"] / times["parse_prices"]:5.1f}x')
+
+if __name__ == '__main__':
+    main()
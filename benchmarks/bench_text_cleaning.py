@@ -0,0 +1,46 @@
+'''
+Compares the original per-row text cleaning (re.sub with an uncompiled pattern,
+applied to every tweet with Series.apply) with the precompiled per-row
+text_cleaner.clean_text() and the batch text_cleaner.clean_texts().
+Run from the repository root:
+    python benchmarks/bench_text_cleaning.py
+'''
+import os
+import re
+import sys
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from text_cleaner import clean_text, clean_texts
+
+def original_clean_tweet(tweet):
+    return ' '.join(re.sub(r"(@[A-Za-z0-9]+)|([^0-9A-Za-z \t])|(\w+:\/\/\S+)", " ", tweet).split())
+
+def make_texts(scale=1):
+    '''
+    Builds raw-looking tweets from the stored tweet texts by adding back
+    mentions, links, cashtags and emoji.
+    '''
+    texts = pd.read_csv('data_files/tweets_110421.csv')['tweet_text'].dropna().astype(str)
+    raw = ('RT @someone: ' + texts + ' $PLTR 🚀 https://t.co/abcdef123').tolist()
+    return raw * scale
+
+def main():
+    for scale in [1, 10, 100]:
+        texts = make_texts(scale)
+        series = pd.Series(texts)
+        assert clean_texts(texts) == series.apply(original_clean_tweet).tolist()
+
+        runs = {
+            'original': lambda: series.apply(original_clean_tweet),
+            'per-row': lambda: series.apply(clean_text),
+            'batch': lambda: clean_texts(series)
+        }
+        times = {name: min(timeit.repeat(run, number=1, repeat=3)) for name, run in runs.items()}
+        summary = ', '.join(f'{name} {seconds * 1000:8.1f} ms' for name, seconds in times.items())
+        print(f'{len(texts):>8} texts: {summary}, speedup {times["original"] / times["batch"]:4.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''
+Fixtures of the benchmark suite, derived from the tweets scraped on 2021-11-04
+(data_files/tweets_110421.csv and data_files/original_tweets_110421.csv).
+At scale n, the tweets are repeated n times. Each copy gets its own tweet IDs,
+and its retweets point to the copy's own original tweets, so the retweet
+structure of the sample is kept at every scale.
+'''
+import os
+
+import numpy as np
+import pandas as pd
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILES = os.path.join(REPO, 'data_files')
+
+# Added to the IDs of every copy, well below the largest BIGINT at scale 100
+COPY_ID_OFFSET = 10 ** 15
+
+def load_sample(file_name, scale=1):
+    '''
+    Returns a sample file repeated scale times, with the IDs of each copy offset.
+    '''
+    # original_tweet_id has gaps, so pandas would parse it into (lossy) floats
+    sample = pd.read_csv(os.path.join(DATA_FILES, file_name), index_col=0, dtype={'original_tweet_id': str})
+    sample['original_tweet_id'] = pd.array(
+        [None if pd.isna(value) else int(value) for value in sample['original_tweet_id']], dtype='Int64'
+        )
+    sample['followers_count'] = pd.to_numeric(sample['followers_count'], errors='coerce')
+    copies = []
+    for copy in range(scale):
+        frame = sample.copy()
+        frame['tweet_id'] = frame['tweet_id'] + copy * COPY_ID_OFFSET
+        frame['original_tweet_id'] = frame['original_tweet_id'] + copy * COPY_ID_OFFSET
+        copies.append(frame)
+    return pd.concat(copies, ignore_index=True)
+
+def load_tweets(scale=1):
+    return load_sample('tweets_110421.csv', scale)
+
+def load_original_tweets(scale=1):
+    return load_sample('original_tweets_110421.csv', scale)
+
+def raw_text(row):
+    '''
+    Returns a raw-looking text for a stored (cleaned) tweet text, with the
+    retweet prefix, mention and link the cleaning removed.
+    '''
+    prefix = 'RT @someone: ' if not pd.isna(row.original_tweet_id) else ''
+    return f'{prefix}{row.tweet_text} $PLTR https://t.co/abcdef123'
+
+def api_tweets(frame):
+    '''
+    Converts a tweet frame to tweets as returned by Twitter's recent search.
+    '''
+    created_at = pd.to_datetime(frame['datetime']).dt.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    tweets = []
+    for row, created in zip(frame.itertuples(index=False), created_at):
+        tweet = {
+            'id': str(row.tweet_id),
+            'text': raw_text(row),
+            'created_at': created,
+            'author_id': str(row.author_id),
+            'public_metrics': {'like_count': int(row.like_count), 'retweet_count': int(row.retweet_count)}
+        }
+        if not pd.isna(row.original_tweet_id):
+            tweet['referenced_tweets'] = [{'type': 'retweeted', 'id': str(int(row.original_tweet_id))}]
+        tweets.append(tweet)
+    return tweets
+
+def api_users(frame):
+    users = frame.dropna(subset=['followers_count']).drop_duplicates(subset='author_id', keep='last')
+    return [
+        {'id': str(author_id), 'public_metrics': {'followers_count': int(followers)}}
+        for author_id, followers in zip(users['author_id'], users['followers_count'])
+    ]
+
+def twitter_payload(scale=1):
+    '''
+    Returns the tweets at scale as one response of Twitter's recent search,
+    with the users and original tweets expansions.
+    '''
+    tweets = load_tweets(scale)
+    original_tweets = load_original_tweets(scale)
+    return {
+        'data': api_tweets(tweets),
+        'includes': {'users': api_users(tweets), 'tweets': api_tweets(original_tweets)},
+        'meta': {'result_count': len(tweets)}
+    }
+
+def alphavantage_time_series(scale=1, bars_per_scale=1000):
+    '''
+    Returns an AlphaVantage intraday time series of scale * bars_per_scale
+    1-minute bars, newest first. There is no price sample in data_files, so
+    the prices are synthetic.
+    '''
+    bars = scale * bars_per_scale
+    dates = pd.date_range('2021-11-03 04:00', periods=bars, freq='min')[::-1]
+    closes = 20 + np.cumsum(np.random.default_rng(0).normal(0, 0.05, bars))
+    return {
+        f'{date:%Y-%m-%d %H:%M:%S}': {
+            '1. open': f'{close - 0.01:.4f}', '2. high': f'{close + 0.05:.4f}', '3. low': f'{close - 0.05:.4f}',
+            '4. close': f'{close:.4f}', '5. volume': f'{1000 + i % 500}'
+        }
+        for i, (date, close) in enumerate(zip(dates, closes))
+    }
@@ -0,0 +1,212 @@
+'''
+Benchmark suite of the ingest hot paths, run on the fixtures of fixtures.py at
+1x, 10x and 100x the 2021-11-04 sample (1,500 tweets at 1x):
+    - parse_tweet_list: TwitterScraper.parse_tweet_list() of a response
+    - process_query_results: TwitterScraper.process_query_results() of a response
+    - clean_and_score: cleaning the texts (clean_texts) and scoring them
+      (SentimentScorer.score_batch, as get_tweet_sentiment), with a cold cache
+    - calculate_rt_metrics: TwitterScraper.calculate_rt_metrics() against an
+      empty SQLite tweet table
+    - process_prices: AlphaVantageScraper.process_results() of 1,000 bars per
+      scale, none of them in the database yet
+    - write_tweets: BulkWriter.write_tweets() to a SQLite file
+
+Each benchmark reports its best time of --repeat runs, its peak memory
+(tracemalloc, measured in one more run) and rows per second. The results are
+appended to a history file (benchmarks/results/history.jsonl by default), and
+every result is compared with the previous one of the same benchmark, scale and
+machine. Slowdowns or memory growth beyond --threshold are reported as
+regressions, and with --fail-on-regression the suite exits with status 1.
+Run from the repository root:
+    python benchmarks/suite.py
+    python benchmarks/suite.py --scales 1 10 --only parse_tweet_list write_tweets
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import create_tables
+import fixtures
+from alphavantage_scraper_class import AlphaVantageScraper
+from bulk_writer_class import BulkWriter
+from database import connect_to_sqlite
+from sentiment_scorer_class import SentimentScorer
+from text_cleaner import clean_texts
+from twitter_scraper_class import TwitterScraper
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'history.jsonl')
+
+def make_scraper(engine):
+    return TwitterScraper(
+        query_terms='palantir', db_table='palantir_tweets', use_since_id=False, engine=engine, db_schema='main',
+        sentiment_scorer=SentimentScorer()
+        )
+
+def make_engine(directory):
+    engine = connect_to_sqlite(os.path.join(directory, 'bench.db'))
+    create_tables.create_tweet_table('palantir_tweets', engine)
+    create_tables.create_stock_table('palantir_prices', engine)
+    return engine
+
+# Each benchmark takes the scale and a SQLite engine, and returns the number of
+# rows it processes and the function to time
+def bench_parse_tweet_list(scale, engine):
+    payload = fixtures.twitter_payload(scale)
+    scraper = make_scraper(engine)
+    return len(payload['data']), lambda: scraper.parse_tweet_list(payload['data'])
+
+def bench_process_query_results(scale, engine):
+    payload = fixtures.twitter_payload(scale)
+    def run():
+        # A new scorer, so the sentiment cache starts cold
+        make_scraper(engine).process_query_results(payload['data'], payload['includes']['users'])
+    return len(payload['data']), run
+
+def bench_clean_and_score(scale, engine):
+    texts = [tweet['text'] for tweet in fixtures.twitter_payload(scale)['data']]
+    def run():
+        SentimentScorer().score_batch(clean_texts(texts))
+    return len(texts), run
+
+def bench_calculate_rt_metrics(scale, engine):
+    payload = fixtures.twitter_payload(scale)
+    scraper = make_scraper(engine)
+    results_df = scraper.process_query_results(payload['data'], payload['includes']['users'])
+    original_tweet_df = scraper.process_query_results(payload['includes']['tweets'], payload['includes']['users'])
+    return len(results_df), lambda: scraper.calculate_rt_metrics(original_tweet_df, results_df.copy())
+
+def bench_process_prices(scale, engine):
+    time_series = fixtures.alphavantage_time_series(scale)
+    scraper = AlphaVantageScraper('palantir_prices', 'PLTR', endpoint='TIME_SERIES_INTRADAY', engine=engine, db_schema='main')
+    return len(time_series), lambda: scraper.process_results(time_series)
+
+def bench_write_tweets(scale, engine):
+    payload = fixtures.twitter_payload(scale)
+    tweets = make_scraper(engine).process_query_results(payload['data'], payload['includes']['users'])
+    writer = BulkWriter(engine)
+    # The first run inserts the tweets, the others update them
+    return len(tweets), lambda: writer.write_tweets(tweets, 'palantir_tweets')
+
+BENCHMARKS = {
+    'parse_tweet_list': bench_parse_tweet_list,
+    'process_query_results': bench_process_query_results,
+    'clean_and_score': bench_clean_and_score,
+    'calculate_rt_metrics': bench_calculate_rt_metrics,
+    'process_prices': bench_process_prices,
+    'write_tweets': bench_write_tweets
+}
+
+def measure(run, repeat):
+    '''
+    Returns the best time of repeat runs, and the peak memory of one more run.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=fixtures.REPO, check=True
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def previous_result(history, result):
+    for previous in reversed(history):
+        if all(previous[key] == result[key] for key in ['benchmark', 'scale', 'machine']):
+            return previous
+    return None
+
+def compare(previous, result, threshold):
+    '''
+    Returns the regressions of result compared with previous, as text.
+    '''
+    regressions = []
+    if result['seconds'] > previous['seconds'] * (1 + threshold):
+        regressions.append(f'time {previous["seconds"]:.4f}s -> {result["seconds"]:.4f}s')
+    if result['peak_mb'] > previous['peak_mb'] * (1 + threshold):
+        regressions.append(f'peak memory {previous["peak_mb"]:.1f} MB -> {result["peak_mb"]:.1f} MB')
+    return regressions
+
+def main(scales=(1, 10, 100), only=None, repeat=3, history_path=HISTORY_PATH, threshold=0.2, fail_on_regression=False):
+    history = load_history(history_path)
+    run_info = {
+        'run_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'machine': platform.node(),
+        'python': platform.python_version()
+    }
+
+    results, regressions = [], []
+    for name, benchmark in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        for scale in scales:
+            with tempfile.TemporaryDirectory() as directory:
+                engine = make_engine(directory)
+                rows, run = benchmark(scale, engine)
+                seconds, peak = measure(run, repeat)
+                engine.dispose()
+
+            result = dict(
+                run_info, benchmark=name, scale=scale, rows=rows, seconds=round(seconds, 6),
+                peak_mb=round(peak / 2 ** 20, 2), rows_per_second=round(rows / seconds)
+                )
+            results.append(result)
+            print(f'{name:>22} {scale:>4}x {rows:>8} rows {seconds * 1000:10.1f} ms {result["peak_mb"]:8.1f} MB {result["rows_per_second"]:>10} rows/s')
+
+            previous = previous_result(history, result)
+            if previous is not None:
+                for regression in compare(previous, result, threshold):
+                    regressions.append(f'{name} {scale}x: {regression} (since {previous["commit"]})')
+
+    os.makedirs(os.path.dirname(history_path), exist_ok=True)
+    with open(history_path, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result) + '\n')
+
+    if regressions:
+        print(f'{len(regressions)} regressions beyond {threshold:.0%}:')
+        for regression in regressions:
+            print(f'  {regression}')
+    return 1 if regressions and fail_on_regression else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ingest hot paths.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='Multiples of the 1,500 tweet sample.')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='Benchmarks to run (default: all).')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark; the best is kept.')
+    parser.add_argument('--history', default=HISTORY_PATH, help='File the results are appended to and compared with.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown or memory growth reported as a regression.')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 if there are regressions.')
+    args = parser.parse_args()
+    sys.exit(main(
+        scales=args.scales, only=args.only, repeat=args.repeat, history_path=args.history,
+        threshold=args.threshold, fail_on_regression=args.fail_on_regression
+        ))
@@ -0,0 +1,245 @@
+import os
+import tempfile
+import threading
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.dialects import mysql, sqlite
+
+from metrics_class import shared_metrics
+from watermark_store_class import watermark_name
+
+# Columns which identify a row, and the columns updated when a row is written again
+TWEET_KEY = ['tweet_id']
+# Retweet metrics are recalculated on every scrape (see TwitterScraper.calculate_rt_metrics)
+TWEET_UPDATE_COLUMNS = ['like_count', 'retweet_count']
+PRICE_KEY = ['date']
+# The latest price interval can still change until it closes
+PRICE_UPDATE_COLUMNS = ['1. open', '2. high', '3. low', '4. close', '5. volume']
+# Keys of the unified tables (see create_tables.py). The partition columns are part of the keys.
+UNIFIED_TWEET_KEY = ['symbol_id', 'tweet_id', 'datetime']
+UNIFIED_PRICE_KEY = ['symbol_id', 'date']
+
+class BulkWriter():
+    '''
+    Methods
+        - write_tweets(self, df, table_name, symbol_id=None)
+        - write_prices(self, df, table_name, symbol_id=None)
+        - upsert(self, df, table_name, key_columns, update_columns, watermark_column=None, watermark_key=None, symbol_id=None)
+        - get_table(self, table_name)
+        - get_records(self, df)
+        - execute_upsert(self, connection, table, records, key_columns, update_columns)
+        - load_data(self, connection, df, table_name)
+        - get_load_data_text(self, df)
+
+    Writes tweet and price frames to the database in batches of batch_size rows.
+    DataFrame.to_sql(if_exists='append') fails as soon as a row is already in the
+    table (a rerun, or pages overlapping the since_id), because tweet_id and date
+    are primary keys. Instead, rows are upserted: new rows are inserted and rows
+    which already exist get their recalculated columns (like and retweet counts,
+    or the prices of the latest interval) updated in place.
+
+    DIALECTS
+    - MySQL/MariaDB: multi-row INSERT ... ON DUPLICATE KEY UPDATE, one statement
+    per batch.
+    - SQLite (tests and offline runs, see database.connect_to_sqlite):
+    INSERT ... ON CONFLICT DO UPDATE, executed for a whole batch at once.
+    Both require a primary key or unique index on the key columns.
+
+    LOAD DATA
+    With use_load_data=True, MySQL batches of at least load_data_threshold rows
+    are written to a temporary file and sent with LOAD DATA LOCAL INFILE ...
+    REPLACE, which replaces existing rows entirely. The file is in MySQL's
+    default format (tab-separated, backslash escapes, \\N for missing values),
+    so the text NULL stays a string as it does in the upserts. The engine must allow local
+    files (database.connect_to_db(local_infile=True)).
+
+    WATERMARKS
+    With a WatermarkStore (see watermark_store_class.py), the newest tweet ID or
+    price date of every write is recorded in the same transaction as the rows.
+
+    UNIFIED TABLES
+    Given a symbol_id, write_tweets() and write_prices() write to the unified
+    tables of all companies (see create_tables.py): every row gets the
+    symbol_id, and the symbol has its own watermark.
+    '''
+
+    def __init__(self, engine, batch_size=1000, db_schema=None, use_load_data=False, load_data_threshold=50000,
+                 watermarks=None):
+        self.engine = engine
+        self.watermarks = watermarks
+        self.batch_size = batch_size
+        # Schema (database) of the tables; None is the engine's default database, as with to_sql
+        self.db_schema = db_schema
+        self.use_load_data = use_load_data
+        self.load_data_threshold = load_data_threshold
+
+        # Reflected tables, by name
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def write_tweets(self, df, table_name, symbol_id=None):
+        '''
+        Upserts a tweet frame. Returns the number of rows written.
+        '''
+        if symbol_id is None:
+            return self.upsert(df, table_name, TWEET_KEY, TWEET_UPDATE_COLUMNS, watermark_column='tweet_id')
+        return self.upsert(
+            df, table_name, UNIFIED_TWEET_KEY, TWEET_UPDATE_COLUMNS, watermark_column='tweet_id',
+            watermark_key=watermark_name(table_name, symbol_id), symbol_id=symbol_id
+            )
+
+    def write_prices(self, df, table_name, symbol_id=None):
+        '''
+        Upserts a price frame. Returns the number of rows written.
+        '''
+        if symbol_id is None:
+            return self.upsert(df, table_name, PRICE_KEY, PRICE_UPDATE_COLUMNS, watermark_column='date')
+        return self.upsert(
+            df, table_name, UNIFIED_PRICE_KEY, PRICE_UPDATE_COLUMNS, watermark_column='date',
+            watermark_key=watermark_name(table_name, symbol_id), symbol_id=symbol_id
+            )
+
+    def upsert(self, df, table_name, key_columns, update_columns, watermark_column=None, watermark_key=None, symbol_id=None):
+        '''
+        Inserts the rows of df into table_name, updating update_columns of the
+        rows whose key_columns already exist. A key appearing twice in df is
+        written once, with its last row. If watermark_column is given, the
+        watermark watermark_key (by default table_name) is advanced to its maximum
+        in the same transaction. With a symbol_id, every row gets a symbol_id column.
+        '''
+        if df is None or df.empty:
+            return 0
+        if symbol_id is not None:
+            df = df.assign(symbol_id=symbol_id)
+        df = df.drop_duplicates(subset=key_columns, keep='last')
+        update_columns = [column for column in update_columns if column in df.columns]
+        use_load_data = self.use_load_data and self.engine.dialect.name == 'mysql' and len(df) >= self.load_data_threshold
+
+        if not use_load_data:
+            table = self.get_table(table_name)
+            records = self.get_records(df)
+
+        watermark_key = watermark_key if watermark_key is not None else table_name
+        watermark = None
+        with shared_metrics().timer('db_write', table=table_name), self.engine.begin() as connection:
+            if use_load_data:
+                self.load_data(connection, df, table_name)
+            else:
+                for start in range(0, len(records), self.batch_size):
+                    batch = records[start:start + self.batch_size]
+                    self.execute_upsert(connection, table, batch, key_columns, update_columns)
+
+            if self.watermarks is not None and watermark_column is not None:
+                watermark = self.watermarks.advance(connection, watermark_key, watermark_column, df[watermark_column].max())
+
+        # Only cache the watermark once the rows are committed
+        if watermark is not None:
+            self.watermarks.remember(watermark_key, watermark_column, watermark)
+        shared_metrics().count('rows_written', len(df), table=table_name)
+        return len(df)
+
+    def get_table(self, table_name):
+        with self.lock:
+            if table_name not in self.tables:
+                self.tables[table_name] = sqlalchemy.Table(
+                    table_name, sqlalchemy.MetaData(), autoload_with=self.engine, schema=self.db_schema
+                    )
+            return self.tables[table_name]
+
+    def get_records(self, df):
+        '''
+        Converts df to a list of dictionaries of plain Python values, with None
+        for missing values, which every database driver accepts.
+        '''
+        columns = {}
+        for column in df.columns:
+            series = df[column]
+            if pd.api.types.is_datetime64_any_dtype(series.dtype):
+                values = list(series.dt.to_pydatetime())
+            elif hasattr(series.dtype, 'numpy_dtype'):
+                # Nullable integers (e.g. the Int64 IDs of schema.py) would otherwise
+                # come out as NumPy scalars
+                values = series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0).tolist()
+            else:
+                values = series.tolist()
+            missing = series.isna().tolist()
+            columns[column] = [None if is_missing else value for value, is_missing in zip(values, missing)]
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+    def execute_upsert(self, connection, table, records, key_columns, update_columns):
+        dialect = self.engine.dialect.name
+        if dialect == 'mysql':
+            # One multi-row INSERT per batch
+            statement = mysql.insert(table).values(records)
+            if update_columns:
+                statement = statement.on_duplicate_key_update(
+                    {column: statement.inserted[column] for column in update_columns}
+                    )
+            else:
+                statement = statement.prefix_with('IGNORE')
+            connection.execute(statement)
+        elif dialect == 'sqlite':
+            statement = sqlite.insert(table)
+            if update_columns:
+                statement = statement.on_conflict_do_update(
+                    index_elements=key_columns,
+                    set_={column: statement.excluded[column] for column in update_columns}
+                    )
+            else:
+                statement = statement.on_conflict_do_nothing(index_elements=key_columns)
+            connection.execute(statement, records)
+        else:
+            raise ValueError(f'Upserts are not supported for the {dialect} dialect')
+
+    def load_data(self, connection, df, table_name):
+        '''
+        Fast path for large MySQL batches: writes df to a temporary file (see
+        get_load_data_text()) and loads it with LOAD DATA LOCAL INFILE ... REPLACE.
+        '''
+        table = f'{self.db_schema}.{table_name}' if self.db_schema else table_name
+        columns = ', '.join(f'`{column}`' for column in df.columns)
+
+        handle, path = tempfile.mkstemp(suffix='.tsv')
+        try:
+            with os.fdopen(handle, 'w', newline='', encoding='utf-8') as f:
+                f.write(self.get_load_data_text(df))
+            # MySQL's default FIELDS and LINES options, spelled out
+            statement = sqlalchemy.text(f'''
+            LOAD DATA LOCAL INFILE '{path}'
+            REPLACE INTO TABLE {table}
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY '\\t' ENCLOSED BY '' ESCAPED BY '\\\\'
+            LINES TERMINATED BY '\\n'
+            ({columns});
+            ''')
+            connection.execute(statement)
+        finally:
+            os.remove(path)
+        return len(df)
+
+    def get_load_data_text(self, df):
+        '''
+        Converts df to the text of a LOAD DATA file in MySQL's default format:
+        one line per row, tab-separated fields, backslash, tab, newline and
+        carriage return escaped with a backslash, and \\N for missing values.
+        Only \\N is read as NULL, so a text which reads NULL stays a string.
+        '''
+        if df.empty:
+            return ''
+        fields = []
+        for column in df.columns:
+            series = df[column]
+            if pd.api.types.is_datetime64_any_dtype(series.dtype):
+                values = series.dt.strftime('%Y-%m-%d %H:%M:%S')
+            elif pd.api.types.is_bool_dtype(series.dtype):
+                values = series.astype('Int64').astype(str)
+            elif pd.api.types.is_numeric_dtype(series.dtype):
+                values = series.astype(str)
+            else:
+                values = series.astype(str)
+                for character, escaped in [('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')]:
+                    values = values.str.replace(character, escaped, regex=False)
+            fields.append(values.where(series.notna(), '\\N').reset_index(drop=True))
+        lines = fields[0].str.cat(fields[1:], sep='\t')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,246 @@
+import json
+import re
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from metrics_class import shared_metrics
+
+# Query parameters holding credentials, which are never written to a cassette
+SECRET_PARAMS = ['apikey']
+# Response headers kept in a cassette
+RECORDED_HEADERS = ['Content-Type']
+
+class CassetteMiss(KeyError):
+    '''
+    Raised by ReplayHttpClient.get() for a request which is not in its cassette.
+    '''
+    pass
+
+class Cassette():
+    '''
+    Methods
+        - load(cls, path)
+        - save(self, path)
+        - write_header(f, recorded_at, watermarks)
+        - write_interaction(f, interaction)
+        - iter_interactions(path)
+        - request_key(url, params=None)
+        - interaction(url, params, body, status=200, headers=None)
+        - add(self, url, params, response)
+        - response(self, url, params=None)
+        - close(self)
+
+    The HTTP responses of one or more runs, stored in a JSON Lines file: a
+    header line with recorded_at and the watermarks, then one line per request,
+    with its URL and parameters (without credentials) and the status, headers
+    and body of its response. recorded_at is the time (UTC) at which recording
+    started, from which replays start their FakeClock.
+
+    A loaded cassette only keeps the file offset of each response, and reads a
+    response from the file when it is replayed, so cassettes of millions of
+    tweets (see twitter_payload_generator_class.py) replay without being held
+    in memory. Recorded responses are held in memory until save().
+
+    watermarks are the newest tweet ID and price date of every table when the
+    recording started (see WatermarkStore.seed()). The since_id and outputsize
+    of the requests depend on them, so a replay seeds its WatermarkStore with
+    them and sends the recorded requests whatever its database holds.
+
+    A request made more often than it was recorded gets the last recorded
+    response again.
+    '''
+
+    def __init__(self, interactions=None, recorded_at=None, watermarks=None):
+        self.interactions = interactions if interactions is not None else []
+        self.recorded_at = recorded_at if recorded_at is not None else datetime.now(timezone.utc).isoformat()
+        self.watermarks = watermarks if watermarks is not None else {}
+
+        # Index of the next response of each request, and the responses of each
+        # request: dictionaries, or offsets of their lines in the file of a loaded cassette
+        self.positions = {}
+        self.responses = {}
+        for interaction in self.interactions:
+            request = interaction['request']
+            self.responses.setdefault(self.request_key(request['url'], request['params']), []).append(interaction['response'])
+        self.file = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Loads a cassette, indexing the offset of every response without keeping
+        the responses in memory.
+        '''
+        f = open(path, 'rb')
+        header = json.loads(f.readline())
+        cassette = cls(recorded_at=header['recorded_at'], watermarks=header.get('watermarks'))
+        cassette.file = f
+        offset = f.tell()
+        for line in iter(f.readline, b''):
+            if line.strip():
+                request = json.loads(line)['request']
+                cassette.responses.setdefault(cassette.request_key(request['url'], request['params']), []).append(offset)
+            offset = f.tell()
+        return cassette
+
+    def save(self, path):
+        '''
+        Writes the responses recorded in memory (see add()) to path.
+        '''
+        with self.lock:
+            interactions = list(self.interactions)
+        with open(path, 'w', encoding='utf-8') as f:
+            self.write_header(f, self.recorded_at, self.watermarks)
+            for interaction in interactions:
+                self.write_interaction(f, interaction)
+
+    @staticmethod
+    def write_header(f, recorded_at, watermarks):
+        # Dates of the watermarks are written as strings
+        f.write(json.dumps({'recorded_at': recorded_at, 'watermarks': watermarks or {}}, default=str) + '\n')
+
+    @staticmethod
+    def write_interaction(f, interaction):
+        # json.dumps escapes the newlines of the body, so every interaction is one line
+        f.write(json.dumps(interaction) + '\n')
+
+    @staticmethod
+    def iter_interactions(path):
+        '''
+        Generator of the interactions of a cassette file, read one at a time.
+        '''
+        with open(path, 'rb') as f:
+            f.readline()
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    @staticmethod
+    def request_key(url, params=None):
+        '''
+        Returns the URL and parameters of a request as one string, without
+        credentials and with the parameters sorted.
+        '''
+        for param in SECRET_PARAMS:
+            url = re.sub(f'([?&]{param}=)[^&]*', r'\1', url)
+        if params:
+            params = {key: value for key, value in params.items() if key not in SECRET_PARAMS}
+            url += ('&' if '?' in url else '?') + urlencode(sorted((key, str(value)) for key, value in params.items()))
+        return url
+
+    @staticmethod
+    def interaction(url, params, body, status=200, headers=None):
+        '''
+        Returns a request and its response as stored in a cassette.
+        '''
+        request = {
+            'url': Cassette.request_key(url),
+            'params': {key: str(value) for key, value in (params or {}).items() if key not in SECRET_PARAMS}
+        }
+        response = {'status': status, 'headers': headers or {}, 'body': body}
+        return {'request': request, 'response': response}
+
+    def add(self, url, params, response):
+        headers = {header: response.headers[header] for header in RECORDED_HEADERS if header in response.headers}
+        interaction = self.interaction(url, params, response.text, response.status_code, headers)
+        request = interaction['request']
+        with self.lock:
+            self.interactions.append(interaction)
+            self.responses.setdefault(self.request_key(request['url'], request['params']), []).append(interaction['response'])
+
+    def response(self, url, params=None):
+        '''
+        Returns the next recorded response to a request as a requests.Response.
+        '''
+        key = self.request_key(url, params)
+        with self.lock:
+            if key not in self.responses:
+                raise CassetteMiss(f'No recorded response to {key}')
+            responses = self.responses[key]
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+            recorded = responses[min(position, len(responses) - 1)]
+            if isinstance(recorded, int):
+                self.file.seek(recorded)
+                recorded = json.loads(self.file.readline())['response']
+
+        response = requests.Response()
+        response.status_code = recorded['status']
+        response.headers = CaseInsensitiveDict(recorded['headers'])
+        response._content = recorded['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = key
+        return response
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class RecordingHttpClient():
+    '''
+    Methods
+        - get(self, url, params=None, auth=None, rate_limiter=None, api=None)
+        - save(self)
+        - close(self)
+
+    Wraps an HttpClient and records every response it returns to a cassette,
+    which save() writes to path. Given the WatermarkStore of the scrapers, the
+    watermarks they read are saved with the responses.
+    '''
+
+    def __init__(self, http_client, path, watermarks=None):
+        self.http_client = http_client
+        self.path = path
+        self.cassette = Cassette()
+        self.watermarks = watermarks
+        if watermarks is not None:
+            watermarks.start_recording()
+
+    def get(self, url, params=None, auth=None, rate_limiter=None, api=None):
+        response = self.http_client.get(url, params=params, auth=auth, rate_limiter=rate_limiter, api=api)
+        self.cassette.add(url, params, response)
+        return response
+
+    def save(self):
+        if self.watermarks is not None:
+            self.cassette.watermarks = self.watermarks.recorded
+        self.cassette.save(self.path)
+
+    def close(self):
+        self.http_client.close()
+
+class ReplayHttpClient():
+    '''
+    Methods
+        - get(self, url, params=None, auth=None, rate_limiter=None, api=None)
+        - save(self)
+        - close(self)
+
+    Stands in for HttpClient: serves the responses recorded in a cassette
+    instead of sending requests, so scrapers run without credentials or
+    network. It still acquires tokens from the rate limiter, so replays
+    follow the same schedule as live runs; pair it with a FakeClock
+    (see clock_class.py) to skip the waits.
+    '''
+
+    def __init__(self, cassette):
+        self.cassette = cassette if isinstance(cassette, Cassette) else Cassette.load(cassette)
+
+    def get(self, url, params=None, auth=None, rate_limiter=None, api=None):
+        if rate_limiter is not None:
+            rate_limiter.acquire(api)
+        with shared_metrics().timer('http_fetch', api=api):
+            response = self.cassette.response(url, params)
+        response.raise_for_status()
+        return response
+
+    def save(self):
+        pass
+
+    def close(self):
+        self.cassette.close()
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pandas as pd
+
+class Clock():
+    '''
+    Methods
+        - time(self)
+        - monotonic(self)
+        - sleep(self, seconds)
+        - wait(self, event, seconds)
+        - now(self, tz=None)
+
+    The clock read by the rate limiter, the HTTP client and the scrapers.
+    Clock is the system clock. Passing a FakeClock instead makes runs
+    deterministic and lets them skip every wait (see cassette_class.py).
+    '''
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, seconds):
+        '''
+        Sleeps until the threading.Event event is set or seconds have passed.
+        Returns whether the event is set.
+        '''
+        return event.wait(max(0, seconds))
+
+    def now(self, tz=None):
+        '''
+        Returns the current time as a naive Timestamp, in time zone tz or in
+        local time.
+        '''
+        if tz is None:
+            return pd.Timestamp.now()
+        return pd.Timestamp.now(tz=tz).tz_localize(None)
+
+class FakeClock(Clock):
+    '''
+    Methods
+        - advance(self, seconds)
+
+    A clock which starts at `start` (a datetime or Timestamp in time zone tz,
+    which is also its local time zone) and only moves when advance() or sleep()
+    is called. sleep() returns immediately, and so does wait(), having
+    advanced the clock unless the event was already set.
+    '''
+
+    def __init__(self, start, tz='UTC'):
+        self.tz = tz
+        start = pd.Timestamp(start)
+        if start.tzinfo is None:
+            start = start.tz_localize(tz)
+        self.current = start.timestamp()
+        self.lock = threading.Lock()
+
+    def time(self):
+        with self.lock:
+            return self.current
+
+    def monotonic(self):
+        return self.time()
+
+    def advance(self, seconds):
+        with self.lock:
+            self.current += seconds
+
+    def sleep(self, seconds):
+        self.advance(max(0, seconds))
+
+    def wait(self, event, seconds):
+        if not event.is_set():
+            self.sleep(seconds)
+        return event.is_set()
+
+    def now(self, tz=None):
+        return pd.Timestamp(self.time(), unit='s', tz='UTC').tz_convert(tz or self.tz).tz_localize(None)
+
+SYSTEM_CLOCK = Clock()
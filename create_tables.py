@@ -1,60 +1,80 @@
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, DateTime, String, Float
-import os
+'''
+Creates and migrates the tweet and price tables of every company in
+query_info.json. Run it whenever query_info.json or the migrations change:
+    python create_tables.py
+
+The tables are versioned. Each table's schema version is stored in the
+schema_migrations table, and only the migrations newer than that version are
+applied, so running the script again does nothing. New companies get every
+migration. Each migration also checks the current state of its table, so it is
+safe on tables created before the versioning (by older versions of this script
+or by DataFrame.to_sql).
+
+UNIFIED LAYOUT
+By default every company has its own tweet and price table. With --unified,
+the script instead creates one tweets table and one prices table for all
+companies, keyed by the symbol_id of a symbols table, and registers every
+company in the symbols table. On MySQL both tables are range-partitioned by
+month, so time range queries and retention (dropping old partitions) only
+touch the partitions they need. --copy-company-tables copies the rows of the
+per-company tables into the unified tables.
+    python create_tables.py --unified --copy-company-tables
+'''
+import argparse
 import json
+from datetime import date, datetime
 
-from dotenv import load_dotenv
-load_dotenv()
-
-def connect_to_db():
-    '''
-    Function to connect to the database used to store results.
-    This code is run with both MySQL and MariaDB databases, which are
-    functionally the same, but require slightly different connection strings.
-    '''
-    # Getting SQL database credentials
-    mysql_user = os.getenv('MYSQL_USER')
-    mysql_pwd = os.getenv('MYSQL_PWD')
-    mysql_host = os.getenv('MYSQL_HOST')
-    mysql_db = os.getenv('MYSQL_DB')
-
-    # Setting up connection to SQL database
-    # I have set this up to handle either mariadb or mysql because I run this on two
-    # different computers which use these different SQL databases.
-    try:
-        engine_str = f'mariadb+mariadbconnector://{mysql_user}:{mysql_pwd}@{mysql_host}/{mysql_db}'
-        engine = create_engine(engine_str)
-        print('Using mariadb database')
-    except:
-        engine_str = f'mysql+pymysql://{mysql_user}:{mysql_pwd}@{mysql_host}/{mysql_db}'
-        engine = create_engine(engine_str)
-        print('Using mysql database')
-    
-    return engine
-
-engine = connect_to_db()
+import sqlalchemy
+from sqlalchemy import MetaData, Table, Column, Integer, BigInteger, DateTime, String, Float, Index
 
-def create_tweet_table(table_name, engine):
-    metadata = MetaData(engine)
-    Table(
+from database import connect_to_db
+
+MIGRATIONS_TABLE = 'schema_migrations'
+
+# Tables of the unified layout
+SYMBOLS_TABLE = 'symbols'
+UNIFIED_TWEET_TABLE = 'tweets'
+UNIFIED_STOCK_TABLE = 'prices'
+# Monthly partitions start here. Older rows (e.g. old original tweets) share one partition.
+PARTITION_START = date(2021, 1, 1)
+# Months of partitions created ahead of the current month
+PARTITION_MONTHS_AHEAD = 3
+
+# Tweet IDs, author IDs and original tweet IDs are snowflake IDs, which need 64 bits
+TWEET_ID_COLUMNS = ['tweet_id', 'author_id', 'original_tweet_id']
+# Secondary indexes of the tweet tables, for the retweet metrics lookups
+# (original_tweet_id), time range queries (datetime) and per-author queries
+TWEET_INDEXES = ['original_tweet_id', 'datetime', 'author_id']
+# Volumes are DOUBLE (FLOAT(53)), as crypto volumes are fractional
+VOLUME_TYPE = Float(precision=53)
+
+def tweet_table(table_name, metadata):
+    '''
+    Returns the current layout of a tweet table.
+    '''
+    table_indexes = [Index(f'ix_{table_name}_{column}', column) for column in TWEET_INDEXES]
+    return Table(
         table_name,
         metadata,
-        Column('tweet_id', Integer, primary_key=True, nullable=False),
+        Column('tweet_id', BigInteger, primary_key=True, nullable=False, autoincrement=False),
         Column('datetime', DateTime),
         Column('tweet_text', String(255)),
         Column('polarity', Float),
         Column('sentiment', String(255)),
-        Column('author_id', Integer),
+        Column('author_id', BigInteger),
         Column('followers_count', Integer),
         Column('retweet_count', Integer),
         Column('like_count', Integer),
         Column('collection_time', DateTime),
-        Column('original_tweet_id', Integer)
+        Column('original_tweet_id', BigInteger),
+        *table_indexes
     )
-    metadata.create_all()
 
-def create_stock_table(table_name, engine):
-    metadata = MetaData(engine)
-    Table(
+def stock_table(table_name, metadata):
+    '''
+    Returns the current layout of a price table.
+    '''
+    return Table(
         table_name,
         metadata,
         Column('date', DateTime, primary_key=True, nullable=False),
@@ -62,19 +82,383 @@ def create_stock_table(table_name, engine):
         Column('2. high', Float),
         Column('3. low', Float),
         Column('4. close', Float),
-        Column('5. volumne', Integer)
+        Column('5. volume', VOLUME_TYPE)
+    )
+
+def create_tweet_table(table_name, engine):
+    metadata = MetaData()
+    tweet_table(table_name, metadata)
+    metadata.create_all(engine)
+
+def create_stock_table(table_name, engine):
+    metadata = MetaData()
+    stock_table(table_name, metadata)
+    metadata.create_all(engine)
+
+def get_columns(connection, table_name):
+    return {column['name']: column for column in sqlalchemy.inspect(connection).get_columns(table_name)}
+
+def widen_tweet_ids(connection, table_name):
+    '''
+    Migration: stores the snowflake IDs as BIGINT. SQLite's INTEGER is already 64 bits.
+    '''
+    if connection.dialect.name == 'sqlite':
+        return
+    columns = get_columns(connection, table_name)
+    changes = []
+    for column in TWEET_ID_COLUMNS:
+        if column in columns and not isinstance(columns[column]['type'], sqlalchemy.BigInteger):
+            null = 'NOT NULL' if column == 'tweet_id' else 'NULL'
+            changes.append(f'MODIFY `{column}` BIGINT {null}')
+    if changes:
+        connection.execute(sqlalchemy.text(f'ALTER TABLE `{table_name}` {", ".join(changes)}'))
+
+def add_tweet_indexes(connection, table_name):
+    '''
+    Migration: adds the secondary indexes of TWEET_INDEXES which are missing.
+    '''
+    indexed = {tuple(index['column_names']) for index in sqlalchemy.inspect(connection).get_indexes(table_name)}
+    table = tweet_table(table_name, MetaData())
+    for index in table.indexes:
+        if tuple(column.name for column in index.columns) not in indexed:
+            index.create(connection)
+
+def rename_volume(connection, table_name):
+    '''
+    Migration: renames the misspelled '5. volumne' column to '5. volume', the name
+    AlphaVantage returns. The column becomes BIGINT here, and DOUBLE in the
+    next migration (see double_volume()) so fractional crypto volumes fit.
+    '''
+    columns = get_columns(connection, table_name)
+    if '5. volumne' not in columns:
+        return
+    if connection.dialect.name == 'sqlite':
+        connection.execute(sqlalchemy.text(f'ALTER TABLE "{table_name}" RENAME COLUMN "5. volumne" TO "5. volume"'))
+    else:
+        connection.execute(sqlalchemy.text(f'ALTER TABLE `{table_name}` CHANGE `5. volumne` `5. volume` BIGINT'))
+
+def double_volume(connection, table_name):
+    '''
+    Migration: stores volumes as DOUBLE, so fractional crypto volumes are not
+    truncated. Stock volumes stay exact (DOUBLE holds integers up to 2^53).
+    SQLite stores fractional values in an integer column as they are.
+    '''
+    if connection.dialect.name == 'sqlite':
+        return
+    connection.execute(sqlalchemy.text(f'ALTER TABLE `{table_name}` MODIFY `5. volume` DOUBLE'))
+
+def symbols_table(metadata):
+    return Table(
+        SYMBOLS_TABLE,
+        metadata,
+        Column('symbol_id', Integer, primary_key=True, autoincrement=True),
+        Column('symbol', String(32), nullable=False, unique=True),
+        Column('company', String(255)),
+        Column('tweet_table', String(255)),
+        Column('stock_table', String(255))
+    )
+
+def unified_tweet_table(metadata):
+    '''
+    Returns the layout of the tweets table of the unified layout. The partition
+    column (datetime) has to be part of the primary key on MySQL.
+    '''
+    return Table(
+        UNIFIED_TWEET_TABLE,
+        metadata,
+        Column('symbol_id', Integer, primary_key=True, nullable=False, autoincrement=False),
+        Column('tweet_id', BigInteger, primary_key=True, nullable=False, autoincrement=False),
+        Column('datetime', DateTime, primary_key=True, nullable=False),
+        Column('tweet_text', String(255)),
+        Column('polarity', Float),
+        Column('sentiment', String(255)),
+        Column('author_id', BigInteger),
+        Column('followers_count', Integer),
+        Column('retweet_count', Integer),
+        Column('like_count', Integer),
+        Column('collection_time', DateTime),
+        Column('original_tweet_id', BigInteger),
+        Index(f'ix_{UNIFIED_TWEET_TABLE}_symbol_original_tweet_id', 'symbol_id', 'original_tweet_id'),
+        Index(f'ix_{UNIFIED_TWEET_TABLE}_datetime', 'datetime'),
+        Index(f'ix_{UNIFIED_TWEET_TABLE}_author_id', 'author_id')
+    )
+
+def unified_stock_table(metadata):
+    return Table(
+        UNIFIED_STOCK_TABLE,
+        metadata,
+        Column('symbol_id', Integer, primary_key=True, nullable=False, autoincrement=False),
+        Column('date', DateTime, primary_key=True, nullable=False),
+        Column('1. open', Float),
+        Column('2. high', Float),
+        Column('3. low', Float),
+        Column('4. close', Float),
+        Column('5. volume', VOLUME_TYPE)
     )
-    metadata.create_all()
 
-with open('query_info.json') as f:
-    query_info = json.load(f)
+def create_unified_table(table_builder):
+    def migration(connection, table_name):
+        metadata = MetaData()
+        table_builder(metadata)
+        metadata.create_all(connection)
+    return migration
+
+def month_starts(first, last):
+    '''
+    Returns the first day of every month from first to last.
+    '''
+    month = date(first.year, first.month, 1)
+    while month <= last:
+        yield month
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def months_ahead(today=None):
+    today = today or date.today()
+    return list(month_starts(today, date(today.year + 1, today.month, 1)))[PARTITION_MONTHS_AHEAD]
+
+def partition_definition(month):
+    '''
+    Returns the definition of the partition holding the month before month.
+    '''
+    previous = date(month.year - (month.month == 1), (month.month - 2) % 12 + 1, 1)
+    return f"PARTITION p{previous:%Y%m} VALUES LESS THAN (TO_DAYS('{month:%Y-%m-%d}'))"
+
+def get_partitions(connection, table_name):
+    '''
+    Returns the names of the partitions of a MySQL table, in order.
+    '''
+    rows = connection.execute(sqlalchemy.text('''
+        SELECT partition_name
+        FROM information_schema.partitions
+        WHERE table_schema = DATABASE() AND table_name = :table_name AND partition_name IS NOT NULL
+        ORDER BY partition_ordinal_position;
+        '''), {'table_name': table_name}).fetchall()
+    return [row.partition_name for row in rows]
+
+def partition_by_month(column):
+    '''
+    Returns a migration which range-partitions a MySQL table by month of column:
+    one partition before PARTITION_START, one per month until
+    PARTITION_MONTHS_AHEAD months from now, and pmax for anything later
+    (see add_partitions()). SQLite tables are not partitioned.
+    '''
+    def migration(connection, table_name):
+        if connection.dialect.name == 'sqlite' or get_partitions(connection, table_name):
+            return
+        months = list(month_starts(PARTITION_START, months_ahead()))
+        partitions = [f"PARTITION p_before VALUES LESS THAN (TO_DAYS('{PARTITION_START:%Y-%m-%d}'))"]
+        partitions += [partition_definition(month) for month in months[1:]]
+        partitions.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+        connection.execute(sqlalchemy.text(
+            f'ALTER TABLE `{table_name}` PARTITION BY RANGE (TO_DAYS(`{column}`)) ({", ".join(partitions)})'
+            ))
+    return migration
+
+def add_partitions(engine, table_name, today=None):
+    '''
+    Splits pmax so a MySQL table keeps monthly partitions until
+    PARTITION_MONTHS_AHEAD months from today. Run by main() every time.
+    '''
+    if engine.dialect.name == 'sqlite':
+        return []
+    with engine.begin() as connection:
+        partitions = get_partitions(connection, table_name)
+        monthly = [partition for partition in partitions if partition not in ('p_before', 'pmax')]
+        if not monthly:
+            return []
+        last = datetime.strptime(monthly[-1], 'p%Y%m').date()
+        months = list(month_starts(last, months_ahead(today)))[2:]
+        if months:
+            definitions = [partition_definition(month) for month in months]
+            definitions.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+            connection.execute(sqlalchemy.text(
+                f'ALTER TABLE `{table_name}` REORGANIZE PARTITION pmax INTO ({", ".join(definitions)})'
+                ))
+        return months
+
+def drop_partitions_before(engine, table_name, month):
+    '''
+    Retention: drops the monthly partitions of a MySQL table older than month
+    (a date), which is much faster than deleting their rows.
+    '''
+    with engine.begin() as connection:
+        old = [
+            partition for partition in get_partitions(connection, table_name)
+            if partition.startswith('p2') and datetime.strptime(partition, 'p%Y%m').date() < month
+            ]
+        if old:
+            connection.execute(sqlalchemy.text(f'ALTER TABLE `{table_name}` DROP PARTITION {", ".join(old)}'))
+    return old
+
+# (version, description, migration) for each kind of table, in order
+TWEET_MIGRATIONS = [
+    (1, 'Create the tweet table', lambda connection, table_name: create_tweet_table(table_name, connection)),
+    (2, 'Store tweet, author and original tweet IDs as BIGINT', widen_tweet_ids),
+    (3, 'Index original_tweet_id, datetime and author_id', add_tweet_indexes)
+]
+STOCK_MIGRATIONS = [
+    (1, 'Create the price table', lambda connection, table_name: create_stock_table(table_name, connection)),
+    (2, "Rename '5. volumne' to '5. volume'", rename_volume),
+    (3, 'Store volumes as DOUBLE', double_volume)
+]
+UNIFIED_MIGRATIONS = {
+    SYMBOLS_TABLE: [
+        (1, 'Create the symbols table', create_unified_table(symbols_table))
+    ],
+    UNIFIED_TWEET_TABLE: [
+        (1, 'Create the tweets table', create_unified_table(unified_tweet_table)),
+        (2, 'Partition by month of datetime', partition_by_month('datetime'))
+    ],
+    UNIFIED_STOCK_TABLE: [
+        (1, 'Create the prices table', create_unified_table(unified_stock_table)),
+        (2, 'Partition by month of date', partition_by_month('date')),
+        (3, 'Store volumes as DOUBLE', double_volume)
+    ]
+}
+
+def migrations_table(metadata):
+    return Table(
+        MIGRATIONS_TABLE,
+        metadata,
+        Column('table_name', String(255), primary_key=True, nullable=False),
+        Column('version', Integer, nullable=False),
+        Column('applied_at', DateTime)
+    )
+
+def get_versions(engine):
+    '''
+    Returns the schema version of every table, creating the migrations table
+    if needed.
+    '''
+    metadata = MetaData()
+    table = migrations_table(metadata)
+    metadata.create_all(engine)
+    with engine.connect() as connection:
+        rows = connection.execute(sqlalchemy.select(table.c.table_name, table.c.version)).fetchall()
+    return {row.table_name: row.version for row in rows}
+
+def migrate_table(engine, table_name, migrations, version):
+    '''
+    Applies the migrations newer than version to a table, recording the new
+    version after each one. Returns the versions applied.
+    '''
+    table = migrations_table(MetaData())
+    applied = []
+    for migration_version, description, migration in migrations:
+        if migration_version <= version:
+            continue
+        print(f'{table_name}: {migration_version}. {description}')
+        with engine.begin() as connection:
+            migration(connection, table_name)
+            values = {'version': migration_version, 'applied_at': datetime.now()}
+            if version == 0 and not applied:
+                connection.execute(table.insert().values(table_name=table_name, **values))
+            else:
+                connection.execute(table.update().where(table.c.table_name == table_name).values(**values))
+        applied.append(migration_version)
+    return applied
+
+def migrate(engine, query_info, unified=False):
+    '''
+    Brings the tweet and price tables of every company in query_info up to date,
+    or with unified=True, the tables of the unified layout. Returns the versions
+    applied to each table.
+    '''
+    versions = get_versions(engine)
+    applied = {}
+    if unified:
+        for table_name, migrations in UNIFIED_MIGRATIONS.items():
+            applied[table_name] = migrate_table(engine, table_name, migrations, versions.get(table_name, 0))
+        register_symbols(engine, query_info)
+        return applied
+
+    for company in query_info:
+        tweet_table_name = query_info[company]['tweet_table']
+        stock_table_name = query_info[company]['stock_table']
+
+        applied[tweet_table_name] = migrate_table(engine, tweet_table_name, TWEET_MIGRATIONS, versions.get(tweet_table_name, 0))
+        applied[stock_table_name] = migrate_table(engine, stock_table_name, STOCK_MIGRATIONS, versions.get(stock_table_name, 0))
+    return applied
+
+def register_symbols(engine, query_info):
+    '''
+    Adds the companies of query_info missing from the symbols table.
+    Returns a dictionary of symbol IDs by symbol.
+    '''
+    table = symbols_table(MetaData())
+    symbol_ids = get_symbol_ids(engine)
+    with engine.begin() as connection:
+        for company, info in query_info.items():
+            if info['symbol'] not in symbol_ids:
+                connection.execute(table.insert().values(
+                    symbol=info['symbol'], company=company, tweet_table=info['tweet_table'], stock_table=info['stock_table']
+                    ))
+    return get_symbol_ids(engine)
+
+def get_symbol_ids(engine):
+    '''
+    Returns a dictionary of symbol IDs by symbol, with one query.
+    '''
+    table = symbols_table(MetaData())
+    with engine.connect() as connection:
+        rows = connection.execute(sqlalchemy.select(table.c.symbol, table.c.symbol_id)).fetchall()
+    return {row.symbol: row.symbol_id for row in rows}
+
+def copy_company_tables(engine, query_info):
+    '''
+    Migration path to the unified layout: copies the rows of every per-company
+    table into the unified tables with INSERT ... SELECT, one statement per
+    table. Rows already copied are skipped, so this can be run again. Returns
+    the number of rows copied from each table.
+    '''
+    symbol_ids = get_symbol_ids(engine)
+    existing = set(sqlalchemy.inspect(engine).get_table_names())
+    targets = [
+        (unified_tweet_table(MetaData()), 'tweet_table'),
+        (unified_stock_table(MetaData()), 'stock_table')
+    ]
+    copied = {}
+    with engine.begin() as connection:
+        for company, info in query_info.items():
+            for target, table_key in targets:
+                source_name = info[table_key]
+                if source_name not in existing:
+                    continue
+                source_columns = get_columns(connection, source_name)
+                columns = [column.name for column in target.columns if column.name in source_columns]
+                source = Table(source_name, MetaData(), *[Column(column) for column in columns])
+
+                select = sqlalchemy.select(
+                    sqlalchemy.literal(symbol_ids[info['symbol']]).label('symbol_id'), *[source.c[column] for column in columns]
+                    )
+                statement = target.insert().from_select(['symbol_id'] + columns, select)
+                statement = statement.prefix_with('OR IGNORE' if connection.dialect.name == 'sqlite' else 'IGNORE')
+                copied[source_name] = connection.execute(statement).rowcount
+    return copied
+
+def main(query_info_path='query_info.json', unified=False, copy_company_tables_=False):
+    with open(query_info_path) as f:
+        query_info = json.load(f)
+
+    engine = connect_to_db()
+    applied = migrate(engine, query_info, unified=unified)
 
-for company in query_info:
-    tweet_table_name = query_info[company]['tweet_table']
-    stock_table_name = query_info[company]['stock_table']
+    migrated = [table_name for table_name, versions in applied.items() if versions]
+    print(f'Migrated {len(migrated)} of {len(applied)} tables')
 
-    print(f'Creating Tweet table for {company}')
-    create_tweet_table(tweet_table_name, engine)
+    if unified:
+        for table_name in [UNIFIED_TWEET_TABLE, UNIFIED_STOCK_TABLE]:
+            added = add_partitions(engine, table_name)
+            if added:
+                print(f'{table_name}: added {len(added)} monthly partitions')
+        if copy_company_tables_:
+            copied = copy_company_tables(engine, query_info)
+            print(f'Copied {sum(copied.values())} rows from {len(copied)} company tables')
 
-    print(f'Creating stock table for {company}')
-    create_stock_table(stock_table_name, engine)
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create and migrate the tables of every company in query_info.json.')
+    parser.add_argument('--query-info', default='query_info.json', help='Path of query_info.json.')
+    parser.add_argument('--unified', action='store_true', help='Use one tweets and one prices table for all companies.')
+    parser.add_argument('--copy-company-tables', action='store_true', help='Copy the per-company tables into the unified tables.')
+    args = parser.parse_args()
+    main(query_info_path=args.query_info, unified=args.unified, copy_company_tables_=args.copy_company_tables)
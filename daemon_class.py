@@ -0,0 +1,373 @@
+import json
+import math
+import os
+import signal
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from clock_class import SYSTEM_CLOCK
+from metrics_class import shared_metrics
+
+class AdaptivePollInterval():
+    '''
+    Methods
+        - update(self, tweets, prices, elapsed)
+        - fail(self)
+
+    The poll interval of one company, adapted to its recent activity.
+    Tweets and prices per second are tracked as exponentially weighted moving
+    averages of the polls (smoothing is the weight of the newest poll). The
+    next poll is due when about target_tweets new tweets or target_prices new
+    price bars are expected, whichever comes first, within [min_interval,
+    max_interval]. A busy ticker is therefore polled every few minutes and a
+    quiet one about once an hour, and a ticker without activity (e.g. a stock
+    over the weekend) drifts to max_interval.
+
+    A failed poll doubles the interval (up to max_interval), so a failing
+    company backs off instead of using up the API quotas.
+    '''
+
+    def __init__(self, min_interval=120, max_interval=3600, target_tweets=300, target_prices=30, smoothing=0.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_tweets = target_tweets
+        self.target_prices = target_prices
+        self.smoothing = smoothing
+
+        # Activity per second, None until two polls have been made
+        self.tweet_rate = None
+        self.price_rate = None
+        self.interval = min_interval
+
+    def update(self, tweets, prices, elapsed):
+        '''
+        Records a successful poll which found tweets and prices, elapsed seconds
+        after the previous one (None for the first poll, whose results cover an
+        unknown period). Returns the new interval.
+        '''
+        if elapsed is None or elapsed <= 0:
+            return self.interval
+
+        if self.tweet_rate is None:
+            self.tweet_rate, self.price_rate = tweets / elapsed, prices / elapsed
+        else:
+            self.tweet_rate += self.smoothing * (tweets / elapsed - self.tweet_rate)
+            self.price_rate += self.smoothing * (prices / elapsed - self.price_rate)
+
+        interval = min(
+            self.target_tweets / self.tweet_rate if self.tweet_rate > 0 else math.inf,
+            self.target_prices / self.price_rate if self.price_rate > 0 else math.inf
+            )
+        self.interval = min(self.max_interval, max(self.min_interval, interval))
+        return self.interval
+
+    def fail(self):
+        self.interval = min(self.max_interval, self.interval * 2)
+        return self.interval
+
+# What a poll scrapes. The tweets and the prices of a company are polled on
+# separate schedules, so an AlphaVantage error or quota does not hold up the
+# tweets, and the prices can be polled more sparingly.
+POLL_PARTS = ['tweets', 'prices']
+
+class ScrapeDaemon():
+    '''
+    Methods
+        - get_mtime(self)
+        - price_interval(self)
+        - schedule(self, companies)
+        - reload(self)
+        - check_reload(self)
+        - due_polls(self, now)
+        - seconds_until_due(self, now)
+        - poll(self, company, part)
+        - finish_poll(self, company, part, outcome, started)
+        - run(self, max_polls=None)
+        - stop(self)
+        - request_reload(self)
+        - install_signal_handlers(self)
+
+    A resident alternative to running __main__ once per cycle. One
+    ScrapeOrchestrator (and so one engine, HTTP client, rate limiter, sentiment
+    scorer and watermark store) is kept for the life of the process, and each
+    company is polled on its own schedule instead of all of them every cycle.
+
+    SCHEDULING
+    The tweets and the prices of every company are polled separately (see
+    POLL_PARTS), each with an AdaptivePollInterval (built by make_interval):
+    tweet polls adapt to the tweets found and price polls to the price bars.
+    A poll is due again its interval after it started. Due polls run on up to
+    max_workers threads (inline with max_workers=1, like
+    ScrapeOrchestrator.run_cycle), and a poll never runs twice at once.
+    All tweet polls are due when the daemon starts.
+
+    PRICE BUDGET
+    AlphaVantage allows 500 requests per day, far fewer than the tweet polls
+    of every company would make. The price polls of all companies together
+    make at most prices_per_day requests: a price poll starts at least
+    1/prices_per_day of a day after the previous one, whichever company it
+    is for, and each company gets its share (see price_interval()). At
+    startup, the first price polls are spread out the same way.
+
+    The watermark cache is loaded once and not invalidated between polls: the
+    BulkWriter keeps it current, so run one daemon per database.
+
+    RELOAD
+    query_info.json is read again when its modification time changes or
+    after request_reload() (SIGHUP). New companies are due at once, removed
+    ones are no longer scheduled (a poll in progress finishes) and changed
+    entries apply from their next poll. A file which fails to load is reported
+    and the previous companies are kept. Create the tables of new companies
+    first (see create_tables.py); in the unified tables they are registered
+    on reload.
+
+    SHUTDOWN
+    stop() (SIGTERM or SIGINT) stops scheduling polls. run() then waits for
+    the polls in progress, whose writes complete, and returns.
+
+    METRICS
+    Each poll has its own run_id (see metrics_class.py) and sets the
+    poll_interval_seconds gauge of its company and part. With the
+    orchestrator's metrics_path, the Prometheus file is written after every
+    poll.
+
+    The daemon waits on its clock, so with a FakeClock (and max_workers=1) a
+    schedule of days runs in moments.
+    '''
+
+    def __init__(self, orchestrator, query_info_path=None, max_workers=1, clock=None, make_interval=None,
+                 prices_per_day=450):
+        self.orchestrator = orchestrator
+        self.query_info_path = query_info_path
+        self.max_workers = max_workers
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.make_interval = make_interval if make_interval is not None else AdaptivePollInterval
+
+        # AlphaVantage requests per day of all price polls, below its daily quota
+        # of 500 to leave room for compact responses retried in full, and the
+        # monotonic time from which the next price poll may start
+        self.prices_per_day = prices_per_day
+        self.next_price_poll = None
+
+        # Schedule of every (company, part) poll: its interval, when it last
+        # started, and when it is due next (None while it runs)
+        self.intervals = {}
+        self.last_polls = {}
+        self.due = {}
+        self.polls = 0
+        self.lock = threading.Lock()
+
+        # Set by stop(), and set to wake run() up early
+        self.stopping = threading.Event()
+        self.wake = threading.Event()
+        self.reload_requested = False
+        self.query_info_mtime = self.get_mtime()
+
+        self.schedule(list(orchestrator.query_info))
+
+    def get_mtime(self):
+        if self.query_info_path is None:
+            return None
+        try:
+            return os.stat(self.query_info_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def price_interval(self):
+        '''
+        Returns the shortest interval between the price polls of a company, so
+        the price polls of all companies make at most prices_per_day requests
+        per day. Must be called with the lock held.
+        '''
+        companies = sum(1 for _, part in self.due if part == 'prices')
+        return 24 * 60 * 60 / self.prices_per_day * companies
+
+    def schedule(self, companies):
+        now = self.clock.monotonic()
+        with self.lock:
+            for company in companies:
+                for part in POLL_PARTS:
+                    self.intervals.setdefault((company, part), self.make_interval())
+                    self.due.setdefault((company, part), now)
+
+    def reload(self):
+        '''
+        Reads query_info.json again and updates the schedule. Returns whether
+        the companies were reloaded.
+        '''
+        try:
+            with open(self.query_info_path) as f:
+                query_info = json.load(f)
+        except (OSError, ValueError):
+            print(f'ERROR: reloading {self.query_info_path} failed, keeping the previous companies')
+            traceback.print_exc()
+            return False
+
+        self.orchestrator.query_info = query_info
+        if self.orchestrator.unified:
+            self.orchestrator.load_symbol_ids()
+
+        with self.lock:
+            for key in list(self.due):
+                if key[0] not in query_info:
+                    del self.due[key]
+                    self.intervals.pop(key, None)
+                    self.last_polls.pop(key, None)
+        self.schedule([company for company in query_info if (company, 'tweets') not in self.due])
+        print(f'Reloaded {self.query_info_path}: {len(query_info)} companies')
+        return True
+
+    def check_reload(self):
+        '''
+        Reloads query_info.json if it changed or a reload was requested.
+        '''
+        if self.query_info_path is None:
+            return
+        mtime = self.get_mtime()
+        if self.reload_requested or mtime != self.query_info_mtime:
+            self.reload_requested = False
+            self.query_info_mtime = mtime
+            self.reload()
+
+    def due_polls(self, now):
+        '''
+        Returns the (company, part) polls due at monotonic time now, most
+        overdue first, and marks them as running. At most one price poll is
+        returned, and none until the previous one is far enough back.
+        '''
+        with self.lock:
+            due = []
+            for key in sorted(self.due, key=lambda key: self.due[key] if self.due[key] is not None else math.inf):
+                if self.due[key] is None or self.due[key] > now:
+                    break
+                if key[1] == 'prices':
+                    if self.next_price_poll is not None and now < self.next_price_poll:
+                        continue
+                    self.next_price_poll = now + 24 * 60 * 60 / self.prices_per_day
+                self.due[key] = None
+                due.append(key)
+        return due
+
+    def seconds_until_due(self, now):
+        '''
+        Returns the seconds until the next poll can start, taking the spacing
+        of the price polls into account.
+        '''
+        with self.lock:
+            due = [
+                max(due, self.next_price_poll) if part == 'prices' and self.next_price_poll is not None else due
+                for (_, part), due in self.due.items() if due is not None
+                ]
+        return max(0, min(due) - now) if due else math.inf
+
+    def poll(self, company, part):
+        '''
+        Scrapes the tweets or the prices of company once and schedules the next
+        poll. Errors are reported instead of raised: on a worker thread,
+        nothing would see them.
+        '''
+        started = self.clock.monotonic()
+        try:
+            outcome = self.orchestrator._scrape_company_isolated(
+                company, run_id=uuid.uuid4().hex[:12], tweets=part == 'tweets', prices=part == 'prices'
+                )
+        except Exception as e:
+            print(f'ERROR: polling the {part} of {company} failed')
+            traceback.print_exc()
+            outcome = {'status': 'error', 'error': repr(e)}
+        try:
+            self.finish_poll(company, part, outcome, started)
+        except Exception:
+            print(f'ERROR: finishing the {part} poll of {company} failed')
+            traceback.print_exc()
+        return outcome
+
+    def finish_poll(self, company, part, outcome, started):
+        key = (company, part)
+        try:
+            with self.lock:
+                self.polls += 1
+                if key not in self.due:
+                    # Removed by a reload while it was polled
+                    return
+                interval = self.intervals[key]
+                previous = self.last_polls.get(key)
+                seconds = interval.max_interval
+                try:
+                    if outcome['status'] == 'ok':
+                        elapsed = started - previous if previous is not None else None
+                        seconds = interval.update(outcome['tweets'], outcome['prices'], elapsed)
+                    else:
+                        seconds = interval.fail()
+                finally:
+                    if part == 'prices':
+                        seconds = max(seconds, self.price_interval())
+                    # The poll is always due again, or it would never run again
+                    self.last_polls[key] = started
+                    self.due[key] = started + seconds
+
+            metrics = shared_metrics()
+            with metrics.tags(company=company):
+                metrics.gauge('poll_interval_seconds', seconds, part=part)
+            if self.orchestrator.metrics_path is not None:
+                metrics.write_prometheus(self.orchestrator.metrics_path)
+            print(f'{company}: next {part} poll in {seconds:.0f}s')
+        finally:
+            self.wake.set()
+
+    def run(self, max_polls=None):
+        '''
+        Polls the companies until stop() is called, or until max_polls polls
+        have finished. Returns the number of polls.
+        '''
+        if self.orchestrator.unified:
+            self.orchestrator.load_symbol_ids()
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers) if self.max_workers > 1 else None
+        try:
+            while not self.stopping.is_set() and (max_polls is None or self.polls < max_polls):
+                # Cleared before the polls are started, so a poll finishing before
+                # the wait below still wakes it
+                self.wake.clear()
+                self.check_reload()
+
+                now = self.clock.monotonic()
+                for company, part in self.due_polls(now):
+                    if executor is None:
+                        self.poll(company, part)
+                        if self.stopping.is_set() or (max_polls is not None and self.polls >= max_polls):
+                            break
+                    else:
+                        executor.submit(self.poll, company, part)
+
+                # Sleep until the next company is due, a poll finishes or stop() is
+                # called, checking query_info.json for changes every few seconds
+                timeout = self.seconds_until_due(self.clock.monotonic())
+                if self.query_info_path is not None:
+                    timeout = min(timeout, 5)
+                self.clock.wait(self.wake, min(timeout, 60))
+        finally:
+            if executor is not None:
+                # Lets the polls in progress finish
+                executor.shutdown(wait=True)
+        return self.polls
+
+    def stop(self):
+        self.stopping.set()
+        self.wake.set()
+
+    def request_reload(self):
+        self.reload_requested = True
+        self.wake.set()
+
+    def install_signal_handlers(self):
+        '''
+        Stops the daemon on SIGTERM and SIGINT, and reloads query_info.json on
+        SIGHUP. Must be called from the main thread.
+        '''
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.request_reload())
@@ -0,0 +1,65 @@
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+import os
+
+from dotenv import load_dotenv
+load_dotenv()
+
+def connect_to_db(pool_size=5, max_overflow=10, pool_pre_ping=True, pool_recycle=3600, local_infile=False):
+    '''
+    Function to connect to the database used to store results.
+    This code is run with both MySQL and MariaDB databases, which are
+    functionally the same, but require slightly different connection strings.
+
+    The returned engine holds a connection pool and is meant to be created once
+    and shared by everything that talks to the database (the scrapers, the
+    writes in __main__ and create_tables.py).
+    Parameters:
+        pool_size: number of connections kept open in the pool.
+        max_overflow: number of extra connections allowed when the pool is busy.
+        pool_pre_ping: test connections before use so connections dropped by the
+            server (e.g. after wait_timeout) are replaced instead of failing.
+        pool_recycle: seconds after which a connection is replaced.
+        local_infile: allow LOAD DATA LOCAL INFILE (see bulk_writer_class.py).
+    '''
+    # Getting SQL database credentials
+    mysql_user = os.getenv('MYSQL_USER')
+    mysql_pwd = os.getenv('MYSQL_PWD')
+    mysql_host = os.getenv('MYSQL_HOST')
+    mysql_db = os.getenv('MYSQL_DB')
+
+    pool_settings = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_pre_ping': pool_pre_ping,
+        'pool_recycle': pool_recycle
+    }
+    if local_infile:
+        pool_settings['connect_args'] = {'local_infile': True}
+
+    # Setting up connection to SQL database
+    # I have set this up to handle either mariadb or mysql because I run this on two
+    # different computers which use these different SQL databases.
+    try:
+        engine_str = f'mariadb+mariadbconnector://{mysql_user}:{mysql_pwd}@{mysql_host}/{mysql_db}'
+        engine = sqlalchemy.create_engine(engine_str, **pool_settings)
+        print('Using mariadb database')
+    except:
+        engine_str = f'mysql+pymysql://{mysql_user}:{mysql_pwd}@{mysql_host}/{mysql_db}'
+        engine = sqlalchemy.create_engine(engine_str, **pool_settings)
+        print('Using mysql database')
+
+    return engine
+
+def connect_to_sqlite(path=None):
+    '''
+    Returns a SQLite engine which stands in for the MySQL database in tests and
+    offline runs. Without a path, the database lives in memory; all connections
+    then share the same (single) connection so they see the same tables.
+    The scrapers must be given db_schema='main' to query SQLite's default schema.
+    '''
+    if path is None:
+        return sqlalchemy.create_engine(
+            'sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False}
+            )
+    return sqlalchemy.create_engine(f'sqlite:///{path}')
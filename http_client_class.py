@@ -0,0 +1,142 @@
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from clock_class import SYSTEM_CLOCK
+from metrics_class import shared_metrics
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class HttpClient():
+    '''
+    Methods
+        - get_session(self, url)
+        - get(self, url, params=None, auth=None, rate_limiter=None, api=None)
+        - retry_delay(self, attempt, response=None)
+        - close(self)
+
+    A small HTTP client shared by the scrapers.
+    - Keeps one requests.Session per host, so the TCP and TLS connections are
+    reused (keep-alive) instead of opening a new connection for every request.
+    Each session has a connection pool of pool_maxsize connections, which should
+    be at least the number of threads using the client.
+    - Applies a (connect, read) timeout to every request.
+    - Retries connection errors, timeouts, 429s and 5xx responses with jittered
+    exponential backoff. A Retry-After header, if present, is honored.
+    - Asks for gzip-compressed responses.
+    - If given a RateLimiter and an API name, acquires a token before every
+    attempt (including retries) and passes the response headers back to the
+    rate limiter.
+    - Times every attempt as the http_fetch stage (see metrics_class.py) and
+    counts retries.
+    '''
+
+    def __init__(self, connect_timeout=5, read_timeout=30, max_retries=5, backoff_base=1, backoff_max=60, pool_maxsize=10,
+                 clock=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_maxsize = pool_maxsize
+        # Clock used for the backoff delays (see clock_class.py)
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get_session(self, url):
+        '''
+        Returns the session for the host of `url`, creating it on first use.
+        '''
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['Accept-Encoding'] = 'gzip, deflate'
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def retry_delay(self, attempt, response=None):
+        '''
+        Returns how long to wait before retry number `attempt` (starting at 0).
+        Uses "full jitter" exponential backoff: a random delay between 0 and
+        backoff_base * 2^attempt seconds, capped at backoff_max. If the server sent
+        a Retry-After header, we wait at least that long.
+        '''
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+        if response is not None and 'Retry-After' in response.headers:
+            retry_after = response.headers['Retry-After']
+            try:
+                # Retry-After is either a number of seconds...
+                retry_after = float(retry_after)
+            except ValueError:
+                # ...or an HTTP date
+                try:
+                    retry_after = parsedate_to_datetime(retry_after).timestamp() - self.clock.time()
+                except (TypeError, ValueError):
+                    retry_after = 0
+            delay = max(delay, retry_after)
+
+        return delay
+
+    def get(self, url, params=None, auth=None, rate_limiter=None, api=None):
+        '''
+        Sends a GET request, retrying as described in the class docstring.
+        Returns the response once it succeeds. If the retries run out, the last
+        error is raised (requests.HTTPError for error responses).
+        '''
+        session = self.get_session(url)
+
+        for attempt in range(self.max_retries + 1):
+            if rate_limiter is not None:
+                rate_limiter.acquire(api)
+
+            try:
+                with shared_metrics().timer('http_fetch', api=api):
+                    response = session.get(url, params=params, auth=auth, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                shared_metrics().count('http_retries', api=api)
+                self.clock.sleep(self.retry_delay(attempt))
+                continue
+
+            if rate_limiter is not None:
+                rate_limiter.update_from_headers(api, response.headers)
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                print(f'Received {response.status_code} from {urlsplit(url).netloc}, retrying')
+                shared_metrics().count('http_retries', api=api)
+                self.clock.sleep(self.retry_delay(attempt, response))
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+_shared_http_client = None
+_shared_http_client_lock = threading.Lock()
+
+def shared_http_client():
+    '''
+    Returns the process-wide HttpClient used by scrapers which were not given
+    one explicitly.
+    '''
+    global _shared_http_client
+    with _shared_http_client_lock:
+        if _shared_http_client is None:
+            _shared_http_client = HttpClient()
+        return _shared_http_client
@@ -0,0 +1,222 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Tags of the current task (company and run_id), set with Metrics.tags(). Worker
+# threads do not inherit them, so tasks set them themselves (see
+# ScrapeOrchestrator._scrape_company_isolated) or run in a copied context.
+current_tags = contextvars.ContextVar('metrics_tags', default={})
+
+# Tags which are only written to the JSON log, not to the Prometheus series:
+# a label with a new value every cycle would create new series forever
+LOG_ONLY_TAGS = ['run_id']
+
+def prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+class Metrics():
+    '''
+    Methods
+        - tags(self, **tags)
+        - timer(self, stage, **labels)
+        - observe(self, stage, seconds, **labels)
+        - count(self, name, value=1, **labels)
+        - gauge(self, name, value, **labels)
+        - log(self, event, **fields)
+        - snapshot(self)
+        - reset(self)
+        - prometheus_text(self)
+        - write_prometheus(self, path)
+        - serve_prometheus(self, port, host='')
+
+    Timers and counters of the scrape pipeline. Every measurement is tagged
+    with the tags of the current task (company and run_id, see tags()) and its
+    own labels, e.g. the stage and the API.
+
+    STAGES
+    http_fetch, json_parse, clean, sentiment, rt_metrics, price_parse,
+    db_lookup, db_write and rate_limit_wait are timed with timer() or
+    observe(), as is each company's whole task (company). Each stage has a
+    total time and a number of calls per company. Stages can be nested:
+    rt_metrics includes the db_lookup time of its queries.
+
+    EXPORT
+    - JSON log: with a log file, every measurement is written as one JSON line,
+    including the run_id, so each cycle can be broken down afterwards.
+    - Prometheus: prometheus_text() returns the totals in Prometheus' text
+    format, which write_prometheus() writes to a file (e.g. for node_exporter's
+    textfile collector) and serve_prometheus() serves on /metrics. The run_id
+    is left out of the series (see LOG_ONLY_TAGS); the last one is exported
+    as scraper_last_run_info.
+    '''
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self.log_file = None
+
+        # Totals by (name, labels)
+        self.stage_seconds = {}
+        self.stage_calls = {}
+        self.counters = {}
+        self.gauges = {}
+        self.last_run_id = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def tags(self, **tags):
+        '''
+        Tags every measurement within the block, e.g.
+        with metrics.tags(company='Palantir'):
+        '''
+        token = current_tags.set({**current_tags.get(), **tags})
+        if 'run_id' in tags:
+            self.last_run_id = tags['run_id']
+        try:
+            yield
+        finally:
+            current_tags.reset(token)
+
+    def series(self, labels):
+        '''
+        Returns the Prometheus labels of a measurement, as a hashable key.
+        '''
+        tags = {key: value for key, value in current_tags.get().items() if key not in LOG_ONLY_TAGS}
+        return tuple(sorted({**tags, **labels}.items()))
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def observe(self, stage, seconds, **labels):
+        '''
+        Adds seconds spent in stage.
+        '''
+        key = self.series({'stage': stage, **labels})
+        with self.lock:
+            self.stage_seconds[key] = self.stage_seconds.get(key, 0) + seconds
+            self.stage_calls[key] = self.stage_calls.get(key, 0) + 1
+        self.log('stage', stage=stage, seconds=round(seconds, 6), **labels)
+
+    def count(self, name, value=1, **labels):
+        key = (name, self.series(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.log('count', name=name, value=value, **labels)
+
+    def gauge(self, name, value, **labels):
+        '''
+        Sets a value which can go up and down, e.g. a poll interval.
+        '''
+        key = (name, self.series(labels))
+        with self.lock:
+            self.gauges[key] = value
+        self.log('gauge', name=name, value=value, **labels)
+
+    def log(self, event, **fields):
+        '''
+        Writes an event, with the current tags, as a JSON line to the log file.
+        '''
+        if self.log_path is None:
+            return
+        line = json.dumps({'time': datetime.now().isoformat(), 'event': event, **current_tags.get(), **fields}, default=str)
+        with self.lock:
+            if self.log_file is None:
+                self.log_file = open(self.log_path, 'a', encoding='utf-8')
+            self.log_file.write(line + '\n')
+            self.log_file.flush()
+
+    def snapshot(self):
+        '''
+        Returns the totals as dictionaries: seconds and calls by stage series,
+        and counts by (name, series).
+        '''
+        with self.lock:
+            return dict(self.stage_seconds), dict(self.stage_calls), dict(self.counters)
+
+    def reset(self):
+        with self.lock:
+            self.stage_seconds, self.stage_calls, self.counters, self.gauges = {}, {}, {}, {}
+
+    def prometheus_text(self):
+        stage_seconds, stage_calls, counters = self.snapshot()
+        lines = [
+            '# HELP scraper_stage_seconds_total Time spent in each stage of the scrape pipeline.',
+            '# TYPE scraper_stage_seconds_total counter'
+            ]
+        lines += [f'scraper_stage_seconds_total{prometheus_labels(dict(key))} {value:.6f}' for key, value in sorted(stage_seconds.items())]
+        lines += [
+            '# HELP scraper_stage_calls_total Number of times each stage of the scrape pipeline ran.',
+            '# TYPE scraper_stage_calls_total counter'
+            ]
+        lines += [f'scraper_stage_calls_total{prometheus_labels(dict(key))} {value}' for key, value in sorted(stage_calls.items())]
+
+        for name in sorted({name for name, _ in counters}):
+            metric = 'scraper_' + re.sub('[^a-zA-Z0-9_]', '_', name) + '_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines += [f'{metric}{prometheus_labels(dict(key))} {value}' for (counter, key), value in sorted(counters.items()) if counter == name]
+
+        with self.lock:
+            gauges = dict(self.gauges)
+        for name in sorted({name for name, _ in gauges}):
+            metric = 'scraper_' + re.sub('[^a-zA-Z0-9_]', '_', name)
+            lines.append(f'# TYPE {metric} gauge')
+            lines += [f'{metric}{prometheus_labels(dict(key))} {value:g}' for (gauge, key), value in sorted(gauges.items()) if gauge == name]
+
+        if self.last_run_id is not None:
+            lines.append('# TYPE scraper_last_run_info gauge')
+            lines.append(f'scraper_last_run_info{prometheus_labels({"run_id": self.last_run_id})} 1')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        '''
+        Writes prometheus_text() to path, replacing the file atomically so
+        readers never see a partial file.
+        '''
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(temporary_path, path)
+
+    def serve_prometheus(self, port, host=''):
+        '''
+        Serves prometheus_text() on http://host:port/metrics from a daemon
+        thread. Returns the server; call its shutdown() to stop it.
+        '''
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus_text().encode()
+                self.send_response(200 if self.path == '/metrics' else 404)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+_shared_metrics = Metrics()
+
+def shared_metrics():
+    '''
+    Returns the process-wide Metrics which the pipeline reports to.
+    '''
+    return _shared_metrics
@@ -0,0 +1,252 @@
+from twitter_scraper_class import TwitterScraper
+from alphavantage_scraper_class import AlphaVantageScraper
+from rate_limiter_class import shared_rate_limiter, default_rate_limiter
+from http_client_class import HttpClient
+from sentiment_scorer_class import shared_sentiment_scorer
+from bulk_writer_class import BulkWriter
+from watermark_store_class import WatermarkStore
+from create_tables import UNIFIED_TWEET_TABLE, UNIFIED_STOCK_TABLE, register_symbols
+from metrics_class import shared_metrics
+from concurrent.futures import ThreadPoolExecutor
+import traceback
+import uuid
+
+CRYPTO_COMPANIES = ['Bitcoin', 'Ethereum', 'Polkadot']
+
+class ScrapeOrchestrator():
+    '''
+    Methods
+        - load_symbol_ids(self)
+        - tables(self, company)
+        - scrape_tweets(self, company)
+        - scrape_prices(self, company)
+        - scrape_company(self, company)
+        - run_cycle(self)
+
+    The orchestrator runs the Twitter and AlphaVantage scrapers for every company
+    in query_info.json. With max_workers=1 it behaves like the original loop in
+    __main__.main: one company after the other. With more workers, companies are
+    scraped concurrently on a bounded thread pool. Almost all of a company's time
+    is spent waiting on the network, so threads are enough here.
+
+    Each company is a single task, so the steps for one company still happen in
+    order (Twitter scrape and write, then AlphaVantage scrape and write). A task
+    that raises is caught and recorded without stopping the other companies; its
+    tweets are kept if only the AlphaVantage scrape failed.
+
+    DATABASE
+    The engine passed to the orchestrator is shared by every scraper and used for
+    the writes, so a whole cycle runs on a single connection pool. Likewise, all
+    scrapers share one HttpClient and reuse its keep-alive connections.
+    Results are written with a BulkWriter (see bulk_writer_class.py), which
+    upserts them in batches, so rows already in the database are updated
+    instead of failing the write. The writer also advances the watermarks
+    (see watermark_store_class.py) from which the scrapers get their since_id
+    and cutoff date, so a cycle does not scan every table for them.
+
+    UNIFIED TABLES
+    With unified=True, every company is written to the unified tweets and prices
+    tables (create them with python create_tables.py --unified) under its
+    symbol_id instead of to its own tables. The symbol IDs are loaded once per
+    cycle, and companies new to query_info.json are registered first.
+
+    OFFLINE RUNS
+    With a FakeClock (see clock_class.py), a SQLite engine (db_schema='main') and
+    a ReplayHttpClient (see cassette_class.py), a whole cycle runs without
+    credentials, network or MySQL, and without waiting for the rate limiter.
+
+    API LIMITS
+    All scrapers share one RateLimiter (see rate_limiter_class.py), so the
+    workers together stay within Twitter's and AlphaVantage's limits.
+
+    METRICS
+    Every cycle gets a run_id, and each company's task tags its timings and
+    counts with the run_id and the company (see metrics_class.py). After the
+    cycle, the totals are written to metrics_path in Prometheus' text format.
+    '''
+
+    def __init__(self, query_info, engine, max_workers=1, rate_limiter=None, http_client=None, pipelined=False,
+                 sentiment_scorer=None, writer=None, watermarks=None, unified=False, backfill_months=0,
+                 db_schema='stock_sentiment_project', clock=None, metrics_path=None):
+        self.query_info = query_info
+        self.engine = engine
+        self.max_workers = max_workers
+
+        # Whether to write to the unified tables, and the symbol_id of each symbol in them
+        self.unified = unified
+        self.symbol_ids = {}
+
+        # Months of price history fetched for every stock, or 0 to only fetch new prices.
+        # A backfill is done once: the companies whose backfill succeeded only
+        # fetch new prices in later cycles.
+        self.backfill_months = backfill_months
+        self.backfilled = set()
+
+        # Whether the Twitter scrapers process pages while fetching the next one
+        self.pipelined = pipelined
+
+        # Schema (database) of the tables queried by the scrapers
+        self.db_schema = db_schema
+
+        # Clock of the scrapers, the rate limiter and the HTTP client. None is the system clock.
+        self.clock = clock
+
+        # File the metrics are written to after every cycle, if any, and the ID of the current cycle
+        self.metrics_path = metrics_path
+        self.run_id = None
+
+        # Rate limiter shared by the scrapers of all workers
+        if rate_limiter is None:
+            rate_limiter = shared_rate_limiter() if clock is None else default_rate_limiter(clock=clock)
+        self.rate_limiter = rate_limiter
+
+        # HTTP client shared by the scrapers of all workers. Its sessions keep
+        # one pooled connection per worker to each API host.
+        if http_client is None:
+            http_client = HttpClient(pool_maxsize=max(10, max_workers), clock=clock)
+        self.http_client = http_client
+
+        # Sentiment scorer (and its cache and worker processes) shared by all workers
+        self.sentiment_scorer = sentiment_scorer if sentiment_scorer is not None else shared_sentiment_scorer()
+
+        # Newest tweet ID and price date of every table, read by the scrapers
+        self.watermarks = watermarks if watermarks is not None else WatermarkStore(engine)
+
+        # Batched upserts of the results, which also advance the watermarks
+        self.writer = writer if writer is not None else BulkWriter(engine)
+        if self.writer.watermarks is None:
+            self.writer.watermarks = self.watermarks
+
+    def load_symbol_ids(self):
+        '''
+        Loads the symbol_id of every symbol in the unified tables, registering
+        the symbols new to query_info.json first.
+        '''
+        self.symbol_ids = register_symbols(self.engine, self.query_info)
+
+    def tables(self, company):
+        '''
+        Returns the tweet table, stock table and symbol_id (None outside the
+        unified tables) which company is written to.
+        '''
+        if self.unified:
+            return UNIFIED_TWEET_TABLE, UNIFIED_STOCK_TABLE, self.symbol_ids[self.query_info[company]['symbol']]
+        return self.query_info[company]['tweet_table'], self.query_info[company]['stock_table'], None
+
+    def scrape_tweets(self, company):
+        '''
+        Scrapes Tweets for one company and sends them to the database. Returns
+        the number of Tweets.
+        '''
+        query_terms = self.query_info[company]['query_terms'] # Search terms
+        tweet_table, _, symbol_id = self.tables(company)
+
+        # Import and run our Twitter scraper
+        twitter_scraper = TwitterScraper(
+            query_terms=query_terms, db_table=tweet_table, use_since_id=True, pipelined=self.pipelined,
+            rate_limiter=self.rate_limiter, engine=self.engine, http_client=self.http_client,
+            sentiment_scorer=self.sentiment_scorer, watermarks=self.watermarks, symbol_id=symbol_id,
+            db_schema=self.db_schema, clock=self.clock
+            )
+        twitter_results = twitter_scraper.run()
+
+        # Send the Twitter results to the respective table in the db
+        self.writer.write_tweets(twitter_results, tweet_table, symbol_id=symbol_id)
+        return len(twitter_results)
+
+    def scrape_prices(self, company):
+        '''
+        Scrapes prices for one company and sends them to the database. Returns
+        the number of prices.
+        '''
+        symbol = self.query_info[company]['symbol'] # Stock symbol
+        _, stock_table, symbol_id = self.tables(company)
+
+        # Import and run our AlphaVantage scraper
+        # AlphaVantage only has price history for stocks
+        if company in CRYPTO_COMPANIES:
+            endpoint = 'CRYPTO_INTRADAY'
+            backfill_months = 0
+        else:
+            endpoint = 'TIME_SERIES_INTRADAY'
+            backfill_months = 0 if company in self.backfilled else self.backfill_months
+        stock_scraper = AlphaVantageScraper(
+            db_table=stock_table, symbol=symbol, endpoint=endpoint,
+            rate_limiter=self.rate_limiter, engine=self.engine, http_client=self.http_client,
+            watermarks=self.watermarks, symbol_id=symbol_id, backfill_months=backfill_months,
+            db_schema=self.db_schema, clock=self.clock
+            )
+        stock_results = stock_scraper.run()
+
+        # Send the stock results to the respective table in the db
+        self.writer.write_prices(stock_results, stock_table, symbol_id=symbol_id)
+        if backfill_months:
+            self.backfilled.add(company)
+        return len(stock_results)
+
+    def scrape_company(self, company):
+        '''
+        Scrapes Tweets and prices for one company and sends both to the database.
+        The Tweets are written before the prices are scraped, so an AlphaVantage
+        error does not lose them.
+        '''
+        return self.scrape_tweets(company), self.scrape_prices(company)
+
+    def _scrape_company_isolated(self, company, run_id=None, tweets=True, prices=True):
+        '''
+        Wrapper around scrape_company() so a failing company is reported
+        instead of aborting the whole cycle. Its metrics are tagged with run_id,
+        by default the ID of the current cycle. With tweets or prices set to
+        False, only the other part is scraped (see ScrapeDaemon).
+        '''
+        metrics = shared_metrics()
+        with metrics.tags(run_id=run_id or self.run_id, company=company):
+            print(company) # Print the name of the company
+            try:
+                with metrics.timer('company'):
+                    if tweets and prices:
+                        tweet_count, price_count = self.scrape_company(company)
+                    else:
+                        tweet_count = self.scrape_tweets(company) if tweets else 0
+                        price_count = self.scrape_prices(company) if prices else 0
+                metrics.count('tweets_scraped', tweet_count)
+                metrics.count('prices_scraped', price_count)
+                return {'status': 'ok', 'tweets': tweet_count, 'prices': price_count}
+            except Exception as e:
+                print(f'ERROR: scraping {company} failed')
+                traceback.print_exc()
+                metrics.count('company_errors')
+                return {'status': 'error', 'error': repr(e)}
+
+    def run_cycle(self):
+        '''
+        Scrapes every company once. Returns a dictionary with the outcome of
+        each company, in query_info.json order.
+        '''
+        companies = list(self.query_info)
+        self.run_id = uuid.uuid4().hex[:12]
+
+        # The watermarks of all tables are loaded again, in one query, when the
+        # first scraper needs them
+        self.watermarks.invalidate()
+
+        if self.unified:
+            self.load_symbol_ids()
+
+        if self.max_workers <= 1:
+            outcomes = [self._scrape_company_isolated(company) for company in companies]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                outcomes = list(executor.map(self._scrape_company_isolated, companies))
+
+        failed = [company for company, outcome in zip(companies, outcomes) if outcome['status'] == 'error']
+        if failed:
+            print(f'{len(failed)} of {len(companies)} companies failed: {", ".join(failed)}')
+
+        metrics = shared_metrics()
+        with metrics.tags(run_id=self.run_id):
+            metrics.log('cycle', companies=len(companies), failed=len(failed))
+        if self.metrics_path is not None:
+            metrics.write_prometheus(self.metrics_path)
+
+        return dict(zip(companies, outcomes))
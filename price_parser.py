@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from schema import PRICE_COLUMNS, PRICE_DTYPES
+
+# Columns of each AlphaVantage bar, after the date
+PRICE_VALUE_COLUMNS = PRICE_COLUMNS[1:]
+
+def to_datetime64(value):
+    '''
+    Converts a date (datetime, Timestamp or string) to a NumPy datetime64[ns].
+    '''
+    return np.datetime64(pd.Timestamp(value).to_datetime64(), 'ns')
+
+def parse_prices(time_series, cutoff_date=None, dtypes=PRICE_DTYPES):
+    '''
+    Parses an AlphaVantage time series ({'2022-01-03 10:01:00': {'1. open': '46000.5', ...}, ...})
+    into a price frame with the columns and dtypes of schema.py, sorted from
+    oldest to newest.
+
+    The dates are parsed first, as one datetime64 array, so bars at or before
+    cutoff_date are dropped before their prices are parsed or any frame is
+    built. The prices of the remaining bars are parsed into one float64 array
+    and cast to dtypes (CRYPTO_PRICE_DTYPES keeps fractional volumes). A
+    fractional value in an integer column raises a ValueError instead of
+    being truncated.
+    '''
+    dates = np.array(list(time_series), dtype='datetime64[ns]')
+    keep = np.arange(len(dates))
+    if cutoff_date is not None:
+        keep = np.flatnonzero(dates > to_datetime64(cutoff_date))
+    # AlphaVantage sends the newest bar first
+    keep = keep[np.argsort(dates[keep], kind='stable')]
+
+    bars = list(time_series.values())
+    values = np.array(
+        [[bars[i][column] for column in PRICE_VALUE_COLUMNS] for i in keep], dtype=np.float64
+        ).reshape(len(keep), len(PRICE_VALUE_COLUMNS))
+
+    data = {'date': dates[keep]}
+    for position, column in enumerate(PRICE_VALUE_COLUMNS):
+        column_values = values[:, position]
+        if np.issubdtype(np.dtype(dtypes[column]), np.integer) and not np.array_equal(column_values, np.round(column_values)):
+            raise ValueError(f"Fractional values in '{column}', which is stored as {dtypes[column]}")
+        data[column] = column_values.astype(dtypes[column])
+    return pd.DataFrame(data, columns=PRICE_COLUMNS)
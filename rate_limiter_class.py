@@ -0,0 +1,187 @@
+import threading
+
+from clock_class import SYSTEM_CLOCK
+from metrics_class import shared_metrics
+
+class DailyQuotaExceeded(Exception):
+    '''
+    Raised by RateLimiter.acquire() when an API's daily quota has been used up.
+    Waiting for a token would mean blocking until the next day, so the caller
+    gets an error instead.
+    '''
+    pass
+
+class TokenBucket():
+    '''
+    Methods
+        - refill(self)
+        - try_take(self, tokens=1)
+        - block_until(self, monotonic_time, remaining=0)
+
+    A token bucket holding up to `capacity` tokens which refills at a rate of
+    `capacity` tokens per `period` seconds. Each API request takes one token.
+    Optionally, the bucket also enforces a daily quota which resets at midnight.
+    '''
+
+    def __init__(self, capacity, period, daily_quota=None, clock=None):
+        # Clock (see clock_class.py)
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period # Tokens per second
+        self.tokens = capacity
+        self.last_refill = self.clock.monotonic()
+
+        # The API can tell us to stop until a certain time (i.e. rate limit headers)
+        self.blocked_until = None
+
+        # Daily quota
+        self.daily_quota = daily_quota
+        self.quota_day = self.clock.now().date()
+        self.used_today = 0
+
+        self.lock = threading.Lock()
+
+    def refill(self):
+        '''
+        Adds the tokens accumulated since the last refill. Must be called with
+        the lock held.
+        '''
+        now = self.clock.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+        today = self.clock.now().date()
+        if self.quota_day != today:
+            self.quota_day = today
+            self.used_today = 0
+
+    def try_take(self, tokens=1):
+        '''
+        Takes tokens from the bucket if possible. Returns 0 on success, otherwise
+        the number of seconds to wait before trying again.
+        '''
+        with self.lock:
+            self.refill()
+
+            if self.daily_quota is not None and self.used_today + tokens > self.daily_quota:
+                raise DailyQuotaExceeded(f'Daily quota of {self.daily_quota} requests used up')
+
+            now = self.clock.monotonic()
+            if self.blocked_until is not None:
+                if now < self.blocked_until:
+                    return self.blocked_until - now
+                self.blocked_until = None
+
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                self.used_today += tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def block_until(self, monotonic_time, remaining=0):
+        '''
+        Caps the tokens at `remaining` and, if nothing remains, blocks the bucket
+        until `monotonic_time`.
+        '''
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, remaining)
+            if remaining <= 0:
+                self.blocked_until = monotonic_time
+
+class RateLimiter():
+    '''
+    Methods
+        - add_bucket(self, api, capacity, period, daily_quota=None)
+        - acquire(self, api, tokens=1)
+        - update_from_headers(self, api, headers)
+
+    A rate limiter with one token bucket per API. Every scraper acquires a token
+    from the bucket of the API it is about to query, blocking until one is
+    available. Sharing a single RateLimiter between all scrapers (and threads)
+    keeps the combined request rate within each API's limits.
+
+    API LIMITS
+    Twitter's recent search endpoint allows 450 requests per 15 minutes. Its
+    responses also carry x-rate-limit-remaining and x-rate-limit-reset headers,
+    which update_from_headers() uses to correct the bucket, e.g. when another
+    process shares the same bearer token.
+    AlphaVantage allows 5 requests per minute and 500 requests per day.
+
+    A bucket allows up to its capacity in a burst on top of its refill rate,
+    so the requests in any window stay within capacity + rate * window. See
+    default_rate_limiter() for buckets which keep within both limits.
+    '''
+
+    def __init__(self, clock=None):
+        self.buckets = {}
+        # Clock (see clock_class.py), which a FakeClock replaces in offline runs
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+
+    def add_bucket(self, api, capacity, period, daily_quota=None):
+        self.buckets[api] = TokenBucket(capacity, period, daily_quota=daily_quota, clock=self.clock)
+        return self.buckets[api]
+
+    def acquire(self, api, tokens=1):
+        '''
+        Blocks until `tokens` tokens are available for `api`. Returns the number
+        of seconds spent waiting. APIs without a bucket are not limited.
+        '''
+        if api not in self.buckets:
+            return 0
+        bucket = self.buckets[api]
+
+        waited = 0
+        wait = bucket.try_take(tokens)
+        while wait > 0:
+            self.clock.sleep(wait)
+            waited += wait
+            wait = bucket.try_take(tokens)
+        shared_metrics().observe('rate_limit_wait', waited, api=api)
+        return waited
+
+    def update_from_headers(self, api, headers):
+        '''
+        Updates the bucket of `api` using Twitter-style rate limit headers.
+        x-rate-limit-reset is the epoch time (in seconds) at which the current
+        window resets.
+        '''
+        if api not in self.buckets:
+            return
+        remaining = headers.get('x-rate-limit-remaining')
+        reset = headers.get('x-rate-limit-reset')
+        if remaining is None or reset is None:
+            return
+
+        # Convert the epoch reset time to our monotonic clock
+        seconds_until_reset = max(0, float(reset) - self.clock.time())
+        self.buckets[api].block_until(self.clock.monotonic() + seconds_until_reset, remaining=int(remaining))
+
+def default_rate_limiter(clock=None):
+    '''
+    Returns a RateLimiter with buckets for the APIs used by this project.
+    '''
+    rate_limiter = RateLimiter(clock=clock)
+    # A full bucket allows its capacity at once plus the refill, so a bucket
+    # of one token spaces the requests out instead: a request every 2 seconds
+    # (450 per 15 minutes) for Twitter and every 12 seconds (5 per minute) for
+    # AlphaVantage, which sends no headers to correct an overshoot
+    rate_limiter.add_bucket('twitter', capacity=1, period=2)
+    rate_limiter.add_bucket('alphavantage', capacity=1, period=12, daily_quota=500)
+    return rate_limiter
+
+_shared_rate_limiter = None
+_shared_rate_limiter_lock = threading.Lock()
+
+def shared_rate_limiter():
+    '''
+    Returns the process-wide RateLimiter used by scrapers which were not given
+    one explicitly.
+    '''
+    global _shared_rate_limiter
+    with _shared_rate_limiter_lock:
+        if _shared_rate_limiter is None:
+            _shared_rate_limiter = default_rate_limiter()
+        return _shared_rate_limiter
@@ -0,0 +1,86 @@
+import pandas as pd
+
+# Columns of the tweet frames, in the order they are written to the database
+TWEET_COLUMNS = [
+    'tweet_id',
+    'datetime',
+    'tweet_text',
+    'polarity',
+    'sentiment',
+    'author_id',
+    'followers_count',
+    'retweet_count',
+    'like_count',
+    'collection_time',
+    'original_tweet_id'
+    ]
+
+SENTIMENT_DTYPE = pd.CategoricalDtype(['negative', 'neutral', 'positive'])
+
+# IDs and counts are nullable integers: original_tweet_id is only set for
+# retweets, and authors missing from the users expansion have no follower count.
+TWEET_DTYPES = {
+    'tweet_id': 'Int64',
+    'datetime': 'datetime64[ns]',
+    'tweet_text': 'object',
+    'polarity': 'float32',
+    'sentiment': SENTIMENT_DTYPE,
+    'author_id': 'Int64',
+    'followers_count': 'Int64',
+    'retweet_count': 'Int64',
+    'like_count': 'Int64',
+    'collection_time': 'datetime64[ns]',
+    'original_tweet_id': 'Int64'
+}
+
+# AlphaVantage's column names, as stored in the price tables
+PRICE_COLUMNS = [
+    'date',
+    '1. open',
+    '2. high',
+    '3. low',
+    '4. close',
+    '5. volume'
+    ]
+
+PRICE_DTYPES = {
+    'date': 'datetime64[ns]',
+    '1. open': 'float64',
+    '2. high': 'float64',
+    '3. low': 'float64',
+    '4. close': 'float64',
+    '5. volume': 'int64'
+}
+
+# Crypto volumes are fractional (e.g. 0.8731 BTC), so they stay float64
+CRYPTO_PRICE_DTYPES = {**PRICE_DTYPES, '5. volume': 'float64'}
+
+def apply_schema(df, columns, dtypes):
+    '''
+    Returns df with only the given columns, in order, cast to their dtypes.
+    Numeric columns arriving as strings (e.g. AlphaVantage prices) are parsed first.
+    '''
+    df = df[columns].copy()
+    for column in columns:
+        dtype = dtypes[column]
+        if df[column].dtype == object and dtype not in ('object', SENTIMENT_DTYPE):
+            if str(dtype).startswith('datetime'):
+                df[column] = pd.to_datetime(df[column])
+            else:
+                df[column] = pd.to_numeric(df[column])
+    return df.astype(dtypes)
+
+def tweet_frame(df):
+    '''
+    Returns a tweet frame with the columns and dtypes of TWEET_DTYPES.
+    '''
+    return apply_schema(df, TWEET_COLUMNS, TWEET_DTYPES)
+
+def price_frame(df):
+    '''
+    Returns a price frame with the columns and dtypes of PRICE_DTYPES.
+    '''
+    return apply_schema(df, PRICE_COLUMNS, PRICE_DTYPES)
+
+def empty_tweet_frame():
+    return tweet_frame(pd.DataFrame(columns=TWEET_COLUMNS))
@@ -0,0 +1,138 @@
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+
+from sentiment_backends import TextBlobBackend, textblob_polarity, warm_up_worker
+
+def sentiment_label(polarity):
+    '''
+    Classifies a polarity as positive, neutral or negative.
+    '''
+    if polarity > 0:
+        return 'positive'
+    elif polarity == 0:
+        return 'neutral'
+    else:
+        return 'negative'
+
+class SentimentScorer():
+    '''
+    Methods
+        - cache_key(self, text)
+        - score(self, text)
+        - score_batch(self, texts)
+        - score_texts(self, texts)
+        - get_executor(self)
+        - close(self)
+
+    Scores the sentiment of cleaned tweet texts with a sentiment backend (see
+    sentiment_backends.py). By default this is TextBlob; the lexicon backend is
+    a vectorized reimplementation of TextBlob's analyzer for large batches.
+    Retweets of the same original tweet have identical texts, so within a batch
+    each unique text is scored only once. Scores are also kept in a bounded LRU
+    cache (of up to cache_size texts) so texts seen in earlier pages or runs are
+    not scored again. The cache key is a hash of the backend's model version and
+    the text, so cached scores are not reused if the backend or TextBlob changes.
+
+    PARALLEL SCORING
+    TextBlob is pure Python, so scoring only uses one core. With workers > 1
+    and the TextBlob backend,
+    batches of at least parallel_threshold new texts are split into chunks of
+    chunksize texts and scored on a pool of worker processes. The pool is created
+    on first use and kept until close(), so each worker loads TextBlob only once.
+    The results come back in the same order and with the same values as scoring
+    serially.
+    '''
+
+    def __init__(self, cache_size=100000, workers=1, chunksize=64, parallel_threshold=256, backend=None):
+        self.backend = backend if backend is not None else TextBlobBackend()
+        self.model_version = self.backend.model_version
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Parallel scoring
+        self.workers = workers
+        self.chunksize = chunksize
+        self.parallel_threshold = parallel_threshold
+        self.executor = None
+
+    def cache_key(self, text):
+        return hashlib.blake2b(f'{self.model_version}\0{text}'.encode('utf-8'), digest_size=16).digest()
+
+    def score(self, text):
+        '''
+        Returns the polarity and sentiment label of a single cleaned text.
+        '''
+        polarities, sentiments = self.score_batch([text])
+        return polarities[0], sentiments[0]
+
+    def score_batch(self, texts):
+        '''
+        Returns a list of polarities and a list of sentiment labels, in the same
+        order as texts.
+        '''
+        texts = list(texts)
+        keys = {text: self.cache_key(text) for text in dict.fromkeys(texts)}
+
+        # Look up the unique texts in the cache
+        polarity_by_text = {}
+        with self.lock:
+            for text, key in keys.items():
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    polarity_by_text[text] = self.cache[key]
+
+        # Score the unique texts we have not seen before
+        missing = [text for text in keys if text not in polarity_by_text]
+        scored = self.score_texts(missing)
+        polarity_by_text.update(zip(missing, scored))
+
+        with self.lock:
+            for text, polarity in zip(missing, scored):
+                self.cache[keys[text]] = polarity
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        polarities = [polarity_by_text[text] for text in texts]
+        sentiments = [sentiment_label(polarity) for polarity in polarities]
+        return polarities, sentiments
+
+    def score_texts(self, texts):
+        '''
+        Scores a list of unique, uncached texts, on the worker processes if the
+        batch is large enough.
+        '''
+        if self.backend.parallel_safe and self.workers > 1 and len(texts) >= self.parallel_threshold:
+            return list(self.get_executor().map(textblob_polarity, texts, chunksize=self.chunksize))
+        return self.backend.score_texts(texts)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up_worker)
+            return self.executor
+
+    def close(self):
+        '''
+        Shuts down the worker processes, if any.
+        '''
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+_shared_sentiment_scorer = None
+_shared_sentiment_scorer_lock = threading.Lock()
+
+def shared_sentiment_scorer():
+    '''
+    Returns the process-wide SentimentScorer used by scrapers which were not
+    given one explicitly, so its cache is shared between scrapers.
+    '''
+    global _shared_sentiment_scorer
+    with _shared_sentiment_scorer_lock:
+        if _shared_sentiment_scorer is None:
+            _shared_sentiment_scorer = SentimentScorer()
+        return _shared_sentiment_scorer
@@ -1,8 +1,38 @@
 import unittest
 import pandas as pd
+import numpy as np
 from datetime import datetime
 
 from twitter_scraper_class import TwitterScraper
+from database import connect_to_sqlite
+import sqlalchemy
+from orchestrator_class import ScrapeOrchestrator
+from rate_limiter_class import RateLimiter, DailyQuotaExceeded, default_rate_limiter
+from http_client_class import HttpClient
+from tweet_accumulator_class import TweetAccumulator
+from alphavantage_scraper_class import AlphaVantageScraper
+from schema import PRICE_DTYPES, CRYPTO_PRICE_DTYPES, SENTIMENT_DTYPE, price_frame
+from price_parser import parse_prices
+from bulk_writer_class import BulkWriter
+from watermark_store_class import WatermarkStore
+import create_tables
+from sentiment_scorer_class import SentimentScorer
+from sentiment_backends import LexiconBackend
+from text_cleaner import clean_text, clean_texts
+from textblob import TextBlob
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import threading
+import requests
+import time
+import re
+import json
+import os
+import tempfile
+from cassette_class import Cassette, CassetteMiss, RecordingHttpClient, ReplayHttpClient
+from clock_class import FakeClock
+from twitter_payload_generator_class import TwitterPayloadGenerator
+from metrics_class import Metrics, shared_metrics
+from daemon_class import AdaptivePollInterval, ScrapeDaemon
 
 class TestRTMetricsCalc(unittest.TestCase):
     '''
@@ -15,12 +45,20 @@ class TestRTMetricsCalc(unittest.TestCase):
     '''
     def setUp(self):
         '''
-        This function sets up an instance of the TwitterScraper class.
+        This function sets up an instance of the TwitterScraper class, backed by an
+        empty in-memory SQLite database instead of our MySQL database.
         It also loads two sample data files as pandas dataframes:
             - Fake original tweet expansion
             - Fake results
         '''
-        self.scraper = TwitterScraper(query_terms='palantir', db_table='palantir_tweets', use_since_id=False)
+        self.engine = connect_to_sqlite()
+        with self.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                'CREATE TABLE palantir_tweets (tweet_id INTEGER PRIMARY KEY, retweet_count INTEGER, like_count INTEGER, original_tweet_id INTEGER)'
+                ))
+        self.scraper = TwitterScraper(
+            query_terms='palantir', db_table='palantir_tweets', use_since_id=False, engine=self.engine, db_schema='main'
+            )
         self.ot_df = pd.read_csv('test_files/input_ot_df.csv', index_col=[0])
         self.results_df = pd.read_csv('test_files/input_results_df.csv', index_col=[0])
     
@@ -99,5 +137,1046 @@ class TestRTMetricsCalc(unittest.TestCase):
         # Assert that self.compare_cols() returned True for both likes and retweets.
         self.assertTrue(correct_likes & correct_rts)
 
+    def test_calculate_rt_metrics_with_history(self):
+        '''
+        This test determines if TwitterScraper.calculate_rt_metrics() only distributes
+        the likes and retweets an original tweet gained since it (and its earlier
+        retweets) were stored in the database.
+        '''
+        with self.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                'INSERT INTO palantir_tweets VALUES (21, 6000000, 60000, NULL), (100, 5, 10, 21), (101, 0, 0, 21)'
+                ))
+        results_df = self.scraper.calculate_rt_metrics(self.ot_df, self.results_df)
+
+        # Original tweet 21 is not added to the results again
+        self.assertEqual((results_df['tweet_id'] == 21).sum(), 0)
+
+        # 70000 - 60000 - 10 = 9990 new likes are distributed among the retweets
+        # with 23, 6, 564 and 54 followers.
+        retweets = results_df[results_df['original_tweet_id'] == 21].set_index('tweet_id')
+        expected_likes = {2: round(9990 * 23 / 647), 6: round(9990 * 6 / 647), 8: round(9990 * 564 / 647), 18: round(9990 * 54 / 647)}
+        for tweet_id, likes in expected_likes.items():
+            self.assertEqual(retweets.loc[tweet_id, 'like_count'], likes)
+
+class TestScrapeOrchestrator(unittest.TestCase):
+    '''
+    Testing ScrapeOrchestrator.run_cycle() without touching the APIs or the database.
+    ScrapeOrchestrator.scrape_company() is replaced so that one company fails.
+    '''
+    class StubOrchestrator(ScrapeOrchestrator):
+        def scrape_company(self, company):
+            if company == 'Broken':
+                raise ValueError('bad symbol')
+            return 10, 5
+
+    def setUp(self):
+        query_info = {company: {} for company in ['Apple', 'Broken', 'Target', 'Bitcoin']}
+        self.orchestrator = self.StubOrchestrator(query_info, engine=None, max_workers=3)
+
+    def test_failing_company_is_isolated(self):
+        '''
+        A company that raises is reported as an error while the others still run,
+        and the outcomes keep the order of query_info.
+        '''
+        outcomes = self.orchestrator.run_cycle()
+        self.assertEqual(list(outcomes), ['Apple', 'Broken', 'Target', 'Bitcoin'])
+        self.assertEqual(outcomes['Broken']['status'], 'error')
+        for company in ['Apple', 'Target', 'Bitcoin']:
+            self.assertEqual(outcomes[company], {'status': 'ok', 'tweets': 10, 'prices': 5})
+
+class TestRateLimiter(unittest.TestCase):
+    '''
+    Testing the token buckets, daily quotas and rate limit headers of RateLimiter.
+    '''
+    def setUp(self):
+        self.rate_limiter = RateLimiter()
+        self.rate_limiter.add_bucket('api', capacity=2, period=0.2, daily_quota=3)
+
+    def test_bucket_waits_for_refill(self):
+        '''
+        The first two requests go through immediately, the third waits for a token.
+        '''
+        self.assertEqual(self.rate_limiter.acquire('api'), 0)
+        self.assertEqual(self.rate_limiter.acquire('api'), 0)
+        self.assertGreater(self.rate_limiter.acquire('api'), 0)
+
+    def test_daily_quota(self):
+        '''
+        Once the daily quota is used up, acquire() raises instead of blocking.
+        '''
+        for _ in range(3):
+            self.rate_limiter.acquire('api')
+        with self.assertRaises(DailyQuotaExceeded):
+            self.rate_limiter.acquire('api')
+
+    def test_headers_block_until_reset(self):
+        '''
+        x-rate-limit-remaining of 0 blocks the bucket until x-rate-limit-reset.
+        '''
+        headers = {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(time.time() + 0.1)}
+        self.rate_limiter.update_from_headers('api', headers)
+        self.assertGreater(self.rate_limiter.acquire('api'), 0.05)
+
+    def test_default_limits_hold_from_the_start(self):
+        '''
+        The default buckets keep within 5 AlphaVantage requests in any minute and
+        450 Twitter requests in any 15 minutes, including the first.
+        '''
+        clock = FakeClock(datetime(2022, 1, 3, 15, 0))
+        rate_limiter = default_rate_limiter(clock=clock)
+        for api, limit, window in [('alphavantage', 5, 60), ('twitter', 450, 15*60)]:
+            start = clock.monotonic()
+            times = []
+            while clock.monotonic() - start < 2 * window:
+                rate_limiter.acquire(api)
+                times.append(clock.monotonic())
+            self.assertTrue(all(sum(t <= other < t + window for other in times) <= limit for t in times))
+
+class TestHttpClient(unittest.TestCase):
+    '''
+    Testing HttpClient's retries against a local HTTP server which fails the
+    first request of every pair with a 503.
+    '''
+    class FlakyHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        requests_seen = 0
+
+        def do_GET(self):
+            type(self).requests_seen += 1
+            if type(self).requests_seen % 2 == 1:
+                body = b'busy'
+                self.send_response(503)
+                self.send_header('Retry-After', '0')
+            else:
+                body = b'{"ok": true}'
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    def setUp(self):
+        self.FlakyHandler.requests_seen = 0
+        self.server = HTTPServer(('127.0.0.1', 0), self.FlakyHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        self.client = HttpClient(backoff_base=0.01, max_retries=1)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retries_server_errors(self):
+        '''
+        A 503 is retried and the following successful response is returned.
+        '''
+        response = self.client.get(self.url)
+        self.assertEqual(response.json(), {'ok': True})
+        self.assertEqual(self.FlakyHandler.requests_seen, 2)
+
+    def test_raises_when_retries_run_out(self):
+        '''
+        Without retries, the 503 is raised as an HTTPError.
+        '''
+        self.client.max_retries = 0
+        with self.assertRaises(requests.HTTPError):
+            self.client.get(self.url)
+
+class TestPagination(unittest.TestCase):
+    '''
+    Testing TwitterScraper.aggregate_query_results() with a fake query_twitter()
+    which serves two pages of Tweets and then an empty page.
+    '''
+    @staticmethod
+    def make_page(first_id, count):
+        tweets, users = [], []
+        for tweet_id in range(first_id + count - 1, first_id - 1, -1):
+            tweet = {
+                'id': str(tweet_id),
+                'text': f'Tweet number {tweet_id} is great',
+                'created_at': f'2022-01-0{1 + tweet_id % 9}T12:00:00.000Z',
+                'author_id': str(tweet_id % 7),
+                'public_metrics': {'like_count': tweet_id % 5, 'retweet_count': 0}
+            }
+            if tweet_id % 3 == 0:
+                tweet['referenced_tweets'] = [{'type': 'retweeted', 'id': '1'}]
+            tweets.append(tweet)
+        for author_id in range(7):
+            users.append({'id': str(author_id), 'public_metrics': {'followers_count': 10 * author_id}})
+        referenced = [{
+            'id': '1', 'text': 'The original', 'created_at': '2021-12-31T12:00:00.000Z',
+            'author_id': '1', 'public_metrics': {'like_count': 50, 'retweet_count': first_id}
+        }]
+        return {'data': tweets, 'includes': {'users': users, 'tweets': referenced}, 'meta': {'result_count': count}}
+
+    def fake_query_twitter(self, query_terms, since_id=None, until_id=None):
+        self.until_ids.append(until_id)
+        pages = {None: self.make_page(200, 10), 199: self.make_page(100, 10)}
+        return pages.get(until_id, {'meta': {'result_count': 0}})
+
+    def run_scraper(self, pipelined):
+        self.until_ids = []
+        scraper = TwitterScraper(query_terms='palantir', db_table='palantir_tweets', use_since_id=False, pipelined=pipelined)
+        scraper.query_twitter = self.fake_query_twitter
+        return scraper.aggregate_query_results('palantir', requests_limit=15)
+
+    def test_pipelined_matches_serial(self):
+        '''
+        Both modes follow the same until_ids and return the same frames.
+        '''
+        serial_results, serial_ots = self.run_scraper(pipelined=False)
+        serial_until_ids = self.until_ids
+        pipelined_results, pipelined_ots = self.run_scraper(pipelined=True)
+
+        self.assertEqual(serial_until_ids, [None, 199, 99])
+        self.assertEqual(self.until_ids, serial_until_ids)
+        pd.testing.assert_frame_equal(
+            serial_results.drop(columns='collection_time'), pipelined_results.drop(columns='collection_time')
+            )
+        pd.testing.assert_frame_equal(
+            serial_ots.drop(columns='collection_time'), pipelined_ots.drop(columns='collection_time')
+            )
+        self.assertEqual(len(serial_results), 20)
+        # The original tweet keeps the metrics from the most recently fetched page
+        self.assertEqual(serial_ots['retweet_count'].tolist(), [100])
+
+class TestReplay(unittest.TestCase):
+    '''
+    Testing that a cycle recorded to a cassette replays offline, on a fake
+    clock and a SQLite database, with the same results.
+    '''
+    query_info = {
+        'Palantir': {'symbol': 'PLTR', 'query_terms': 'palantir', 'tweet_table': 'palantir_tweets', 'stock_table': 'palantir_prices'}
+    }
+
+    class LiveHttpClient():
+        '''
+        Stands in for the live APIs while recording, waiting for the rate
+        limiter like HttpClient.
+        '''
+        def get(self, url, params=None, auth=None, rate_limiter=None, api=None):
+            if rate_limiter is not None:
+                rate_limiter.acquire(api)
+            if api == 'twitter':
+                pages = {None: TestPagination.make_page(200, 10), '199': TestPagination.make_page(100, 10)}
+                payload = pages.get(params.get('until_id') and str(params['until_id']), {'meta': {'result_count': 0}})
+            else:
+                prices = {'1. open': '20.5', '2. high': '21', '3. low': '20', '4. close': '20.75', '5. volume': '1000'}
+                payload = {'Time Series (1min)': {f'2022-01-03 10:0{minute}:00': prices for minute in range(5)}}
+            response = requests.Response()
+            response.status_code = 200
+            response._content = json.dumps(payload).encode()
+            return response
+
+        def close(self):
+            pass
+
+    def run_cycle(self, http_client, clock, engine=None, watermarks=None):
+        if engine is None:
+            engine = connect_to_sqlite()
+            create_tables.migrate(engine, self.query_info)
+        orchestrator = ScrapeOrchestrator(
+            self.query_info, engine, http_client=http_client, db_schema='main', clock=clock,
+            sentiment_scorer=SentimentScorer(), watermarks=watermarks
+            )
+        outcomes = orchestrator.run_cycle()
+        tweets = pd.read_sql_query('SELECT * FROM palantir_tweets ORDER BY tweet_id', engine)
+        prices = pd.read_sql_query('SELECT * FROM palantir_prices ORDER BY date', engine)
+        return outcomes, tweets, prices
+
+    def test_replay_matches_recording(self):
+        start = datetime(2022, 1, 3, 15, 0)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cycle.json')
+            recorder = RecordingHttpClient(self.LiveHttpClient(), path)
+            recorded = self.run_cycle(recorder, FakeClock(start))
+            recorder.save()
+
+            with open(path) as f:
+                self.assertNotIn('apikey=None', f.read())
+            replay_client = ReplayHttpClient(path)
+            replayed = self.run_cycle(replay_client, FakeClock(start))
+            replay_client.close()
+
+        self.assertEqual(recorded[0], {'Palantir': {'status': 'ok', 'tweets': 21, 'prices': 5}})
+        self.assertEqual(replayed[0], recorded[0])
+        pd.testing.assert_frame_equal(replayed[1], recorded[1])
+        pd.testing.assert_frame_equal(replayed[2], recorded[2])
+        # The second page waits 2 seconds of fake time for the Twitter rate limiter
+        self.assertEqual(sorted(recorded[1]['collection_time'].unique()), ['2022-01-03 15:00:00.000000', '2022-01-03 15:00:02.000000'])
+
+    def test_price_error_keeps_tweets(self):
+        class QuotaHttpClient(self.LiveHttpClient):
+            def get(self, url, params=None, auth=None, rate_limiter=None, api=None):
+                if api == 'alphavantage':
+                    raise DailyQuotaExceeded('Daily quota of 500 requests used up')
+                return super().get(url, params=params, auth=auth, rate_limiter=rate_limiter, api=api)
+
+        outcomes, tweets, prices = self.run_cycle(QuotaHttpClient(), FakeClock(datetime(2022, 1, 3, 15, 0)))
+        self.assertEqual(outcomes['Palantir']['status'], 'error')
+        # The tweets were written before the prices were scraped
+        self.assertEqual(len(tweets), 21)
+        self.assertEqual(len(prices), 0)
+
+    def test_replay_on_empty_database(self):
+        # The recording database already has tweets and prices, so the recorded
+        # requests have a since_id and ask for compact prices
+        engine = connect_to_sqlite()
+        create_tables.migrate(engine, self.query_info)
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text("INSERT INTO palantir_tweets (tweet_id, datetime) VALUES (50, '2022-01-03 09:00:00')"))
+            connection.execute(sqlalchemy.text("INSERT INTO palantir_prices (date) VALUES ('2022-01-03 09:00:00')"))
+
+        start = datetime(2022, 1, 3, 15, 0)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cycle.json')
+            watermarks = WatermarkStore(engine)
+            recorder = RecordingHttpClient(self.LiveHttpClient(), path, watermarks=watermarks)
+            recorded = self.run_cycle(recorder, FakeClock(start), engine=engine, watermarks=watermarks)
+            recorder.save()
+
+            cassette = Cassette.load(path)
+            self.assertEqual(cassette.watermarks['palantir_tweets'], {'tweet_id': 50})
+            interactions = list(Cassette.iter_interactions(path))
+            self.assertTrue(all('since_id' in interaction['request']['params'] for interaction in interactions[:3]))
+
+            # Replayed on an empty database, seeded with the recorded watermarks
+            replay_engine = connect_to_sqlite()
+            create_tables.migrate(replay_engine, self.query_info)
+            replay_watermarks = WatermarkStore(replay_engine)
+            replay_watermarks.seed(cassette.watermarks)
+            replayed = self.run_cycle(ReplayHttpClient(cassette), FakeClock(start), engine=replay_engine, watermarks=replay_watermarks)
+            cassette.close()
+
+        self.assertEqual(recorded[0], {'Palantir': {'status': 'ok', 'tweets': 21, 'prices': 5}})
+        self.assertEqual(replayed[0], recorded[0])
+        # The seeded watermarks give way to the replayed writes
+        self.assertEqual(replay_watermarks.get_tweet_id('palantir_tweets'), 209)
+
+    def test_unknown_request(self):
+        with self.assertRaises(CassetteMiss):
+            ReplayHttpClient(Cassette()).get('https://api.twitter.com/2/tweets/search/recent', params={'query': 'palantir'})
+
+    def test_fake_clock_skips_waits(self):
+        clock = FakeClock(datetime(2022, 1, 3, 15, 0))
+        rate_limiter = RateLimiter(clock=clock)
+        rate_limiter.add_bucket('alphavantage', capacity=5, period=60)
+        for _ in range(15):
+            rate_limiter.acquire('alphavantage')
+        # Two waits of a minute, which took no time at all
+        self.assertEqual(clock.now(), pd.Timestamp('2022-01-03 15:02:00'))
+
+class TestPayloadGenerator(unittest.TestCase):
+    '''
+    Testing that TwitterPayloadGenerator streams the same valid pages for the
+    same seed, and that its cassettes replay through a whole Twitter scrape.
+    '''
+    def setUp(self):
+        self.generator = TwitterPayloadGenerator(tweets=2500, seed=7, chunk_size=1000)
+
+    def test_pages(self):
+        pages = list(self.generator.pages())
+        self.assertEqual(pages[0], next(TwitterPayloadGenerator(tweets=2500, seed=7, chunk_size=1000).pages()))
+        self.assertEqual(len(pages), 25)
+
+        tweet_ids = [int(tweet['id']) for page in pages for tweet in page['data']]
+        self.assertEqual(tweet_ids, sorted(set(tweet_ids), reverse=True))
+        for page in pages:
+            included = {tweet['id'] for tweet in page['includes'].get('tweets', [])}
+            users = {user['id'] for user in page['includes']['users']}
+            for tweet in page['data']:
+                self.assertIn(tweet['author_id'], users)
+                for reference in tweet.get('referenced_tweets', []):
+                    self.assertIn(reference['id'], included)
+
+        scraper = TwitterScraper(query_terms='', db_table='palantir_tweets', engine=connect_to_sqlite(), db_schema='main')
+        results_df, referenced_df = scraper.process_page(pages[0])
+        self.assertEqual(len(results_df), 100)
+        self.assertTrue(results_df['original_tweet_id'].notna().any())
+
+    def test_replay_cassette(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'generated.json')
+            self.assertEqual(self.generator.write_cassette(path, 'palantir'), 25)
+            http_client = ReplayHttpClient(path)
+            # Only the offsets of the responses are loaded, not the pages
+            offsets = [offset for responses in http_client.cassette.responses.values() for offset in responses]
+            self.assertEqual(len(offsets), 26)
+            self.assertTrue(all(isinstance(offset, int) for offset in offsets))
+            scraper = TwitterScraper(
+                query_terms='palantir', db_table='palantir_tweets', use_since_id=False, requests_limit=30,
+                engine=connect_to_sqlite(), db_schema='main', http_client=http_client,
+                rate_limiter=RateLimiter()
+                )
+            results_df, original_tweet_df = scraper.aggregate_query_results('palantir', requests_limit=30)
+            http_client.close()
+        self.assertEqual(len(results_df), 2500)
+        self.assertTrue(results_df['tweet_id'].is_unique)
+
+class TestTweetParser(unittest.TestCase):
+    '''
+    Testing that the columnar parser builds typed columns and converts created_at
+    like the original pd.to_datetime/tz_convert/tz_localize steps.
+    '''
+    def test_parse_page(self):
+        page = TestPagination().make_page(200, 10)
+        response_df = TwitterScraper(query_terms='palantir', db_table='palantir_tweets').process_query_results(
+            page['data'], page['includes']['users'][1:] # Author 0 is missing from the users expansion
+            )
+
+        created_at = pd.Series([tweet['created_at'] for tweet in page['data']])
+        expected_datetimes = pd.to_datetime(created_at).dt.tz_convert(tz='US/Eastern').dt.tz_localize(tz=None)
+        self.assertEqual(sorted(response_df['datetime']), sorted(expected_datetimes))
+
+        for column in ['tweet_id', 'author_id', 'like_count', 'retweet_count']:
+            self.assertEqual(response_df[column].dtype, 'Int64')
+        self.assertEqual(response_df['original_tweet_id'].dtype, 'Int64')
+        self.assertEqual(response_df['polarity'].dtype, 'float32')
+        self.assertEqual(response_df['sentiment'].dtype, SENTIMENT_DTYPE)
+        self.assertEqual(response_df['original_tweet_id'].notna().sum(), 3)
+        followers = response_df.set_index('tweet_id')['followers_count']
+        self.assertEqual(followers[209], 60)
+        self.assertTrue(pd.isna(followers[203])) # 203 % 7 == 0
+
+class TestPriceSchema(unittest.TestCase):
+    '''
+    Testing that AlphaVantageScraper.process_results() parses prices into the
+    dtypes of schema.py and drops prices already in the database.
+    '''
+    def test_process_results(self):
+        engine = connect_to_sqlite()
+        pd.DataFrame({'date': [datetime(2022, 1, 3, 10, 0)]}).to_sql('bitcoin_prices', engine, index=False)
+        scraper = AlphaVantageScraper('bitcoin_prices', 'BTC', engine=engine, db_schema='main')
+
+        prices = {'1. open': '46000.5', '2. high': '46100', '3. low': '45900.25', '4. close': '46050', '5. volume': '120'}
+        results_df = scraper.process_results({'2022-01-03 10:01:00': prices, '2022-01-03 10:00:00': prices})
+
+        self.assertEqual(results_df['date'].tolist(), [pd.Timestamp('2022-01-03 10:01:00')])
+        # The default endpoint is CRYPTO_INTRADAY, whose volumes are fractional
+        self.assertEqual(results_df.dtypes.to_dict(), {column: np.dtype(dtype) for column, dtype in CRYPTO_PRICE_DTYPES.items()})
+
+    def test_crypto_volumes_are_not_truncated(self):
+        prices = {'1. open': '46000.5', '2. high': '46100', '3. low': '45900.25', '4. close': '46050', '5. volume': '0.8731'}
+        time_series = {'2022-01-03 10:01:00': prices}
+        crypto = AlphaVantageScraper('bitcoin_prices', 'BTC', endpoint='CRYPTO_INTRADAY', engine=connect_to_sqlite(), db_schema='main')
+        self.assertEqual(crypto.process_results(time_series, cutoff_date=datetime(2022, 1, 3))['5. volume'].tolist(), [0.8731])
+        # Stock volumes are integers, and a fractional one is an error rather than truncated
+        with self.assertRaises(ValueError):
+            parse_prices(time_series)
+
+    def test_parse_prices_matches_frame(self):
+        dates = pd.date_range('2022-01-03 09:30', periods=50, freq='min')[::-1] # Newest first, as AlphaVantage sends them
+        time_series = {
+            f'{date:%Y-%m-%d %H:%M:%S}': {
+                '1. open': f'{100 + i / 4}', '2. high': f'{101 + i / 4}', '3. low': f'{99 + i / 4}',
+                '4. close': f'{100.5 + i / 4}', '5. volume': f'{1000 + i}'
+            }
+            for i, date in enumerate(dates)
+        }
+        cutoff_date = datetime(2022, 1, 3, 10, 0)
+
+        # The original processing: build a frame of strings, sort it, then filter it
+        expected = pd.DataFrame.from_dict(time_series, orient='index').reset_index().rename(columns={'index': 'date'})
+        expected = price_frame(expected).sort_values(by='date')
+        expected = expected[expected['date'] > cutoff_date].reset_index(drop=True)
+
+        pd.testing.assert_frame_equal(parse_prices(time_series, cutoff_date), expected)
+        self.assertEqual(len(parse_prices(time_series)), 50)
+        self.assertEqual(len(parse_prices(time_series, dates[0])), 0)
+
+class TestOutputsize(unittest.TestCase):
+    '''
+    Testing that AlphaVantageScraper asks for outputsize=compact when the newest
+    bars reach the cutoff date, and for outputsize=full otherwise.
+    '''
+    class FakeHttpClient():
+        def __init__(self, time_series):
+            self.time_series = time_series
+            self.urls = []
+
+        def get(self, url, rate_limiter=None, api=None):
+            self.urls.append(url)
+            bars = self.time_series if 'outputsize=full' in url else dict(list(self.time_series.items())[:100])
+            response = requests.Response()
+            response._content = json.dumps({'Time Series (1min)': bars}).encode()
+            return response
+
+    def setUp(self):
+        self.engine = connect_to_sqlite()
+        dates = pd.date_range('2022-01-03 09:30', periods=300, freq='min')[::-1]
+        prices = {'1. open': '1', '2. high': '1', '3. low': '1', '4. close': '1', '5. volume': '1'}
+        self.time_series = {f'{date:%Y-%m-%d %H:%M:%S}': prices for date in dates}
+
+    def run_scraper(self, cutoff_date, now):
+        pd.DataFrame({'date': [cutoff_date]}).to_sql('palantir_prices', self.engine, index=False, if_exists='replace')
+        http_client = self.FakeHttpClient(self.time_series)
+        scraper = AlphaVantageScraper(
+            'palantir_prices', 'PLTR', endpoint='TIME_SERIES_INTRADAY', engine=self.engine, db_schema='main',
+            http_client=http_client, rate_limiter=RateLimiter()
+            )
+        scraper.now = lambda: now
+        results_df = scraper.run()
+        return [re.search('outputsize=(\\w+)', url).group(1) for url in http_client.urls], results_df
+
+    def test_compact_when_recent(self):
+        outputsizes, results_df = self.run_scraper(datetime(2022, 1, 3, 13, 0), datetime(2022, 1, 3, 14, 29))
+        self.assertEqual(outputsizes, ['compact'])
+        self.assertEqual(len(results_df), 89)
+
+    def test_full_when_behind(self):
+        outputsizes, results_df = self.run_scraper(datetime(2022, 1, 3, 10, 0), datetime(2022, 1, 3, 14, 29))
+        self.assertEqual(outputsizes, ['full'])
+        self.assertEqual(len(results_df), 269)
+
+    def test_full_when_compact_falls_short(self):
+        # The clock says compact is enough, but the newest 100 bars do not reach the cutoff
+        outputsizes, results_df = self.run_scraper(datetime(2022, 1, 3, 12, 0), datetime(2022, 1, 3, 12, 30))
+        self.assertEqual(outputsizes, ['compact', 'full'])
+        self.assertEqual(len(results_df), 149)
+
+    def test_backfill_runs_once(self):
+        class CountingHttpClient(TestReplay.LiveHttpClient):
+            urls = []
+            def get(self, url, params=None, auth=None, rate_limiter=None, api=None):
+                self.urls.append(url)
+                return super().get(url, params=params, auth=auth, rate_limiter=rate_limiter, api=api)
+
+        create_tables.migrate(self.engine, TestReplay.query_info)
+        http_client = CountingHttpClient()
+        orchestrator = ScrapeOrchestrator(
+            TestReplay.query_info, self.engine, http_client=http_client, db_schema='main', backfill_months=2,
+            clock=FakeClock(datetime(2022, 1, 3, 15, 0)), sentiment_scorer=SentimentScorer()
+            )
+        for _ in range(2):
+            orchestrator.run_cycle()
+        months = [re.search('month=([0-9-]+)', url).group(1) for url in http_client.urls if 'month=' in url]
+        self.assertEqual(sorted(months), ['2021-12', '2022-01'])
+
+class TweetTableTestCase(unittest.TestCase):
+    '''
+    Base class of the tests which write tweets to a SQLite tweet table.
+    '''
+    def setUp(self):
+        self.engine = connect_to_sqlite()
+        metadata = sqlalchemy.MetaData()
+        sqlalchemy.Table(
+            'palantir_tweets', metadata,
+            sqlalchemy.Column('tweet_id', sqlalchemy.BigInteger, primary_key=True),
+            sqlalchemy.Column('tweet_text', sqlalchemy.String(255)),
+            sqlalchemy.Column('retweet_count', sqlalchemy.Integer),
+            sqlalchemy.Column('like_count', sqlalchemy.Integer),
+            sqlalchemy.Column('original_tweet_id', sqlalchemy.BigInteger)
+            )
+        metadata.create_all(self.engine)
+
+    def tweets(self, like_counts):
+        return pd.DataFrame({
+            'tweet_id': pd.array([1, 2, 3], dtype='Int64'),
+            'tweet_text': ['first', 'second', 'third'],
+            'retweet_count': pd.array([0, 1, None], dtype='Int64'),
+            'like_count': like_counts,
+            'original_tweet_id': pd.array([None, 1, 1], dtype='Int64')
+        })
+
+class TestBulkWriter(TweetTableTestCase):
+    '''
+    Testing that BulkWriter upserts tweets on SQLite and builds
+    INSERT ... ON DUPLICATE KEY UPDATE statements for MySQL.
+    '''
+    def setUp(self):
+        super().setUp()
+        self.writer = BulkWriter(self.engine, batch_size=2)
+
+    def test_rewrite_updates_counts(self):
+        self.assertEqual(self.writer.write_tweets(self.tweets([1, 2, 3]), 'palantir_tweets'), 3)
+        # Writing the same tweets again updates their like counts instead of failing
+        self.writer.write_tweets(self.tweets([10, 20, 30]), 'palantir_tweets')
+
+        stored = pd.read_sql_query('SELECT * FROM palantir_tweets ORDER BY tweet_id', self.engine)
+        self.assertEqual(stored['tweet_id'].tolist(), [1, 2, 3])
+        self.assertEqual(stored['like_count'].tolist(), [10, 20, 30])
+        self.assertEqual(stored['tweet_text'].tolist(), ['first', 'second', 'third'])
+        self.assertTrue(pd.isna(stored['retweet_count'][2]))
+
+    def test_mysql_statement(self):
+        class RecordingConnection():
+            def execute(self, statement, *args):
+                self.statement = statement
+
+        # Creating a MySQL engine does not connect to a server
+        mysql_writer = BulkWriter(sqlalchemy.create_engine('mysql+pymysql://'))
+        connection = RecordingConnection()
+        table = self.writer.get_table('palantir_tweets')
+        records = self.writer.get_records(self.tweets([1, 2, 3]))
+        mysql_writer.execute_upsert(connection, table, records, ['tweet_id'], ['like_count'])
+
+        sql = str(connection.statement.compile(dialect=mysql_writer.engine.dialect))
+        self.assertIn('ON DUPLICATE KEY UPDATE like_count = VALUES(like_count)', sql)
+        # One multi-row INSERT for the whole batch
+        self.assertEqual(sql.count('(%(tweet_id_m'), 3)
+
+    def test_load_data_text(self):
+        tweets = self.tweets([1, 2, 3])
+        tweets['tweet_text'] = ['NULL', 'tab\there\nand a \\N', None]
+        text = self.writer.get_load_data_text(tweets)
+
+        # Read the file back as LOAD DATA does with MySQL's default options
+        unescape = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0'}
+        def read_field(field):
+            if field == '\\N':
+                return None
+            return re.sub(r'\\(.)', lambda match: unescape.get(match.group(1), match.group(1)), field)
+        rows = [[read_field(field) for field in line.split('\t')] for line in text.splitlines()]
+
+        columns = list(tweets.columns)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual([row[columns.index('tweet_text')] for row in rows], ['NULL', 'tab\there\nand a \\N', None])
+        self.assertEqual([row[columns.index('retweet_count')] for row in rows], ['0', '1', None])
+        self.assertEqual(rows[0][columns.index('tweet_id')], '1')
+
+class TestWatermarkStore(TweetTableTestCase):
+    '''
+    Testing that the since_id and cutoff date come from the watermark store,
+    which BulkWriter advances, and that it is loaded with a single query.
+    '''
+    def setUp(self):
+        super().setUp()
+        self.watermarks = WatermarkStore(self.engine)
+        self.writer = BulkWriter(self.engine, watermarks=self.watermarks)
+        self.scraper = TwitterScraper(
+            query_terms='palantir', db_table='palantir_tweets', engine=self.engine, db_schema='main',
+            watermarks=self.watermarks
+            )
+
+    def count_queries(self, function):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        sqlalchemy.event.listen(self.engine, 'before_cursor_execute', listener)
+        try:
+            function()
+        finally:
+            sqlalchemy.event.remove(self.engine, 'before_cursor_execute', listener)
+        return len(statements)
+
+    def test_empty_table(self):
+        self.assertIsNone(self.scraper.get_since_id())
+        self.assertIsNone(self.scraper.query_since_id())
+
+    def test_write_advances_watermark(self):
+        self.writer.write_tweets(self.tweets([1, 2, 3]), 'palantir_tweets')
+        self.assertEqual(self.scraper.get_since_id(), 3)
+
+        # Watermarks never move backwards
+        older = self.tweets([1, 2, 3]).iloc[:1]
+        self.writer.write_tweets(older, 'palantir_tweets')
+
+        # A new cycle loads all watermarks with one query, then serves them from the cache
+        self.watermarks.invalidate()
+        self.assertEqual(self.count_queries(lambda: [self.scraper.get_since_id() for _ in range(5)]), 1)
+        self.assertEqual(self.scraper.get_since_id(), 3)
+
+    def test_fallback_seeds_watermark(self):
+        # Tweets written before there was a watermark store
+        BulkWriter(self.engine).write_tweets(self.tweets([1, 2, 3]), 'palantir_tweets')
+        self.assertEqual(self.scraper.get_since_id(), 3)
+        self.watermarks.invalidate()
+        self.assertEqual(self.count_queries(self.scraper.get_since_id), 1)
+
+    def test_empty_table_is_cached(self):
+        self.assertIsNone(self.scraper.get_since_id())
+        # Neither the watermarks nor the empty table are queried again
+        self.assertEqual(self.count_queries(lambda: [self.scraper.get_since_id() for _ in range(5)]), 0)
+        self.writer.write_tweets(self.tweets([1, 2, 3]), 'palantir_tweets')
+        self.assertEqual(self.scraper.get_since_id(), 3)
+
+    def test_advance_compares_in_sql(self):
+        # Another process moved the watermark past this process' cache
+        self.writer.write_tweets(self.tweets([1, 2, 3]), 'palantir_tweets')
+        other = WatermarkStore(self.engine)
+        with self.engine.begin() as connection:
+            other.advance(connection, 'palantir_tweets', 'tweet_id', 10)
+
+        with self.engine.begin() as connection:
+            self.assertEqual(self.watermarks.advance(connection, 'palantir_tweets', 'tweet_id', 5), 10)
+        self.watermarks.invalidate()
+        self.assertEqual(self.scraper.get_since_id(), 10)
+
+class TestMigrations(unittest.TestCase):
+    '''
+    Testing that create_tables.migrate() creates and upgrades the tables of
+    every company, and does nothing when run again.
+    '''
+    query_info = {
+        'Palantir': {'tweet_table': 'palantir_tweets', 'stock_table': 'palantir_prices'},
+        'Bitcoin': {'tweet_table': 'bitcoin_tweets', 'stock_table': 'bitcoin_prices'}
+    }
+
+    def test_migrate(self):
+        engine = connect_to_sqlite()
+        # A price table from before the migrations, with the misspelled volume column
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text('CREATE TABLE palantir_prices (date DATETIME PRIMARY KEY, "5. volumne" INTEGER)'))
+
+        applied = create_tables.migrate(engine, self.query_info)
+        self.assertEqual(applied['palantir_tweets'], [1, 2, 3])
+        self.assertEqual(applied['palantir_prices'], [1, 2, 3])
+
+        inspector = sqlalchemy.inspect(engine)
+        indexed = {tuple(index['column_names']) for index in inspector.get_indexes('bitcoin_tweets')}
+        self.assertEqual(indexed, {('original_tweet_id',), ('datetime',), ('author_id',)})
+        self.assertIn('5. volume', [column['name'] for column in inspector.get_columns('palantir_prices')])
+
+        # Running again applies nothing
+        applied = create_tables.migrate(engine, self.query_info)
+        self.assertEqual(sum(len(versions) for versions in applied.values()), 0)
+
+class TestUnifiedTables(unittest.TestCase):
+    '''
+    Testing the unified tweets and prices tables: company tables are copied
+    into them, and every symbol gets its own rows, lookups and watermark.
+    '''
+    query_info = {
+        'Palantir': {'symbol': 'PLTR', 'tweet_table': 'palantir_tweets', 'stock_table': 'palantir_prices'},
+        'Bitcoin': {'symbol': 'BTC', 'tweet_table': 'bitcoin_tweets', 'stock_table': 'bitcoin_prices'}
+    }
+
+    def setUp(self):
+        self.engine = connect_to_sqlite()
+        create_tables.migrate(self.engine, self.query_info)
+        self.applied = create_tables.migrate(self.engine, self.query_info, unified=True)
+        self.symbol_ids = create_tables.get_symbol_ids(self.engine)
+        self.watermarks = WatermarkStore(self.engine)
+        self.writer = BulkWriter(self.engine, watermarks=self.watermarks)
+
+    def tweets(self, tweet_ids, like_count):
+        return pd.DataFrame({
+            'tweet_id': pd.array(tweet_ids, dtype='Int64'),
+            'datetime': pd.to_datetime(['2022-03-01 10:00'] * len(tweet_ids)),
+            'like_count': pd.array([like_count] * len(tweet_ids), dtype='Int64'),
+            'original_tweet_id': pd.array([None] * len(tweet_ids), dtype='Int64')
+        })
+
+    def test_copy_company_tables(self):
+        self.assertEqual(self.applied['tweets'], [1, 2])
+        self.assertEqual(set(self.symbol_ids), {'PLTR', 'BTC'})
+
+        self.writer.write_tweets(self.tweets([1, 2], 5), 'palantir_tweets')
+        self.writer.write_tweets(self.tweets([2, 3, 4], 7), 'bitcoin_tweets')
+        prices = pd.DataFrame({'date': pd.to_datetime(['2022-03-01 10:00', '2022-03-01 10:01']), '4. close': [1.0, 2.0]})
+        self.writer.write_prices(prices, 'palantir_prices')
+
+        copied = create_tables.copy_company_tables(self.engine, self.query_info)
+        self.assertEqual(copied, {'palantir_tweets': 2, 'palantir_prices': 2, 'bitcoin_tweets': 3, 'bitcoin_prices': 0})
+        # Copying again skips the rows already copied
+        copied = create_tables.copy_company_tables(self.engine, self.query_info)
+        self.assertEqual(sum(copied.values()), 0)
+
+        stored = pd.read_sql_query('SELECT symbol_id, tweet_id FROM tweets ORDER BY symbol_id, tweet_id', self.engine)
+        self.assertEqual(stored.groupby('symbol_id')['tweet_id'].apply(list).to_dict(), {
+            self.symbol_ids['PLTR']: [1, 2], self.symbol_ids['BTC']: [2, 3, 4]
+        })
+
+    def test_symbols_are_separate(self):
+        pltr, btc = self.symbol_ids['PLTR'], self.symbol_ids['BTC']
+        self.writer.write_tweets(self.tweets([1, 2], 5), 'tweets', symbol_id=pltr)
+        self.writer.write_tweets(self.tweets([2, 3], 7), 'tweets', symbol_id=btc)
+        # Writing again updates the rows of the same symbol only
+        self.writer.write_tweets(self.tweets([2], 6), 'tweets', symbol_id=pltr)
+
+        scrapers = {
+            symbol_id: TwitterScraper(
+                query_terms='', db_table='tweets', engine=self.engine, db_schema='main', watermarks=self.watermarks,
+                symbol_id=symbol_id
+                )
+            for symbol_id in [pltr, btc]
+        }
+        self.assertEqual(scrapers[pltr].get_since_id(), 2)
+        self.assertEqual(scrapers[btc].get_since_id(), 3)
+        self.assertEqual(scrapers[btc].query_since_id(), 3)
+        self.assertEqual(scrapers[pltr].ot_metrics_in_db_bulk([1, 2, 3])['like_count'].tolist(), [5, 6])
+        self.assertEqual(scrapers[btc].ot_metrics_in_db_bulk([1, 2, 3])['like_count'].tolist(), [7, 7])
+
+class TestMetrics(unittest.TestCase):
+    '''
+    Testing the stage timings and counts, their tags and their export.
+    '''
+    def test_tags_and_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            metrics = Metrics(log_path=os.path.join(directory, 'metrics.jsonl'))
+            with metrics.tags(run_id='abc123', company='Palantir'):
+                with metrics.timer('clean'):
+                    pass
+                metrics.observe('rate_limit_wait', 2.5, api='twitter')
+                metrics.count('rows_written', 10, table='palantir_tweets')
+            metrics.count('rows_written', 5, table='palantir_tweets')
+            metrics.write_prometheus(os.path.join(directory, 'metrics.prom'))
+
+            with open(os.path.join(directory, 'metrics.jsonl')) as f:
+                events = [json.loads(line) for line in f]
+            with open(os.path.join(directory, 'metrics.prom')) as f:
+                text = f.read()
+
+        self.assertEqual([event['stage'] for event in events[:2]], ['clean', 'rate_limit_wait'])
+        self.assertEqual(events[1]['run_id'], 'abc123')
+        self.assertEqual(events[1]['company'], 'Palantir')
+        self.assertNotIn('run_id', events[3])
+
+        # The run_id is only exported as the last run
+        self.assertIn('scraper_stage_seconds_total{api="twitter",company="Palantir",stage="rate_limit_wait"} 2.500000', text)
+        self.assertIn('scraper_stage_calls_total{company="Palantir",stage="clean"} 1', text)
+        self.assertIn('scraper_rows_written_total{company="Palantir",table="palantir_tweets"} 10', text)
+        self.assertIn('scraper_rows_written_total{table="palantir_tweets"} 5', text)
+        self.assertIn('scraper_last_run_info{run_id="abc123"} 1', text)
+        self.assertEqual(text.count('run_id'), 1)
+
+    def test_cycle_stages(self):
+        start = datetime(2022, 1, 3, 15, 0)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cycle.json')
+            recorder = RecordingHttpClient(TestReplay.LiveHttpClient(), path)
+            TestReplay().run_cycle(recorder, FakeClock(start))
+            recorder.save()
+
+            metrics = shared_metrics()
+            metrics.reset()
+            TestReplay().run_cycle(ReplayHttpClient(path), FakeClock(start))
+            stage_seconds, stage_calls, counters = metrics.snapshot()
+
+        stages = {dict(key)['stage'] for key in stage_calls if dict(key).get('company') == 'Palantir'}
+        self.assertTrue({
+            'http_fetch', 'json_parse', 'clean', 'sentiment', 'rt_metrics', 'price_parse', 'db_lookup', 'db_write',
+            'rate_limit_wait', 'company'
+            } <= stages)
+        # Three Twitter requests (two pages and the empty one) and one AlphaVantage request
+        http_calls = {dict(key)['api']: calls for key, calls in stage_calls.items() if dict(key)['stage'] == 'http_fetch'}
+        self.assertEqual(http_calls, {'twitter': 3, 'alphavantage': 1})
+        self.assertEqual(counters[('tweets_scraped', (('company', 'Palantir'),))], 21)
+
+class TestDaemon(unittest.TestCase):
+    '''
+    Testing the adaptive poll intervals, and the daemon's schedule, reload and
+    shutdown on a fake clock.
+    '''
+    class FakeOrchestrator():
+        '''
+        Stands in for ScrapeOrchestrator: every poll of a company finds the
+        same number of tweets or prices. Tweet polls are recorded in polled
+        and price polls in price_polls.
+        '''
+        unified = False
+        metrics_path = None
+
+        def __init__(self, query_info, activity):
+            self.query_info = query_info
+            self.activity = activity
+            self.polled = []
+            self.price_polls = []
+            self.on_poll = None
+
+        def _scrape_company_isolated(self, company, run_id=None, tweets=True, prices=True):
+            (self.polled if tweets else self.price_polls).append(company)
+            if self.on_poll is not None:
+                self.on_poll(company)
+            tweet_count, price_count = self.activity.get(company, (0, 0))
+            return {'status': 'ok', 'tweets': tweet_count if tweets else 0, 'prices': price_count if prices else 0}
+
+    def test_interval(self):
+        busy = AdaptivePollInterval(min_interval=60, max_interval=3600)
+        self.assertEqual(busy.update(10000, 0, None), 60)
+        self.assertEqual(busy.update(1000, 5, 120), 60)
+        quiet = AdaptivePollInterval(min_interval=60, max_interval=3600)
+        self.assertEqual(quiet.update(0, 0, 600), 3600)
+        # 100 tweets in 10 minutes: 300 tweets are expected in 30 minutes
+        moderate = AdaptivePollInterval(min_interval=60, max_interval=3600)
+        self.assertEqual(moderate.update(100, 0, 600), 1800)
+        self.assertEqual(moderate.fail(), 3600)
+
+    def test_busy_companies_are_polled_more_often(self):
+        orchestrator = self.FakeOrchestrator({'Busy': {}, 'Quiet': {}}, {'Busy': (600, 2), 'Quiet': (1, 0)})
+        clock = FakeClock(datetime(2022, 1, 3, 15, 0))
+        daemon = ScrapeDaemon(orchestrator, clock=clock)
+        self.assertEqual(daemon.run(max_polls=40), 40)
+
+        self.assertEqual(orchestrator.polled[:2], ['Busy', 'Quiet'])
+        self.assertGreaterEqual(orchestrator.polled.count('Busy'), 32)
+        # The prices are polled on their own, much sparser, schedule
+        self.assertEqual(orchestrator.price_polls, ['Busy', 'Quiet', 'Busy', 'Quiet'])
+        self.assertEqual(daemon.intervals['Quiet', 'tweets'].interval, 3600)
+        self.assertLess(clock.now(), pd.Timestamp('2022-01-03 17:00'))
+
+    def test_poll_finishing_before_wait_wakes_run(self):
+        clock = FakeClock(datetime(2022, 1, 3, 15, 0))
+        orchestrator = self.FakeOrchestrator({'Busy': {}}, {'Busy': (600, 2)})
+        daemon = ScrapeDaemon(orchestrator, clock=clock)
+        # The poll finishes (and sets the wake event) before run() waits, as
+        # a poll on a worker thread can, so the wait returns at once instead
+        # of sleeping through its timeout
+        daemon.run(max_polls=1)
+        self.assertEqual(clock.now(), pd.Timestamp('2022-01-03 15:00'))
+
+    def test_failing_metrics_file_keeps_the_schedule(self):
+        with tempfile.TemporaryDirectory() as directory:
+            orchestrator = self.FakeOrchestrator({'Busy': {}}, {'Busy': (600, 2)})
+            # write_prometheus() raises, after the poll has been rescheduled
+            orchestrator.metrics_path = os.path.join(directory, 'missing', 'metrics.prom')
+            daemon = ScrapeDaemon(orchestrator, clock=FakeClock(datetime(2022, 1, 3, 15, 0)))
+            self.assertEqual(daemon.run(max_polls=4), 4)
+        self.assertEqual(orchestrator.polled, ['Busy'] * 2)
+        self.assertEqual(orchestrator.price_polls, ['Busy'] * 2)
+
+    def test_price_polls_stay_within_budget(self):
+        query_info = {f'Company {number}': {} for number in range(10)}
+        orchestrator = self.FakeOrchestrator(query_info, {company: (1, 100) for company in query_info})
+        clock = FakeClock(datetime(2022, 1, 3, 15, 0))
+        daemon = ScrapeDaemon(orchestrator, clock=clock, prices_per_day=45)
+        end = clock.monotonic() + 24 * 60 * 60
+        orchestrator.on_poll = lambda company: clock.monotonic() >= end and daemon.stop()
+        daemon.run()
+
+        # The price polls keep within the budget of 45 a day (the daemon stops
+        # on the first poll of the second day, which may be a price poll), and
+        # every company gets its share, although each one has price bars to fetch
+        self.assertLessEqual(len(orchestrator.price_polls), 45 + 1)
+        self.assertTrue(all(orchestrator.price_polls.count(company) >= 4 for company in query_info))
+
+    def test_failing_prices_do_not_hold_up_tweets(self):
+        class QuotaOrchestrator(self.FakeOrchestrator):
+            def _scrape_company_isolated(self, company, run_id=None, tweets=True, prices=True):
+                outcome = super()._scrape_company_isolated(company, run_id=run_id, tweets=tweets, prices=prices)
+                return outcome if tweets else {'status': 'error', 'error': "DailyQuotaExceeded('Daily quota of 500 requests used up')"}
+
+        orchestrator = QuotaOrchestrator({'Busy': {}}, {'Busy': (600, 2)})
+        daemon = ScrapeDaemon(orchestrator, clock=FakeClock(datetime(2022, 1, 3, 15, 0)))
+        daemon.run(max_polls=20)
+        self.assertEqual(daemon.intervals['Busy', 'tweets'].interval, 120)
+        self.assertGreater(daemon.intervals['Busy', 'prices'].interval, 120)
+
+    def test_reload_and_stop(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'query_info.json')
+            with open(path, 'w') as f:
+                json.dump({'Old': {}, 'Kept': {}}, f)
+            orchestrator = self.FakeOrchestrator({'Old': {}, 'Kept': {}}, {})
+            daemon = ScrapeDaemon(orchestrator, query_info_path=path, clock=FakeClock(datetime(2022, 1, 3, 15, 0)))
+            daemon.run(max_polls=3)
+
+            # A broken file keeps the companies
+            with open(path, 'w') as f:
+                f.write('{')
+            os.utime(path, ns=(0, 1))
+            daemon.check_reload()
+            self.assertEqual(sorted({company for company, _ in daemon.due}), ['Kept', 'Old'])
+
+            with open(path, 'w') as f:
+                json.dump({'Kept': {}, 'New': {}}, f)
+            os.utime(path, ns=(0, 2))
+            orchestrator.on_poll = lambda company: company == 'New' and daemon.stop()
+            daemon.run()
+
+        self.assertEqual(orchestrator.polled[:2], ['Old', 'Kept'])
+        self.assertEqual(orchestrator.polled[2:], ['New'])
+        self.assertEqual(sorted({company for company, _ in daemon.due}), ['Kept', 'New'])
+        self.assertEqual(orchestrator.query_info, {'Kept': {}, 'New': {}})
+
+class TestTweetAccumulator(unittest.TestCase):
+    '''
+    Testing that TweetAccumulator builds the same frames as concatenating and
+    deduplicating page by page.
+    '''
+    def test_matches_page_by_page_concat(self):
+        pages = []
+        for page_number in range(5):
+            tweet_ids = [page_number * 10 + i for i in range(10)] + [1, 2] # IDs 1 and 2 repeat on every page
+            pages.append(pd.DataFrame({'tweet_id': tweet_ids, 'like_count': [page_number] * 12}))
+
+        accumulator = TweetAccumulator()
+        expected_results, expected_ots = None, None
+        for page in pages:
+            accumulator.add_page(page, page)
+            expected_results = pd.concat([page, expected_results])
+            expected_ots = pd.concat([page, expected_ots]).drop_duplicates(subset='tweet_id', keep='first')
+
+        pd.testing.assert_frame_equal(accumulator.results_frame(), expected_results)
+        pd.testing.assert_frame_equal(accumulator.original_tweet_frame(), expected_ots)
+
+class TestSentimentScorer(unittest.TestCase):
+    '''
+    Testing that SentimentScorer matches TextBlob and scores each unique text once.
+    '''
+    class CountingScorer(SentimentScorer):
+        def score_texts(self, texts):
+            self.scored = getattr(self, 'scored', 0) + len(texts)
+            return super().score_texts(texts)
+
+    def test_scores_unique_texts_once(self):
+        texts = ['Palantir is a great company', 'I hate this stock', 'Palantir is a great company', 'Just a tweet']
+        scorer = self.CountingScorer(cache_size=2)
+        polarities, sentiments = scorer.score_batch(texts)
+
+        self.assertEqual(polarities, [TextBlob(text).sentiment.polarity for text in texts])
+        self.assertEqual(sentiments, ['positive', 'negative', 'positive', 'neutral'])
+        self.assertEqual(scorer.scored, 3)
+        # Only the cache_size most recent texts are kept
+        self.assertEqual(len(scorer.cache), 2)
+
+        scorer.score_batch(['Just a tweet'])
+        self.assertEqual(scorer.scored, 3)
+
+    def test_parallel_matches_serial(self):
+        '''
+        Scoring on worker processes returns the same values in the same order.
+        '''
+        texts = [f'tweet {i} is {word}' for i, word in enumerate(['good', 'bad', 'okay', 'terrible', 'amazing'] * 20)]
+        serial_polarities, _ = SentimentScorer().score_batch(texts)
+
+        scorer = SentimentScorer(workers=2, chunksize=7, parallel_threshold=10)
+        try:
+            parallel_polarities, _ = scorer.score_batch(texts)
+        finally:
+            scorer.close()
+        self.assertEqual(parallel_polarities, serial_polarities)
+
+    def test_lexicon_backend_matches_textblob(self):
+        '''
+        The vectorized lexicon backend agrees with TextBlob within its documented
+        tolerance on cleaned tweets, including intensifiers and negations.
+        '''
+        texts = pd.read_csv('data_files/tweets_110421.csv')['tweet_text'].dropna().tolist()
+        texts += ['not good', 'very good', 'not very good', 'really not good', 'no a bad movie', 'extremely happy never sad', '']
+        backend = LexiconBackend()
+        polarities = backend.score_texts(texts)
+        for text, polarity in zip(texts, polarities):
+            self.assertAlmostEqual(polarity, TextBlob(text).sentiment.polarity, delta=backend.tolerance)
+
+class TestTextCleaner(unittest.TestCase):
+    '''
+    Testing that the batch text cleaning matches cleaning one tweet at a time.
+    '''
+    texts = [
+        'RT @someone: Palantir $PLTR to the moon 🚀 https://t.co/abc123',
+        'Multi\nline\ttweet with @mention_and_more and a link:https://x.co/y z',
+        '$5 is not a ticker, $AAPL is. Costs $ 10!',
+        'RT',
+        '',
+        None,
+        'café://link @@double x://y'
+        ]
+
+    def test_matches_clean_text(self):
+        for keep_tickers in [False, True]:
+            for strip_rt in [False, True]:
+                expected = [clean_text(text or '', keep_tickers, strip_rt) for text in self.texts]
+                self.assertEqual(clean_texts(self.texts, keep_tickers, strip_rt), expected)
+
+    def test_default_matches_original_clean_tweet(self):
+        texts = [text for text in self.texts if text is not None]
+        expected = [' '.join(re.sub(r"(@[A-Za-z0-9]+)|([^0-9A-Za-z \t])|(\w+:\/\/\S+)", " ", text).split()) for text in texts]
+        self.assertEqual(clean_texts(texts), expected)
+        self.assertEqual(clean_texts(texts[:1], keep_tickers=True, strip_rt=True), ['Palantir $PLTR to the moon'])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import re
+
+# Mentions, non-alphanumeric characters and links, as in the original clean_tweet()
+CLEAN_PATTERN = re.compile(r'(@[A-Za-z0-9]+)|([^0-9A-Za-z \t])|(\w+:\/\/\S+)')
+# Same, but keeps $ when it starts a ticker (e.g. $AAPL)
+CLEAN_PATTERN_KEEP_TICKERS = re.compile(r'(@[A-Za-z0-9]+)|([^0-9A-Za-z \t$]|\$(?![A-Za-z]))|(\w+:\/\/\S+)')
+
+# Patterns of the batch cleaning, which let the newlines separating the texts
+# of a batch through. Mentions and runs of non-alphanumeric characters are
+# removed in separate passes.
+MENTION_PATTERN = re.compile(r'@[A-Za-z0-9]+')
+SPECIAL_PATTERN = re.compile(r'[^0-9A-Za-z \t\n]+')
+SPECIAL_PATTERN_KEEP_TICKERS = re.compile(r'[^0-9A-Za-z \t\n$]+|\$(?![A-Za-z])')
+
+RT_PATTERN = re.compile(r'^RT(?: |$)')
+
+def clean_text(tweet, keep_tickers=False, strip_rt=False):
+    '''
+    Cleans a single tweet text by removing mentions, links and special
+    characters. With the default options, this is the original
+    TwitterScraper.clean_tweet().
+    Parameters:
+        keep_tickers: keep the $ of cashtags such as $AAPL.
+        strip_rt: remove the "RT" that starts the text of retweets.
+    '''
+    pattern = CLEAN_PATTERN_KEEP_TICKERS if keep_tickers else CLEAN_PATTERN
+    cleaned = ' '.join(pattern.sub(' ', tweet).split())
+    if strip_rt:
+        cleaned = RT_PATTERN.sub('', cleaned, count=1)
+    return cleaned
+
+def clean_texts(texts, keep_tickers=False, strip_rt=False):
+    '''
+    Cleans a whole batch of tweet texts (e.g. a page of results) and returns a
+    list of cleaned texts in the same order. The output is identical to calling
+    clean_text() on every text. Missing texts (None) are cleaned to ''.
+
+    The texts are joined with newlines so each pattern runs once over the whole
+    batch, and mentions and special characters are removed in two separate
+    passes, which are much faster than the combined pattern. Links cannot be
+    removed that way, as where a link starts depends on what the combined
+    pattern matched before it. No match ever contains a space though, so a text
+    can be cleaned in pieces split at a space: the part of a text starting with
+    the word of its first "://" is cleaned with the combined pattern, and the
+    part before it goes through the batch passes.
+    '''
+    pattern = CLEAN_PATTERN_KEEP_TICKERS if keep_tickers else CLEAN_PATTERN
+    special_pattern = SPECIAL_PATTERN_KEEP_TICKERS if keep_tickers else SPECIAL_PATTERN
+
+    heads = []
+    tails = []
+    for text in texts:
+        text = '' if text is None else text.replace('\n', ' ')
+        link = text.find('://')
+        if link >= 0:
+            start = text.rfind(' ', 0, link) + 1
+            heads.append(text[:start])
+            tails.append(pattern.sub(' ', text[start:]))
+        else:
+            heads.append(text)
+            tails.append('')
+    if not heads:
+        return []
+
+    batch = MENTION_PATTERN.sub(' ', '\n'.join(heads))
+    batch = special_pattern.sub(' ', batch)
+
+    cleaned = [
+        ' '.join((head + ' ' + tail).split()) if tail else ' '.join(head.split())
+        for head, tail in zip(batch.split('\n'), tails)
+        ]
+    if strip_rt:
+        cleaned = [RT_PATTERN.sub('', text, count=1) for text in cleaned]
+    return cleaned
@@ -0,0 +1,49 @@
+import pandas as pd
+
+from schema import empty_tweet_frame
+
+class TweetAccumulator():
+    '''
+    Methods
+        - add_page(self, request_results, referenced_tweets=None)
+        - results_frame(self)
+        - original_tweet_frame(self)
+
+    Collects the processed pages of a Twitter scrape and builds the results and
+    original tweet dataframes once, at the end.
+    Concatenating every page onto the frames built so far copies all previous rows
+    for every page, which is quadratic in the number of pages. Keeping the pages
+    in lists and concatenating once is linear.
+
+    The frames come out in the same order as the page-by-page version produced:
+    the most recently added page first. Original tweets are deduplicated by
+    tweet_id, keeping the row from the most recently added page (i.e. the most
+    recent metrics), using a set of the tweet IDs already kept.
+    '''
+
+    def __init__(self):
+        self.result_pages = []
+        self.referenced_pages = []
+
+    def add_page(self, request_results, referenced_tweets=None):
+        self.result_pages.append(request_results)
+        if referenced_tweets is not None:
+            self.referenced_pages.append(referenced_tweets)
+
+    def results_frame(self):
+        if not self.result_pages:
+            return empty_tweet_frame()
+        return pd.concat(self.result_pages[::-1])
+
+    def original_tweet_frame(self):
+        if not self.referenced_pages:
+            return empty_tweet_frame()
+
+        seen_ids = set()
+        kept_pages = []
+        for page in self.referenced_pages[::-1]:
+            tweet_ids = page['tweet_id']
+            keep = ~tweet_ids.duplicated(keep='first') & ~tweet_ids.isin(seen_ids)
+            seen_ids.update(tweet_ids[keep])
+            kept_pages.append(page[keep])
+        return pd.concat(kept_pages)
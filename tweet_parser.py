@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+# orjson decodes API responses several times faster than the standard library.
+# It is optional: without it, responses are decoded with json.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Format of created_at in Twitter's V2 API, e.g. 2022-01-05T18:30:01.000Z
+CREATED_AT_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+def loads(content):
+    '''
+    Decodes a JSON payload (bytes or str), with orjson if it is installed.
+    '''
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def original_tweet_id(tweet):
+    '''
+    Returns the ID of the tweet retweeted by tweet, or None if it is not a retweet.
+    Quote tweets and replies also reference tweets, but their public metrics
+    are accurate, so they are not treated as retweets.
+    '''
+    for referenced_tweet in tweet.get('referenced_tweets', ()):
+        if referenced_tweet['type'] == 'retweeted':
+            return int(referenced_tweet['id'])
+    return None
+
+def to_eastern(created_at):
+    '''
+    Converts created_at strings (UTC) to naive US/Eastern datetimes, the time
+    zone in which the NYSE operates, in a single pass over a DatetimeIndex.
+    '''
+    utc = pd.to_datetime(created_at, format=CREATED_AT_FORMAT, utc=True)
+    return pd.DatetimeIndex(utc).tz_convert('US/Eastern').tz_localize(None)
+
+def int_column(values, count):
+    '''
+    Builds a nullable Int64 column (see schema.py) from an iterable of ints.
+    '''
+    return pd.array(np.fromiter(values, dtype=np.int64, count=count), dtype='Int64')
+
+def parse_tweets(tweets):
+    '''
+    Parses a list of tweets from the API into a dataframe of typed columns, with
+    the dtypes of schema.py: Int64 tweet IDs, author IDs and metrics, an
+    original_tweet_id which is only set for retweets, the tweet text and the
+    US/Eastern datetime.
+    Each column is extracted straight into its array instead of building a
+    dictionary of lists.
+    '''
+    count = len(tweets)
+    return pd.DataFrame({
+        'tweet_id': int_column((int(tweet['id']) for tweet in tweets), count),
+        'datetime': to_eastern([tweet['created_at'] for tweet in tweets]),
+        'like_count': int_column((tweet['public_metrics']['like_count'] for tweet in tweets), count),
+        'retweet_count': int_column((tweet['public_metrics']['retweet_count'] for tweet in tweets), count),
+        'text': np.array([tweet['text'] for tweet in tweets], dtype=object),
+        'author_id': int_column((int(tweet['author_id']) for tweet in tweets), count),
+        'original_tweet_id': pd.array([original_tweet_id(tweet) for tweet in tweets], dtype='Int64')
+    })
+
+def parse_followers(users):
+    '''
+    Parses the users expansion into a Series of follower counts indexed by
+    (int64) user ID. If a user appears twice, the last entry is kept.
+    '''
+    count = len(users)
+    followers = pd.Series(
+        np.fromiter((user['public_metrics']['followers_count'] for user in users), dtype=np.int64, count=count),
+        index=np.fromiter((int(user['id']) for user in users), dtype=np.int64, count=count)
+        )
+    return followers[~followers.index.duplicated(keep='last')]
@@ -0,0 +1,254 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from cassette_class import Cassette
+from twitter_scraper_class import SEARCH_URL, TwitterScraper
+
+# Twitter's snowflake IDs are the milliseconds since this epoch, shifted left by 22 bits
+TWITTER_EPOCH_MS = 1288834974657
+SNOWFLAKE_SHIFT = 22
+USER_ID_START = 10 ** 9
+
+WORDS = np.array([
+    'stock', 'market', 'buy', 'sell', 'earnings', 'growth', 'great', 'terrible', 'bullish', 'bearish', 'calls',
+    'puts', 'today', 'guidance', 'revenue', 'love', 'hate', 'moon', 'dip', 'hold', 'company', 'contract',
+    'price', 'target', 'analyst', 'upgrade', 'downgrade', 'news', 'chart', 'week', 'strong', 'weak'
+    ])
+
+class TwitterPayloadGenerator():
+    '''
+    Methods
+        - snowflake_ids(self, times_ms, counter)
+        - created_at(self, times_ms)
+        - texts(self, rng, count)
+        - chunk(self, index, count)
+        - tweets(self)
+        - pages(self)
+        - user(self, user)
+        - build_page(self, page)
+        - write_cassette(self, path, query_terms, since_id=None)
+
+    Generates recent search responses (Twitter's V2 API, with the users and
+    referenced tweets expansions) of any size, seeded so the same arguments
+    always give the same pages:
+    - Follower counts follow a power law (Pareto with follower_alpha). Authors
+    of original tweets are drawn with a weight growing with their followers,
+    retweeters uniformly.
+    - Every original tweet starts a retweet cascade whose size is Zipf
+    distributed (cascade_alpha), so most tweets are never retweeted and a few
+    are retweeted thousands of times. Retweets follow their original after a
+    log-normal delay. Retweets after the end of the stream are not in it but
+    are counted in the original's retweet_count.
+    - Shares of the original tweets are quotes and replies of earlier tweets.
+    - old_original_share of the cascades retweet tweets older than the stream,
+    which only appear in includes.tweets.
+    - IDs are snowflakes, so they are time-ordered like Twitter's.
+    - Retweets carry the original's retweet_count and no likes, as the API
+    returns them.
+
+    Tweets are generated in chunks of chunk_size tweets, newest chunk first,
+    each from its own seed, so pages can be streamed for 10 million tweets
+    without holding them in memory. Cascades do not cross chunk boundaries.
+
+    The pages can go straight into TwitterScraper.process_page() or
+    process_query_results(), or be written to a cassette with
+    write_cassette() and replayed (see cassette_class.py).
+    '''
+
+    def __init__(self, tweets=10000, seed=0, end='2022-01-05 16:00', tweets_per_second=2.0, users=None,
+                 page_size=100, chunk_size=10000, follower_alpha=1.2, cascade_alpha=2.2, quote_share=0.05,
+                 reply_share=0.1, old_original_share=0.2):
+        self.tweet_count = tweets
+        self.seed = seed
+        # End of the stream (UTC), in milliseconds since the Unix epoch
+        self.end_ms = pd.Timestamp(end).value // 10 ** 6
+        self.tweets_per_second = tweets_per_second
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self.cascade_alpha = cascade_alpha
+        self.quote_share = quote_share
+        self.reply_share = reply_share
+        self.old_original_share = old_original_share
+
+        # The user pool, with power-law follower counts
+        user_count = users if users is not None else max(1000, tweets // 5)
+        rng = np.random.default_rng([seed, 0])
+        self.user_ids = USER_ID_START + np.arange(user_count, dtype=np.int64) * 97
+        self.followers = np.minimum(rng.pareto(follower_alpha, user_count) * 20, 10 ** 8).astype(np.int64)
+        weights = np.sqrt(self.followers + 1.0)
+        self.author_weights = weights / weights.sum()
+
+    def snowflake_ids(self, times_ms, counter):
+        '''
+        Returns snowflake IDs for times_ms, made unique by counter (the sequence bits).
+        '''
+        return ((times_ms - TWITTER_EPOCH_MS) << SNOWFLAKE_SHIFT) | (counter & ((1 << SNOWFLAKE_SHIFT) - 1))
+
+    def created_at(self, times_ms):
+        # e.g. 2022-01-05T18:30:01.123Z
+        return (pd.to_datetime(times_ms, unit='ms').strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z').tolist()
+
+    def texts(self, rng, count):
+        words = rng.choice(WORDS, size=(count, 10))
+        tickers = rng.choice(['$PLTR', '$AAPL', '$TSLA', '$BTC'], size=count)
+        return [' '.join(row) + ' ' + ticker for row, ticker in zip(words.tolist(), tickers.tolist())]
+
+    def chunk(self, index, count):
+        '''
+        Generates chunk number index (0 is the newest) of count tweets. Returns
+        the tweets, newest first, and every tweet they reference, by ID.
+        '''
+        rng = np.random.default_rng([self.seed, index + 1])
+        duration_ms = int(self.chunk_size / self.tweets_per_second * 1000)
+        end_ms = self.end_ms - index * duration_ms
+        start_ms = end_ms - duration_ms
+        counter = index * self.chunk_size * 4
+
+        # Cascade sizes until the chunk is full
+        sizes = np.minimum(rng.zipf(self.cascade_alpha, size=count) - 1, count)
+        total = np.cumsum(sizes + 1)
+        originals = int(np.searchsorted(total, count)) + 1
+        sizes = sizes[:originals]
+        sizes[-1] -= total[originals - 1] - count
+        # Cascades of tweets older than the stream
+        old = rng.random(originals) < self.old_original_share
+
+        # Original tweets: in the chunk, or days before the stream
+        original_ms = rng.integers(start_ms, end_ms, size=originals)
+        old_delay_ms = (rng.lognormal(np.log(2 * 86400), 1.0, size=originals) * 1000).astype(np.int64)
+        original_ms = np.where(old, start_ms - old_delay_ms, original_ms)
+        original_ids = self.snowflake_ids(original_ms, counter + np.arange(originals))
+        counter += originals
+        original_authors = rng.choice(len(self.user_ids), size=originals, p=self.author_weights)
+        original_texts = self.texts(rng, originals)
+
+        # Retweets: a log-normal delay after their original (uniform in the chunk
+        # for old originals). Those after the end of the chunk are not seen.
+        cascade = np.repeat(np.arange(originals), sizes)
+        retweet_ms = original_ms[cascade] + (rng.lognormal(np.log(600), 1.5, size=len(cascade)) * 1000).astype(np.int64)
+        retweet_ms = np.where(old[cascade], rng.integers(start_ms, end_ms, size=len(cascade)), retweet_ms)
+        seen = retweet_ms < end_ms
+        unseen_retweets = rng.poisson(sizes * 0.1)
+        retweet_counts = sizes + unseen_retweets
+        like_counts = np.round(retweet_counts * rng.lognormal(1.0, 0.8, size=originals)).astype(np.int64)
+
+        cascade, retweet_ms = cascade[seen], retweet_ms[seen]
+        retweet_ids = self.snowflake_ids(retweet_ms, counter + np.arange(len(cascade)))
+        retweet_authors = rng.integers(len(self.user_ids), size=len(cascade))
+
+        # Quotes and replies reference an earlier original of the chunk
+        kind = rng.random(originals)
+        earlier = np.argsort(original_ms)
+        rank = np.empty(originals, dtype=np.int64)
+        rank[earlier] = np.arange(originals)
+        target = earlier[(rng.random(originals) * rank).astype(np.int64)]
+        referencing = (kind < self.quote_share + self.reply_share) & (rank > 0) & ~old
+
+        created = self.created_at(np.concatenate([original_ms, retweet_ms]))
+        referenced = {}
+        tweets = []
+        for i in range(originals):
+            tweet = {
+                'id': str(original_ids[i]),
+                'text': original_texts[i],
+                'created_at': created[i],
+                'author_id': str(self.user_ids[original_authors[i]]),
+                'public_metrics': {
+                    'retweet_count': int(retweet_counts[i]), 'reply_count': 0, 'like_count': int(like_counts[i]), 'quote_count': 0
+                }
+            }
+            if referencing[i]:
+                reference_type = 'quoted' if kind[i] < self.quote_share else 'replied_to'
+                tweet['referenced_tweets'] = [{'type': reference_type, 'id': str(original_ids[target[i]])}]
+            referenced[tweet['id']] = tweet
+            if not old[i]:
+                tweets.append(tweet)
+
+        for j in range(len(cascade)):
+            original = referenced[str(original_ids[cascade[j]])]
+            tweets.append({
+                'id': str(retweet_ids[j]),
+                'text': f'RT @user{original["author_id"]}: {original["text"]}',
+                'created_at': created[originals + j],
+                'author_id': str(self.user_ids[retweet_authors[j]]),
+                'public_metrics': {
+                    'retweet_count': original['public_metrics']['retweet_count'], 'reply_count': 0, 'like_count': 0, 'quote_count': 0
+                },
+                'referenced_tweets': [{'type': 'retweeted', 'id': original['id']}]
+            })
+
+        tweets.sort(key=lambda tweet: int(tweet['id']), reverse=True)
+        return tweets, referenced
+
+    def tweets(self):
+        '''
+        Generator of (tweet, referenced tweets) for every tweet of the stream,
+        newest first.
+        '''
+        remaining = self.tweet_count
+        index = 0
+        while remaining > 0:
+            tweets, referenced = self.chunk(index, min(self.chunk_size, remaining))
+            for tweet in tweets[:remaining]:
+                yield tweet, referenced
+            remaining -= min(len(tweets), remaining)
+            index += 1
+
+    def user(self, user):
+        return {
+            'id': str(self.user_ids[user]),
+            'username': f'user{self.user_ids[user]}',
+            'public_metrics': {'followers_count': int(self.followers[user])}
+        }
+
+    def pages(self):
+        '''
+        Generator of recent search responses of page_size tweets, newest first,
+        as returned by TwitterScraper.query_twitter().
+        '''
+        page = []
+        for tweet, referenced in self.tweets():
+            page.append((tweet, referenced))
+            if len(page) == self.page_size:
+                yield self.build_page(page)
+                page = []
+        if page:
+            yield self.build_page(page)
+
+    def build_page(self, page):
+        data = [tweet for tweet, _ in page]
+        users = {}
+        included = {}
+        for tweet, referenced in page:
+            user = (int(tweet['author_id']) - USER_ID_START) // 97
+            users.setdefault(user, self.user(user))
+            for reference in tweet.get('referenced_tweets', ()):
+                included.setdefault(reference['id'], referenced[reference['id']])
+        includes = {'users': list(users.values())}
+        if included:
+            includes['tweets'] = list(included.values())
+        meta = {'result_count': len(data), 'newest_id': data[0]['id'], 'oldest_id': data[-1]['id']}
+        return {'data': data, 'includes': includes, 'meta': meta}
+
+    def write_cassette(self, path, query_terms, since_id=None):
+        '''
+        Writes the pages to a cassette, page by page, keyed by the requests
+        TwitterScraper.aggregate_query_results() sends for query_terms, followed
+        by the empty page which ends its search. Give the scraper a
+        requests_limit of at least the number of pages. Returns the number of
+        pages written.
+        '''
+        until_id = None
+        count = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            Cassette.write_header(f, pd.Timestamp(self.end_ms, unit='ms', tz='UTC').isoformat(), {})
+            for page in self.pages():
+                params = TwitterScraper.search_params(query_terms, since_id=since_id, until_id=until_id)
+                Cassette.write_interaction(f, Cassette.interaction(SEARCH_URL, params, json.dumps(page)))
+                until_id = int(page['meta']['oldest_id']) - 1
+                count += 1
+            params = TwitterScraper.search_params(query_terms, since_id=since_id, until_id=until_id)
+            Cassette.write_interaction(f, Cassette.interaction(SEARCH_URL, params, json.dumps({'meta': {'result_count': 0}})))
+        return count
@@ -1,32 +1,56 @@
-from textblob import TextBlob
 import pandas as pd
-import re
-import time
-import sqlalchemy
 import os
-import requests
+import sqlalchemy
 import numpy as np
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter_class import shared_rate_limiter
+from database import connect_to_db
+from http_client_class import shared_http_client
+from tweet_accumulator_class import TweetAccumulator
+from sentiment_scorer_class import shared_sentiment_scorer
+from text_cleaner import clean_text, clean_texts
+from tweet_parser import loads, parse_tweets, parse_followers
+from schema import tweet_frame
+from watermark_store_class import watermark_name
+from clock_class import SYSTEM_CLOCK
+from metrics_class import shared_metrics
 
 from dotenv import load_dotenv
 load_dotenv()
 
+# Maximum number of tweet IDs per database lookup query
+LOOKUP_BATCH_SIZE = 1000
+
+# Twitter's V2 recent search endpoint
+SEARCH_URL = 'https://api.twitter.com/2/tweets/search/recent'
+
 class TwitterScraper():
     '''
     Methods
         - connect_to_db(self)
         - bearer_oauth(self, r)
         - aggregate_twitter_results(self, query_terms, requests_limit=15)
+        - fetch_pages(self, query_terms, requests_limit, since_id=None)
+        - next_until_id(self, json_results)
+        - process_page(self, json_results)
         - query_twitter(self, query_terms, since_id=None, until_id=None)
+        - search_params(query_terms, since_id=None, until_id=None)
         - process_query_results(self, tweet_json, user_json=None)
         - parse_tweet_list(self, json_response)
         - get_user_data(self, users_list)
         - get_ot_metrics(self, json_response)
-        - get_user_metrics(self, user_id, followers_counts)
         - clean_tweet(self, tweet)
         - get_tweet_sentiment(self, tweet)
         - get_since_id(self)
+        - query_since_id(self)
         - ot_metrics_in_db(self, tweet_id)
         - rt_metrics_in_db(self, original_tweet_id)
+        - ot_metrics_in_db_bulk(self, tweet_ids)
+        - rt_metrics_in_db_bulk(self, original_tweet_ids)
+        - symbol_condition(self, keyword='AND')
+        - query_by_ids(self, mysql_query, tweet_ids, columns)
         - dist_metrics(self, id, follower_dict, results_df, total_likes=None, total_retweets=None)
         - calculate_rt_metrics(self, original_tweet_df, results_df)
     
@@ -67,15 +91,27 @@ class TwitterScraper():
             follower counts. However, I do not have the OT's user's follower count. In this case,
             because I have no way of knowing that follower count, I will give half of the likes and
             retweets to the OT and distribute the rest to the RTs (if there are any) proportionally.
+
+    UNIFIED TABLES
+    With a symbol_id, db_table is the unified tweets table of all companies (see
+    create_tables.py) and every query of the database is limited to the rows of
+    that symbol.
     '''
 
-    def __init__(self, query_terms, db_table, use_since_id=True, requests_limit=15):
-        # Connect to our SQL database
+    def __init__(self, query_terms, db_table, use_since_id=True, requests_limit=15, pipelined=False,
+                 rate_limiter=None, engine=None, http_client=None, db_schema='stock_sentiment_project',
+                 sentiment_scorer=None, keep_tickers=False, strip_rt=False, watermarks=None, symbol_id=None, clock=None):
+        # Connect to our SQL database, unless we were given a shared engine
+        self.db_schema = db_schema
         self.db_table = db_table
-        self.engine = self.connect_to_db()
+        # Symbol of the company in the unified tweets table, or None for a per-company table
+        self.symbol_id = symbol_id
+        self.engine = engine if engine is not None else self.connect_to_db()
         
         # Determine if we will query out DB for a since_id
         self.use_since_id = use_since_id
+        # Store of the newest tweet ID of each table (see watermark_store_class.py)
+        self.watermarks = watermarks
 
         # Query terms
         self.query_terms = query_terms
@@ -83,31 +119,34 @@ class TwitterScraper():
         # Requests limit
         self.requests_limit = requests_limit
 
+        # Whether to process pages while the next page is being fetched
+        self.pipelined = pipelined
+
+        # Text cleaning options (see text_cleaner.py). By default, cashtags lose their $
+        # and retweets keep their leading "RT", as they always have.
+        self.keep_tickers = keep_tickers
+        self.strip_rt = strip_rt
+
+        # Sentiment scorer with a cache of scored texts (see sentiment_scorer_class.py)
+        self.sentiment_scorer = sentiment_scorer if sentiment_scorer is not None else shared_sentiment_scorer()
+
+        # Rate limiter shared with the other scrapers (see rate_limiter_class.py)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else shared_rate_limiter()
+
+        # HTTP client with pooled keep-alive sessions and retries (see http_client_class.py)
+        self.http_client = http_client if http_client is not None else shared_http_client()
+
+        # Clock of the collection times (see clock_class.py)
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+
     def connect_to_db(self):
         '''
         Function to connect to the database used to store results.
-        This code is run with both MySQL and MariaDB databases, which are
-        functionally the same, but require slightly different connection strings.
-        '''
-        # Getting SQL database credentials
-        mysql_user = os.getenv('MYSQL_USER')
-        mysql_pwd = os.getenv('MYSQL_PWD')
-        mysql_host = os.getenv('MYSQL_HOST')
-        mysql_db = os.getenv('MYSQL_DB')
-
-        # Setting up connection to SQL database
-        # I have set this up to handle either mariadb or mysql because I run this on two
-        # different computers which use these different SQL databases.
-        try:
-            engine_str = f'mariadb+mariadbconnector://{mysql_user}:{mysql_pwd}@{mysql_host}/{mysql_db}'
-            engine = sqlalchemy.create_engine(engine_str)
-            print('Using mariadb database')
-        except:
-            engine_str = f'mysql+pymysql://{mysql_user}:{mysql_pwd}@{mysql_host}/{mysql_db}'
-            engine = sqlalchemy.create_engine(engine_str)
-            print('Using mysql database')
-        
-        return engine
+        Only used when no engine is passed to the scraper. Creating one engine
+        and sharing it between scrapers (see database.py) avoids building a new
+        connection pool for every scraper.
+        '''
+        return connect_to_db(pool_size=1, max_overflow=2)
     
     def bearer_oauth(self, r):
         """
@@ -129,6 +168,11 @@ class TwitterScraper():
             API endpoint.
             - requests_limit: the maximum number of API requests sent during one
             use of this scraper.
+
+        If the scraper was created with pipelined=True, pages are processed on a
+        worker thread while the next page is being fetched. Otherwise each page is
+        processed before the next one is requested. Both modes return the same
+        results.
         '''
 
         # The API allows you to specify a Tweet ID such that the API will only
@@ -138,24 +182,46 @@ class TwitterScraper():
         else:
             since_id = None
 
+        pages = self.fetch_pages(query_terms, requests_limit, since_id=since_id)
+
+        if self.pipelined:
+            # The fetcher (this thread) follows until_id using only the raw pages,
+            # so it can request the next page while the worker is still cleaning
+            # and scoring the previous one. Each page is processed in a copy of
+            # this thread's context, so its timings keep the company's metric tags.
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self.process_page, json_results)
+                    for json_results in pages
+                    ]
+                processed_pages = [future.result() for future in futures]
+        else:
+            processed_pages = [self.process_page(json_results) for json_results in pages]
+
+        # Collect the pages and build each dataframe once at the end
+        accumulator = TweetAccumulator()
+        for request_results, referenced_tweets in processed_pages:
+            # Because this recent search endpoint does not include accurate metrics for
+            # retweets, we must use the data about the original tweets contained in
+            # json['includes']['tweets'] to sort out those missing metrics.
+            accumulator.add_page(request_results, referenced_tweets)
+
+        results_df = accumulator.results_frame()
+        original_tweet_df = accumulator.original_tweet_frame()
+        
+        return results_df, original_tweet_df
+
+    def fetch_pages(self, query_terms, requests_limit, since_id=None):
+        '''
+        Generator which queries Twitter page by page and yields the raw json of
+        each page that contains Tweets. Stops after requests_limit requests or
+        once a page comes back empty.
+        The until_id of the next page is taken from the raw json, so fetching
+        does not have to wait for the previous page to be processed.
+        '''
         requests_count = 0
         until_id = None
 
-        results_df = pd.DataFrame(columns = [
-            'tweet_id',
-            'datetime',
-            'tweet_text',
-            'polarity',
-            'sentiment',
-            'author_id',
-            'followers_count', 
-            'retweet_count',
-            'like_count',
-            'collection_time',
-            'original_tweet_id'
-            ])
-        original_tweet_df = results_df.copy(deep=True)
-
         while requests_count < requests_limit:
             # Queries twitter
             json_results = self.query_twitter(query_terms, since_id=since_id, until_id=until_id)
@@ -164,7 +230,7 @@ class TwitterScraper():
                 
             requests_count += 1
             print('Request: ', requests_count)
-            print('Requests remaining: ', 15 - requests_count)
+            print('Requests remaining: ', requests_limit - requests_count)
 
             print('Results size: ', results_size)
 
@@ -174,37 +240,45 @@ class TwitterScraper():
                 print('Returned no Tweets. Ending search.')
                 break
 
-            # Provided we have results, we process these Tweets.
-            if results_size > 0:
-                request_results = self.process_query_results(
-                    json_results['data'], json_results['includes']['users']
-                    )
-
-                results_df = pd.concat([request_results, results_df])
-
-                # Like the since_id, the API also allows you to specify a Tweet ID
-                # such that the API will only return Tweets before that Tweet.
-                # Because the recent search endpoint returns newest results first,
-                # we must repeatedly set the until_id as the oldest Tweet of the most
-                # recent query's results so we get older Tweets each query.
-                until_id = request_results['tweet_id'].iloc[0]
-                until_id = np.int64(until_id) - np.int64(1)
-            
-            if 'tweets' in json_results['includes']:
-                # json['includes']['tweets'] contains the tweets that were retweeted, quoted,
-                # or replied to in the main results (json_results['data']).
-                # json['includes']['users'] contains data about all the users whose tweets
-                # appeared in the main results.
-                referenced_tweets = self.process_query_results(
-                    json_results['includes']['tweets'], json_results['includes']['users']
-                    )
-                # Because this recent search endpoint does not include accurate metrics for
-                # retweets, we must use the data about the original tweets contained in
-                # json['includes']['tweets'] to sort out those missing metrics.
-                original_tweet_df = pd.concat([referenced_tweets, original_tweet_df])
-                original_tweet_df = original_tweet_df.drop_duplicates(subset='tweet_id', keep='first')
-        
-        return results_df, original_tweet_df
+            # Like the since_id, the API also allows you to specify a Tweet ID
+            # such that the API will only return Tweets before that Tweet.
+            # Because the recent search endpoint returns newest results first,
+            # we must repeatedly set the until_id as the oldest Tweet of the most
+            # recent query's results so we get older Tweets each query.
+            until_id = self.next_until_id(json_results)
+
+            yield json_results
+
+    def next_until_id(self, json_results):
+        '''
+        Returns the until_id for the page after json_results: the ID of the
+        oldest Tweet in the page minus one. Tweet IDs are time-ordered, so the
+        oldest Tweet has the smallest ID.
+        '''
+        oldest_id = min(np.int64(tweet['id']) for tweet in json_results['data'])
+        return oldest_id - np.int64(1)
+
+    def process_page(self, json_results):
+        '''
+        Processes one page of raw json returned by query_twitter(). Returns the
+        processed Tweets and the processed referenced tweets (or None if the page
+        did not reference any tweets).
+        '''
+        request_results = self.process_query_results(
+            json_results['data'], json_results['includes']['users']
+            )
+
+        referenced_tweets = None
+        if 'tweets' in json_results['includes']:
+            # json['includes']['tweets'] contains the tweets that were retweeted, quoted,
+            # or replied to in the main results (json_results['data']).
+            # json['includes']['users'] contains data about all the users whose tweets
+            # appeared in the main results.
+            referenced_tweets = self.process_query_results(
+                json_results['includes']['tweets'], json_results['includes']['users']
+                )
+
+        return request_results, referenced_tweets
 
     def query_twitter(self, query_terms, since_id=None, until_id=None):
         '''
@@ -233,8 +307,22 @@ class TwitterScraper():
             max_results: specifies how many results should be returned for each query. The max possible
                 is 100.
         '''
-        search_url = 'https://api.twitter.com/2/tweets/search/recent'
+        query_params = self.search_params(query_terms, since_id=since_id, until_id=until_id)
         
+        # The HTTP client waits for our turn within Twitter's rate limit before
+        # each attempt and retries 429s and 5xx responses.
+        response = self.http_client.get(
+            SEARCH_URL, params=query_params, auth=self.bearer_oauth, rate_limiter=self.rate_limiter, api='twitter'
+            )
+        # Decoded with orjson when it is installed
+        with shared_metrics().timer('json_parse', api='twitter'):
+            return loads(response.content)
+    
+    @staticmethod
+    def search_params(query_terms, since_id=None, until_id=None):
+        '''
+        Returns the parameters of a recent search request (see query_twitter()).
+        '''
         query_params = {'tweet.fields': 'id,text,created_at,public_metrics', 'expansions': 'author_id,referenced_tweets.id', 'user.fields': 'public_metrics', 'max_results': 100}
 
         query = '(' + query_terms + ') lang:en'
@@ -244,18 +332,17 @@ class TwitterScraper():
             query_params['since_id'] = since_id
         if until_id:
             query_params['until_id'] = until_id
-        
-        response = requests.get(search_url, auth=self.bearer_oauth, params=query_params)
-        return response.json()
-    
+        return query_params
+
     def process_query_results(self, tweet_json, user_json=None):
         '''
         This function processes the results returned by the query.
         As input, this function takes the json of the returned tweets and,
         optionally, the json of users.
         This function:
+            - parses the tweets into typed columns, with created_at converted
+                to US/Eastern datetimes
             - adds follower counts of the Tweet authors to the dataframe
-            - converts created_at to a datetime format recognized by pandas
             - cleans the texts of the Tweets
             - Gets the polarities and sentiments of the tweets and add them to
                 the dataframe.
@@ -266,43 +353,29 @@ class TwitterScraper():
         response_df = self.parse_tweet_list(tweet_json)
         
         # Add follower counts of the Tweet authors to df
+        # Authors missing from the users expansion get a null follower count.
         if user_json:
-            user_followers_dict = self.get_user_data(user_json)
-            response_df['followers_count'] = response_df['author_id'].apply(lambda author_id: self.get_user_metrics(author_id, user_followers_dict))
-
-        # Convert created_at to datetime
-        # Additionally, created_at is returned in the UTC-0 time zone
-        # I want to convert it to UTC-4 because that time zone (US/Easter)
-        # is the timezone in which the NYSE operates.
-        response_df['datetime_utc+0'] = pd.to_datetime(response_df['created_at'])
-        response_df['datetime_utc-4'] = response_df['datetime_utc+0'].dt.tz_convert(tz='US/Eastern')
-        response_df['datetime'] = response_df['datetime_utc-4'].dt.tz_localize(tz=None)
+            followers = parse_followers(user_json)
+            response_df['followers_count'] = response_df['author_id'].map(followers).astype('Int64')
 
         # Clean tweet texts
-        response_df['tweet_text'] = response_df['text'].apply(lambda tweet: self.clean_tweet(tweet))
+        # The whole page is cleaned in one batch
+        with shared_metrics().timer('clean'):
+            response_df['tweet_text'] = clean_texts(response_df['text'], keep_tickers=self.keep_tickers, strip_rt=self.strip_rt)
         
-        # Get polarity and sentiment of tweets
-        response_df['polarity'] = response_df['tweet_text'].apply(lambda tweet: self.get_tweet_sentiment(tweet)[0])
-        response_df['sentiment'] = response_df['tweet_text'].apply(lambda tweet: self.get_tweet_sentiment(tweet)[1])
+        # Get polarity and sentiment of tweets. The texts are already clean, and each
+        # unique text (e.g. the retweets of one tweet) is only scored once.
+        with shared_metrics().timer('sentiment'):
+            polarities, sentiments = self.sentiment_scorer.score_batch(response_df['tweet_text'])
+        response_df['polarity'] = polarities
+        response_df['sentiment'] = sentiments
 
         # Add collection time to df
-        collection_time = time.asctime( time.localtime(time.time()) )
-        response_df['collection_time'] = pd.to_datetime(collection_time)
-
-        # Keep only the columns we want
-        response_df = response_df[[
-            'tweet_id',
-            'datetime',
-            'tweet_text',
-            'polarity',
-            'sentiment',
-            'author_id',
-            'followers_count', 
-            'retweet_count',
-            'like_count',
-            'collection_time',
-            'original_tweet_id'
-            ]]
+        # (local time, to the second)
+        response_df['collection_time'] = self.clock.now().floor('S')
+
+        # Keep only the columns we want, with the dtypes of schema.py
+        response_df = tweet_frame(response_df)
 
         # Sort by datetime so the Tweets go from oldest to newest
         response_df.sort_values(by='datetime', ascending=True, inplace=True)
@@ -311,50 +384,23 @@ class TwitterScraper():
 
     def parse_tweet_list(self, json_response):
         '''
-        This function parses the json of tweets returned by the API.
-        This function breaks down the multi-level json into a single-level
-        dictionary which is then returned as a dataframe.
-        '''
-        tweet_dict = {
-            'tweet_id': [],
-            'created_at': [],
-            'like_count': [],
-            'retweet_count': [],
-            'text': [],
-            'author_id': [],
-            'original_tweet_id': []
-        }
-        for tweet in json_response:
-            tweet_dict['tweet_id'].append(tweet['id'])
-            tweet_dict['created_at'].append(tweet['created_at'])
-            tweet_dict['like_count'].append(tweet['public_metrics']['like_count'])
-            tweet_dict['retweet_count'].append(tweet['public_metrics']['retweet_count'])
-            tweet_dict['text'].append(tweet['text'])
-            tweet_dict['author_id'].append(tweet['author_id'])
-            
-            # We need to handle retweets differently because their public metrics are inaccurate.
-            # So we will need to figure out the public metrics of retweets ourselves.
-            if 'referenced_tweets' in tweet:
-                retweet_status = False
-                for referenced_tweet in tweet['referenced_tweets']:
-                    if referenced_tweet['type'] == 'retweeted':
-                        tweet_dict['original_tweet_id'].append(referenced_tweet['id'])
-                        retweet_status = True
-                if retweet_status == False:
-                    tweet_dict['original_tweet_id'].append(None)
-            else:
-                tweet_dict['original_tweet_id'].append(None)
-        return pd.DataFrame(tweet_dict)
+        This function parses the json of tweets returned by the API into a
+        dataframe with one typed column per field (see tweet_parser.py).
+        created_at is returned in the UTC-0 time zone. It is converted to
+        US/Eastern because that is the timezone in which the NYSE operates.
+        We need to handle retweets differently because their public metrics are
+        inaccurate, so original_tweet_id is set for retweets and we figure out
+        their public metrics ourselves.
+        '''
+        return parse_tweets(json_response)
 
     def get_user_data(self, users_list):
         '''
         This function takes the data from the users expansion and reformats
         that data to a simple dictionary of user_id-follower_count key-value pairs.
+        User IDs are ints, like the author_id column.
         '''
-        followers_count_dict = {}
-        for user in users_list:
-            followers_count_dict[user['id']] = user['public_metrics']['followers_count']
-        return followers_count_dict
+        return parse_followers(users_list).to_dict()
 
     def get_ot_metrics(self, json_response):
         '''
@@ -365,61 +411,57 @@ class TwitterScraper():
         original_tweet_list = json_response['includes']['tweets']
         original_tweet_dict = {}
         for tweet in original_tweet_list:
-            original_tweet_dict[tweet['id']] = (tweet['public_metrics']['retweet_count'], tweet['public_metrics']['like_count'])
+            original_tweet_dict[int(tweet['id'])] = (tweet['public_metrics']['retweet_count'], tweet['public_metrics']['like_count'])
         return original_tweet_dict
 
-    def get_user_metrics(self, user_id, followers_counts):
-        '''
-        Utility function to add follower counts to the results dataframe.
-        '''
-        if user_id in followers_counts:
-            followers_count = followers_counts[user_id]
-            return followers_count
-        else:
-            return ''
-
     def clean_tweet(self, tweet):
         ''' 
         Utility function to clean tweet text by removing links, special characters 
         using simple regex statements. 
         '''
-        return ' '.join(re.sub("(@[A-Za-z0-9]+)|([^0-9A-Za-z \t])|(\w+:\/\/\S+)", " ", tweet).split())
+        return clean_text(tweet, keep_tickers=self.keep_tickers, strip_rt=self.strip_rt)
 
     def get_tweet_sentiment(self, tweet):
         ''' 
         Utility function to classify sentiment of passed tweet 
         using textblob's sentiment method 
         '''
-        # create TextBlob object of passed tweet text 
-        analysis = TextBlob(self.clean_tweet(tweet))
-        polarity = analysis.sentiment.polarity
-        # set sentiment 
-        if analysis.sentiment.polarity > 0: 
-            sentiment = 'positive'
-        elif analysis.sentiment.polarity == 0: 
-            sentiment = 'neutral'
-        else: 
-            sentiment = 'negative'
-        return polarity, sentiment
+        return self.sentiment_scorer.score(self.clean_tweet(tweet))
 
     def get_since_id(self):
         '''
         This function returns the Tweet ID of the newest Tweet stored in the
-        database. This Tweet ID will be used as the since ID, if necessary.
+        database, or None if the table is empty. This Tweet ID will be used as
+        the since ID, if necessary.
+        With a watermark store, the ID comes from its cache and the table is
+        only queried if it has no watermark yet.
+        '''
+        if self.watermarks is not None:
+            return self.watermarks.get_tweet_id(watermark_name(self.db_table, self.symbol_id), fallback=self.query_since_id)
+        return self.query_since_id()
+
+    def query_since_id(self):
+        '''
+        Queries the newest Tweet ID stored in the database. Tweet IDs are
+        time-ordered, so this is the largest ID, which the primary key index finds
+        without sorting the table.
         '''
         # Import most recent Tweet ID from MySQL database
         mysql_query = '''
-        SELECT tweet_id
-        FROM stock_sentiment_project.''' + self.db_table + '''
-        ORDER BY `datetime` desc
-        LIMIT 1;
+        SELECT MAX(tweet_id) AS tweet_id
+        FROM ''' + self.db_schema + '.' + self.db_table + '''
+        ''' + self.symbol_condition('WHERE') + ''';
         '''
 
-        since_id_df = pd.read_sql_query(mysql_query, self.engine)
+        with shared_metrics().timer('db_lookup', table=self.db_table):
+            since_id_df = pd.read_sql_query(sqlalchemy.text(mysql_query), self.engine, params={'symbol_id': self.symbol_id})
 
         # Set most recent Tweet ID as 'since_id' parameter so we don't pull Tweets we have already pulled
         since_id = since_id_df['tweet_id'].iloc[0]
-        return since_id
+        if pd.isna(since_id):
+            # The table is empty
+            return None
+        return int(since_id)
 
     def ot_metrics_in_db(self, tweet_id):
         '''
@@ -428,11 +470,7 @@ class TwitterScraper():
         added to the database. If so, returns the retweet and like counts
         of the tweet. If not, returns None for both values.
         '''
-        mysql_query = '''
-        SELECT retweet_count, like_count
-        FROM stock_sentiment_project.''' + self.db_table + '''
-        WHERE tweet_id = ''' + str(tweet_id) + ''';'''
-        tweet_in_db = pd.read_sql_query(mysql_query, self.engine)
+        tweet_in_db = self.ot_metrics_in_db_bulk([tweet_id])
         if tweet_in_db.shape[0] > 0:
             retweets = tweet_in_db['retweet_count'].iloc[0]
             likes = tweet_in_db['like_count'].iloc[0]
@@ -446,16 +484,73 @@ class TwitterScraper():
         Queries the database to get the sum of retweet and like counts for all
         retweets of the original tweet specified by original_tweet_id.
         '''
-        mysql_query= '''
-        SELECT SUM(retweet_count), SUM(like_count)
-        FROM stock_sentiment_project.''' + self.db_table + '''
-        WHERE original_tweet_id = ''' + str(original_tweet_id) + ''';'''
-        rt_metrics_in_db = pd.read_sql_query(mysql_query, self.engine)
-        retweets = rt_metrics_in_db['SUM(retweet_count)'].iloc[0]
-        likes = rt_metrics_in_db['SUM(like_count)'].iloc[0]
-        if type(retweets) != int or type(likes) != int:
+        rt_metrics_in_db = self.rt_metrics_in_db_bulk([original_tweet_id])
+        if rt_metrics_in_db.shape[0] > 0:
+            retweets = rt_metrics_in_db['retweet_count'].iloc[0]
+            likes = rt_metrics_in_db['like_count'].iloc[0]
+        else:
             retweets, likes = 0, 0
         return retweets, likes
+
+    def ot_metrics_in_db_bulk(self, tweet_ids):
+        '''
+        Support function for calculate_rt_metrics().
+        Like ot_metrics_in_db(), but for many tweets with one query per batch of
+        LOOKUP_BATCH_SIZE tweet IDs. Returns a dataframe with the tweet_id,
+        retweet_count and like_count of the tweets found in the database.
+        '''
+        mysql_query = '''
+        SELECT tweet_id, retweet_count, like_count
+        FROM ''' + self.db_schema + '.' + self.db_table + '''
+        WHERE tweet_id IN :tweet_ids''' + self.symbol_condition() + ''';'''
+        return self.query_by_ids(mysql_query, tweet_ids, ['tweet_id', 'retweet_count', 'like_count'])
+
+    def rt_metrics_in_db_bulk(self, original_tweet_ids):
+        '''
+        Support function for calculate_rt_metrics().
+        Like rt_metrics_in_db(), but for many original tweets with one GROUP BY
+        query per batch of LOOKUP_BATCH_SIZE IDs. Returns a dataframe with the
+        original_tweet_id and the summed retweet_count and like_count of its
+        retweets in the database. Original tweets without retweets in the
+        database are left out.
+        '''
+        mysql_query = '''
+        SELECT original_tweet_id, SUM(retweet_count) AS retweet_count, SUM(like_count) AS like_count
+        FROM ''' + self.db_schema + '.' + self.db_table + '''
+        WHERE original_tweet_id IN :tweet_ids''' + self.symbol_condition() + '''
+        GROUP BY original_tweet_id;'''
+        rt_metrics = self.query_by_ids(mysql_query, original_tweet_ids, ['original_tweet_id', 'retweet_count', 'like_count'])
+        rt_metrics[['retweet_count', 'like_count']] = rt_metrics[['retweet_count', 'like_count']].fillna(0)
+        return rt_metrics
+
+    def symbol_condition(self, keyword='AND'):
+        '''
+        Returns the condition (following keyword) limiting a query of the
+        unified tweets table to the rows of self.symbol_id (the :symbol_id
+        parameter), or nothing for a per-company table.
+        '''
+        if self.symbol_id is None:
+            return ''
+        return f' {keyword} symbol_id = :symbol_id'
+
+    def query_by_ids(self, mysql_query, tweet_ids, columns):
+        '''
+        Runs mysql_query, whose :tweet_ids parameter is a list of tweet IDs, in
+        batches of LOOKUP_BATCH_SIZE IDs and returns the combined results.
+        '''
+        tweet_ids = [int(tweet_id) for tweet_id in pd.unique(pd.Series(tweet_ids, dtype=object).dropna())]
+        query = sqlalchemy.text(mysql_query).bindparams(sqlalchemy.bindparam('tweet_ids', expanding=True))
+
+        batches = []
+        for start in range(0, len(tweet_ids), LOOKUP_BATCH_SIZE):
+            batch = tweet_ids[start:start + LOOKUP_BATCH_SIZE]
+            params = {'tweet_ids': batch, 'symbol_id': self.symbol_id}
+            with shared_metrics().timer('db_lookup', table=self.db_table):
+                batches.append(pd.read_sql_query(query, self.engine, params=params))
+
+        if not batches:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(batches, ignore_index=True)
     
     def dist_metrics(self, id, follower_dict, results_df, total_likes=None, total_retweets=None):
         '''
@@ -499,52 +594,106 @@ class TwitterScraper():
         user was not returned in the users expansion unless one of that users tweets appeared
         in the results. If this is the case, the original tweet is given half of the metrics
         and the other half is distributed among its retweets proportional to follower counts.
-        '''
-        results_df_copy = results_df.copy()
-        for _, original_tweet in original_tweet_df.iterrows():
-            if original_tweet['tweet_id'] in results_df['tweet_id']:
-                # The original tweet appears in our results dataframe so we don't have to check the db.
-                relevant_subset = results_df_copy[(results_df_copy['tweet_id'] == original_tweet['tweet_id']) | (results_df_copy['original_tweet_id'] == original_tweet['tweet_id'])]
-                
-                total_likes, total_retweets = original_tweet['like_count'], original_tweet['retweet_count']
-                
-                followers_dict = dict(zip(relevant_subset['tweet_id'], relevant_subset['followers_count']))
-                
-                relevant_subset['tweet_id'].apply(lambda id: self.dist_metrics(id, followers_dict, results_df, total_likes, total_retweets))
-            
-            elif isinstance(self.ot_metrics_in_db(original_tweet['tweet_id'])[0], int):
-                # The original tweet exists in our db because our query returned metrics
-                hist_retweets, hist_likes = self.rt_metrics_in_db(original_tweet['tweet_id'])
-                orig_retweets, orig_likes = self.ot_metrics_in_db(original_tweet['tweet_id'])
-                
-                new_retweets = original_tweet['retweet_count'] - (hist_retweets + orig_retweets)
-                new_likes = original_tweet['like_count'] - (hist_likes + orig_likes)
-
-                relevant_subset = results_df_copy[(results_df_copy['original_tweet_id'] == original_tweet['tweet_id'])]
-                followers_dict = dict(zip(relevant_subset['tweet_id'], relevant_subset['followers_count']))
-
-                relevant_subset['tweet_id'].apply(lambda id: self.dist_metrics(id, followers_dict, results_df, new_likes, new_retweets))
-            
-            else:
-                # The original tweet exists neither in our db or our results.
-                # This is only applicable for when the original tweet was tweeted before I started
-                # running this script.
-                relevant_subset = results_df_copy[(results_df_copy['original_tweet_id'] == original_tweet['tweet_id'])]
-
-                followers_dict = dict(zip(relevant_subset['tweet_id'], relevant_subset['followers_count']))
-                if sum(followers_dict.values()) == 0:
-                    followers_dict[original_tweet['tweet_id']] = 1
-                else:
-                    followers_dict[original_tweet['tweet_id']] = sum(followers_dict.values())
 
-                original_tweet['followers_count'] = 1
-
-                relevant_subset = relevant_subset.append(original_tweet)
-                results_df = results_df.append(original_tweet)
-
-                total_likes, total_retweets = original_tweet['like_count'], original_tweet['retweet_count']
-
-                relevant_subset['tweet_id'].apply(lambda id: self.dist_metrics(id, followers_dict, results_df, total_likes, total_retweets))
+        This is computed for all original tweets at once: every original tweet and
+        its retweets form a group, the follower-proportional shares are computed with
+        a single groupby, and the like and retweet counts are assigned in bulk.
+        '''
+        # One row per original tweet, looked up by position
+        original_tweets = original_tweet_df.drop_duplicates(subset='tweet_id', keep='first')
+        ot_ids = pd.Index(original_tweets['tweet_id'])
+        total_likes = pd.to_numeric(original_tweets['like_count'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        total_retweets = pd.to_numeric(original_tweets['retweet_count'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+        # Path 1: the original tweet appears in our results dataframe so we don't have to check the db.
+        in_results = np.asarray(ot_ids.isin(results_df['tweet_id']), dtype=bool)
+
+        # Path 2: the original tweet exists in our db. Only the likes and retweets it
+        # gained since then are distributed.
+        # All database lookups are done in two queries: one for the original tweets
+        # themselves and one for the sums over their retweets already in the db.
+        lookup_ids = ot_ids[~in_results]
+        ot_in_db = self.ot_metrics_in_db_bulk(lookup_ids)
+        rt_in_db = self.rt_metrics_in_db_bulk(ot_in_db['tweet_id'])
+
+        # With the integer IDs of schema.py the lookups are integer comparisons.
+        # Other IDs (e.g. strings) are converted one by one.
+        if pd.api.types.is_integer_dtype(ot_ids.dtype):
+            int_ot_ids = pd.Index(ot_ids.to_numpy(dtype='int64', na_value=-1))
+        else:
+            int_ot_ids = pd.Index([int(tweet_id) if pd.notna(tweet_id) else -1 for tweet_id in ot_ids])
+        db_positions = int_ot_ids.get_indexer(ot_in_db['tweet_id'].astype('int64'))
+        hist_positions = int_ot_ids.get_indexer(rt_in_db['original_tweet_id'].astype('int64'))
+
+        in_db = np.zeros(len(ot_ids), dtype=bool)
+        in_db[db_positions] = True
+        in_db &= ~in_results
+        total_retweets[db_positions] -= ot_in_db['retweet_count'].to_numpy(dtype=float)
+        total_likes[db_positions] -= ot_in_db['like_count'].to_numpy(dtype=float)
+        total_retweets[hist_positions] -= rt_in_db['retweet_count'].to_numpy(dtype=float)
+        total_likes[hist_positions] -= rt_in_db['like_count'].to_numpy(dtype=float)
+
+        # Path 3: the original tweet exists neither in our db or our results.
+        # This is only applicable for when the original tweet was tweeted before I started
+        # running this script. The original tweet is added to the results.
+        appended = ~in_results & ~in_db
+        appended_tweets = original_tweets[appended].copy()
+        appended_tweets['followers_count'] = 1
+        results_count = len(results_df)
+        results_df = pd.concat([results_df, appended_tweets])
+
+        tweet_ids = results_df['tweet_id']
+        followers = pd.to_numeric(results_df['followers_count'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+        # Group members: the retweets of each original tweet (from the original results)...
+        rt_group = ot_ids.get_indexer(results_df['original_tweet_id'].iloc[:results_count])
+        rt_positions = np.flatnonzero(rt_group >= 0)
+        # ...the original tweets found in the results (path 1)...
+        ot_group = ot_ids.get_indexer(tweet_ids.iloc[:results_count])
+        ot_positions = np.flatnonzero((ot_group >= 0) & in_results[np.maximum(ot_group, 0)])
+        # ...and the original tweets we just added (path 3).
+        appended_positions = np.arange(results_count, len(results_df))
+
+        members = pd.DataFrame({
+            'position': np.concatenate([rt_positions, ot_positions, appended_positions]),
+            'group': np.concatenate([rt_group[rt_positions], ot_group[ot_positions], np.flatnonzero(appended)]),
+            'tweet_id': np.concatenate([
+                tweet_ids.to_numpy()[rt_positions], tweet_ids.to_numpy()[ot_positions], tweet_ids.to_numpy()[appended_positions]
+                ]),
+        })
+        members['followers'] = followers[members['position']]
+        # A tweet counts once per group, as in the follower dictionary used by dist_metrics().
+        members = members.drop_duplicates(subset=['group', 'tweet_id'], keep='last')
+
+        # We do not have the follower count of an added original tweet, so it gets as
+        # many followers as all its retweets together, i.e. half of the metrics.
+        # If its retweets have no followers, it gets a follower count of 1.
+        is_appended = members['position'].to_numpy() >= results_count
+        rt_followers = members[~is_appended].groupby('group')['followers'].sum()
+        appended_followers = members.loc[is_appended, 'group'].map(rt_followers).fillna(0)
+        members.loc[is_appended, 'followers'] = appended_followers.where(appended_followers != 0, 1)
+
+        # Distribute the metrics proportional to follower counts
+        group_followers = members.groupby('group')['followers'].transform('sum')
+        proportion = members['followers'] / group_followers
+        distributable = (group_followers != 0).to_numpy()
+
+        for column, totals in [('like_count', total_likes), ('retweet_count', total_retweets)]:
+            member_totals = totals[members['group']]
+            # Like dist_metrics(), a total of zero is not distributed
+            assign = distributable & (member_totals != 0) & ~np.isnan(member_totals) & proportion.notna().to_numpy()
+            new_values = pd.Series(
+                np.round(member_totals[assign] * proportion.to_numpy()[assign]),
+                index=members['tweet_id'].to_numpy()[assign]
+                )
+            new_values = new_values[~new_values.index.duplicated(keep='last')]
+
+            # Every row with a distributed tweet ID gets its new value
+            mapped = tweet_ids.map(new_values)
+            current = results_df[column]
+            if pd.api.types.is_extension_array_dtype(current.dtype):
+                current = current.astype('float64')
+            results_df[column] = mapped.where(mapped.notna(), current)
         
         return results_df
     
@@ -558,6 +707,9 @@ class TwitterScraper():
 
         # Now we need to update the public metrics of retweets. For more information on this step, see
         # the docstring at the beginning of the class.
-        results_df = self.calculate_rt_metrics(original_tweet_df, results_df)
+        # (the rt_metrics stage includes its db_lookup time)
+        with shared_metrics().timer('rt_metrics'):
+            results_df = self.calculate_rt_metrics(original_tweet_df, results_df)
 
-        return results_df
\ No newline at end of file
+        # The estimated metrics are whole numbers, so the frame keeps the dtypes of schema.py
+        return tweet_frame(results_df)
\ No newline at end of file
@@ -0,0 +1,215 @@
+import threading
+from datetime import datetime
+
+import pandas as pd
+import sqlalchemy
+
+from metrics_class import shared_metrics
+
+WATERMARK_TABLE = 'scrape_watermarks'
+
+def watermark_name(table_name, symbol_id=None):
+    '''
+    Returns the name of the watermark of a table. The unified tables (see
+    create_tables.py) hold every company, so they have one watermark per symbol.
+    '''
+    return table_name if symbol_id is None else f'{table_name}:{symbol_id}'
+
+class WatermarkStore():
+    '''
+    Methods
+        - get_table(self)
+        - invalidate(self)
+        - load(self)
+        - get(self, name, column, fallback=None)
+        - get_tweet_id(self, table_name, fallback=None)
+        - get_date(self, table_name, fallback=None)
+        - advance(self, connection, name, column, value)
+        - remember(self, name, column, value)
+        - start_recording(self)
+        - seed(self, watermarks)
+
+    Keeps the newest tweet ID and price date written to each company table, so
+    the scrapers do not have to look them up with a sorted scan of every table
+    on every run. Tweet IDs are time-ordered, so the newest tweet ID is enough
+    for the since_id.
+
+    The watermarks live in a small table (one row per data table) and in an
+    in-process cache. The cache is loaded with a single query the first time a
+    watermark is needed after invalidate(), which the orchestrator calls at the
+    start of every cycle. BulkWriter advances the watermark of a table in the
+    same transaction as the rows it writes, so the two cannot disagree.
+
+    A table without a watermark yet (e.g. the first run after upgrading) gets
+    one from the fallback passed to get(), usually a MAX() query of the table.
+    If the fallback finds nothing (an empty table), the miss is cached too, until
+    the watermark is advanced or the cache is invalidated.
+
+    Several workers and processes can write to the same tables, so advance()
+    compares the watermarks in SQL rather than against the cache.
+
+    RECORD AND REPLAY
+    The since_id and outputsize of the requests come from the watermarks, so a
+    cassette (see cassette_class.py) only replays against the database state it
+    was recorded with. After start_recording(), the first value get() returns
+    for each watermark is kept in recorded, which the cassette saves. seed()
+    makes get() return those values on replay, whatever the database holds,
+    until the watermark is advanced by a write.
+    In the unified tables, every symbol has its own watermark (see watermark_name()).
+    '''
+
+    def __init__(self, engine, table_name=WATERMARK_TABLE, db_schema=None):
+        self.engine = engine
+        self.table_name = table_name
+        self.db_schema = db_schema
+
+        self.table = None
+        self.cache = None
+        # (name, column) of the watermarks whose fallback found nothing
+        self.misses = set()
+        # Watermarks read while recording, and watermarks seeded for a replay, by name and column
+        self.recorded = None
+        self.seeded = {}
+        self.lock = threading.RLock()
+
+    def get_table(self):
+        '''
+        Returns the watermark table, creating it if it does not exist yet.
+        '''
+        with self.lock:
+            if self.table is None:
+                metadata = sqlalchemy.MetaData()
+                table = sqlalchemy.Table(
+                    self.table_name,
+                    metadata,
+                    sqlalchemy.Column('table_name', sqlalchemy.String(255), primary_key=True, nullable=False),
+                    sqlalchemy.Column('tweet_id', sqlalchemy.BigInteger),
+                    sqlalchemy.Column('date', sqlalchemy.DateTime),
+                    sqlalchemy.Column('updated_at', sqlalchemy.DateTime),
+                    schema=self.db_schema
+                    )
+                metadata.create_all(self.engine, checkfirst=True)
+                self.table = table
+            return self.table
+
+    def invalidate(self):
+        '''
+        Drops the cache, so the next get() loads the watermarks again.
+        '''
+        with self.lock:
+            self.cache = None
+            self.misses = set()
+
+    def load(self):
+        '''
+        Loads the watermarks of all tables with one query.
+        '''
+        table = self.get_table()
+        with shared_metrics().timer('db_lookup', table=self.table_name), self.engine.connect() as connection:
+            rows = connection.execute(sqlalchemy.select(table.c.table_name, table.c.tweet_id, table.c.date)).fetchall()
+        with self.lock:
+            self.cache = {row.table_name: {'tweet_id': row.tweet_id, 'date': row.date} for row in rows}
+
+    def get(self, name, column, fallback=None):
+        '''
+        Returns the watermark column ('tweet_id' or 'date') of table name, or
+        None if it has none. If it has none, fallback() is called (when given)
+        and its result is stored as the watermark, or remembered as a miss if
+        it is None.
+        '''
+        with self.lock:
+            if (name, column) in self.seeded:
+                return self.seeded[(name, column)]
+            if self.cache is None:
+                self.load()
+            value = self.cache.get(name, {}).get(column)
+            if value is None and (name, column) in self.misses:
+                return self.record(name, column, None)
+
+        if value is None and fallback is not None:
+            value = fallback()
+            if value is None:
+                with self.lock:
+                    self.misses.add((name, column))
+            else:
+                with self.engine.begin() as connection:
+                    value = self.advance(connection, name, column, value)
+                self.remember(name, column, value)
+        return self.record(name, column, value)
+
+    def record(self, name, column, value):
+        '''
+        Keeps the first value of a watermark read while recording. Returns value.
+        '''
+        with self.lock:
+            if self.recorded is not None:
+                self.recorded.setdefault(name, {}).setdefault(column, value)
+        return value
+
+    def get_tweet_id(self, table_name, fallback=None):
+        return self.get(table_name, 'tweet_id', fallback)
+
+    def get_date(self, table_name, fallback=None):
+        return self.get(table_name, 'date', fallback)
+
+    def advance(self, connection, name, column, value):
+        '''
+        Moves the watermark column of table name forward to value, within the
+        transaction of connection. Watermarks never move backwards: the
+        comparison is part of the UPDATE, so a newer watermark written by
+        another worker or process is never overwritten. Returns the new
+        watermark (value, or the newer one in the table), which should be
+        passed to remember() once the transaction has been committed.
+        '''
+        if isinstance(value, pd.Timestamp):
+            value = value.to_pydatetime()
+        elif hasattr(value, 'item'):
+            value = value.item() # NumPy scalar
+
+        with self.lock:
+            self.misses.discard((name, column))
+            self.seeded.pop((name, column), None)
+
+        table = self.get_table()
+        values = {column: value, 'updated_at': datetime.now()}
+        newer = (table.c.table_name == name) & (table.c[column].is_(None) | (table.c[column] < value))
+        if connection.execute(table.update().where(newer).values(**values)).rowcount > 0:
+            return value
+
+        # Either the watermark is already at or past value, or there is no row yet
+        current = connection.execute(sqlalchemy.select(table.c[column]).where(table.c.table_name == name)).first()
+        if current is not None:
+            return current[0]
+        insert = table.insert().values(table_name=name, **values)
+        insert = insert.prefix_with('OR IGNORE' if connection.dialect.name == 'sqlite' else 'IGNORE')
+        if connection.execute(insert).rowcount == 0:
+            # Another process inserted the row in the meantime
+            return self.advance(connection, name, column, value)
+        return value
+
+    def remember(self, name, column, value):
+        '''
+        Caches a committed watermark, unless the cache already has a newer one.
+        '''
+        with self.lock:
+            self.misses.discard((name, column))
+            if self.cache is not None:
+                watermarks = self.cache.setdefault(name, {})
+                if watermarks.get(column) is None or watermarks[column] < value:
+                    watermarks[column] = value
+
+    def start_recording(self):
+        with self.lock:
+            self.recorded = {}
+
+    def seed(self, watermarks):
+        '''
+        Makes get() return the watermarks of a recording ({name: {column: value}},
+        with dates as strings), until they are advanced.
+        '''
+        with self.lock:
+            for name, columns in watermarks.items():
+                for column, value in columns.items():
+                    if column == 'date' and value is not None:
+                        value = pd.Timestamp(value).to_pydatetime()
+                    self.seeded[(name, column)] = value